@@ -0,0 +1,206 @@
+"""
+Accounts Receivable Aging
+
+This module computes outstanding order balances (order total minus completed
+payments) as of a date, aged by order date into 0-30, 31-60, 61-90 and 90+
+day buckets, per branch and per salesperson.
+
+Each order's balance is netted in SQL: completed payments are summed per
+order in one grouped subquery and joined to the stored order totals (see
+order_accounting.py), so the whole aging is one statement with grouped
+conditional sums, however many orders are outstanding. Buckets are order
+date ranges, which the (branchid, created_at) and (userid, created_at)
+order indexes serve directly in the drilldown.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, case, select
+from extensions import db
+from models import EAT, Branch, Order, Payment, User
+from order_queries import order_items_subquery
+from keyset_pagination import keyset_paginate
+from timezones import eat_day_start, to_eat
+
+
+# (key, label, oldest age in days or None)
+AGING_BUCKETS = (
+    ('current', '0-30 days', 30),
+    ('days_31_60', '31-60 days', 60),
+    ('days_61_90', '61-90 days', 90),
+    ('over_90', '90+ days', None),
+)
+BUCKET_KEYS = tuple(key for key, _, _ in AGING_BUCKETS)
+
+
+@dataclass
+class AgingRow:
+    """Outstanding balances of one branch, salesperson or the whole business"""
+    id: int = None
+    name: str = 'Total'
+    orders: int = 0
+    buckets: dict = field(default_factory=lambda: {key: Decimal('0') for key in BUCKET_KEYS})
+
+    @property
+    def total(self):
+        return sum(self.buckets.values(), Decimal('0'))
+
+    def add(self, orders, amounts):
+        self.orders += orders
+        for key, amount in zip(BUCKET_KEYS, amounts):
+            self.buckets[key] += amount or 0
+
+
+@dataclass
+class ARAging:
+    """Aging summary as of a date"""
+    as_of: object
+    total: AgingRow = field(default_factory=AgingRow)
+    by_branch: list = field(default_factory=list)  # AgingRow, largest balance first
+    by_salesperson: list = field(default_factory=list)  # AgingRow, largest balance first
+
+
+def _bucket_bounds(as_of):
+    """
+    Order date ranges of the aging buckets.
+
+    Returns:
+        dict: {key: (start or None, end)} for `created_at >= start AND created_at < end`
+    """
+    end = eat_day_start(as_of) + timedelta(days=1)
+    bounds = {}
+    for key, _, oldest in AGING_BUCKETS:
+        start = eat_day_start(as_of - timedelta(days=oldest)) if oldest is not None else None
+        bounds[key] = (start, end)
+        end = start
+    return bounds
+
+
+def _bucket_of(created_at, as_of):
+    """SQL CASE giving the bucket key of an order date"""
+    return case(*(
+        (created_at >= start, key)
+        for key, (start, _) in _bucket_bounds(as_of).items() if start is not None
+    ), else_=BUCKET_KEYS[-1])
+
+
+def _balances(as_of, filters=(), order_ids=None):
+    """
+    Per-order total, completed payments and balance as of the end of a date.
+
+    Args:
+        as_of: Date payments and orders are counted up to
+        filters: Extra WHERE clauses on Order
+        order_ids: Optional subquery limiting the orders whose payments are summed
+
+    Returns:
+        tuple: (paid subquery, items subquery, total and balance expressions, WHERE clauses)
+    """
+    day_end = eat_day_start(as_of) + timedelta(days=1)
+    payments = select(
+        Payment.orderid.label('orderid'),
+        func.sum(Payment.amount).label('paid')
+    ).where(Payment.payment_status == 'completed', Payment.created_at < day_end)
+    if order_ids is not None:
+        payments = payments.where(Payment.orderid.in_(order_ids))
+    paid = payments.group_by(Payment.orderid).subquery()
+
+    # Orders without stored totals (not reconciled yet) are totalled from their items
+    items = order_items_subquery(select(Order.id).where(Order.total_amount.is_(None), *filters))
+    total = func.coalesce(Order.total_amount, items.c.total_amount, 0)
+    balance = total - func.coalesce(paid.c.paid, 0)
+    where = [Order.created_at < day_end, balance > 0, *filters]
+    return paid, items, total, balance, where
+
+
+def get_ar_aging(as_of=None, branch_id=None):
+    """
+    Age outstanding order balances per branch and salesperson.
+
+    One grouped statement: orders joined to their completed payment totals,
+    with a conditional sum per bucket, grouped by branch and salesperson.
+
+    Args:
+        as_of: Date to age balances at (defaults to today in EAT)
+        branch_id: Only orders of this branch
+
+    Returns:
+        ARAging
+    """
+    as_of = as_of or datetime.now(EAT).date()
+    filters = [Order.branchid == branch_id] if branch_id else []
+    paid, items, total, balance, where = _balances(as_of, filters)
+    bucket = _bucket_of(Order.created_at, as_of)
+
+    rows = db.session.execute(
+        select(
+            Branch.id, Branch.name, User.id, User.firstname, User.lastname,
+            func.count(Order.id),
+            *(func.coalesce(func.sum(case((bucket == key, balance))), 0) for key in BUCKET_KEYS)
+        ).select_from(Order)
+        .outerjoin(paid, paid.c.orderid == Order.id)
+        .outerjoin(items, items.c.orderid == Order.id)
+        .join(Branch, Order.branchid == Branch.id)
+        .join(User, Order.userid == User.id)
+        .where(*where)
+        .group_by(Branch.id, Branch.name, User.id, User.firstname, User.lastname)
+    )
+
+    aging = ARAging(as_of)
+    branches, salespeople = {}, {}
+    for branch, branch_name, user, firstname, lastname, orders, *amounts in rows:
+        branches.setdefault(branch, AgingRow(branch, branch_name)).add(orders, amounts)
+        salespeople.setdefault(user, AgingRow(user, f"{firstname} {lastname}")).add(orders, amounts)
+        aging.total.add(orders, amounts)
+    aging.by_branch = sorted(branches.values(), key=lambda row: row.total, reverse=True)
+    aging.by_salesperson = sorted(salespeople.values(), key=lambda row: row.total, reverse=True)
+    return aging
+
+
+def get_outstanding_orders(as_of=None, bucket=None, branch_id=None, user_id=None,
+                           after=None, before=None, per_page=20):
+    """
+    Drill down to the outstanding orders behind an aging figure, oldest first.
+
+    The bucket, branch and salesperson are order date and column filters,
+    served by the orders (branchid, created_at) and (userid, created_at)
+    indexes; payments are only summed for the orders in that range.
+
+    Args:
+        as_of: Date to age balances at (defaults to today in EAT)
+        bucket: One of BUCKET_KEYS, or None for all outstanding orders
+        branch_id: Only orders of this branch
+        user_id: Only orders of this salesperson
+        after, before: Keyset cursors (see keyset_pagination.py)
+        per_page: Page size
+
+    Returns:
+        KeysetPage: Rows with Order, order_total, total_paid and balance
+    """
+    as_of = as_of or datetime.now(EAT).date()
+    filters = []
+    if bucket in BUCKET_KEYS:
+        start, end = _bucket_bounds(as_of)[bucket]
+        filters.append(Order.created_at < end)
+        if start is not None:
+            filters.append(Order.created_at >= start)
+    if branch_id:
+        filters.append(Order.branchid == branch_id)
+    if user_id:
+        filters.append(Order.userid == user_id)
+
+    paid, items, total, balance, where = _balances(as_of, filters, select(Order.id).where(*filters))
+    query = db.session.query(
+        Order,
+        total.label('order_total'),
+        func.coalesce(paid.c.paid, 0).label('total_paid'),
+        balance.label('balance')
+    ).outerjoin(paid, paid.c.orderid == Order.id).outerjoin(
+        items, items.c.orderid == Order.id
+    ).filter(*where)
+    page = keyset_paginate(query, (Order.created_at, Order.id), after=after, before=before,
+                           per_page=per_page, descending=False)
+    for row in page.items:
+        row.Order.age_days = (as_of - to_eat(row.Order.created_at).date()).days
+    return page
@@ -0,0 +1,78 @@
+"""
+Branch Directory
+
+This module keeps an immutable in-memory list of the branches (id, name,
+location, image), loaded once per worker, for the branch dropdowns of the
+navigation bar and of the filter forms. Branches change a few times a year
+but are listed on almost every page.
+
+The directory is a report_cache.TableSnapshot of the `branch` table: the
+commits of add_branch, edit_branch and delete_branch bump its version, which
+rebuilds it in this worker and (with REPORT_CACHE_URL set) in all others.
+Templates get it through the `branches` context variable, a proxy that only
+looks the directory up when the template actually iterates it.
+"""
+
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from werkzeug.local import LocalProxy
+from models import Branch
+from report_cache import TableSnapshot
+
+
+@dataclass(frozen=True)
+class BranchEntry:
+    """Read-only copy of a Branch"""
+    id: int
+    name: str
+    location: str = None
+    image_url: str = None
+
+
+@dataclass(frozen=True)
+class BranchDirectory:
+    """Branches by name, with an id lookup"""
+    branches: tuple = ()
+    by_id: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))  # {branch_id: BranchEntry}
+
+    def __iter__(self):
+        return iter(self.branches)
+
+    def __len__(self):
+        return len(self.branches)
+
+    def __getitem__(self, index):
+        return self.branches[index]
+
+    def get(self, branch_id):
+        return self.by_id.get(branch_id)
+
+    def name(self, branch_id, default=''):
+        branch = self.by_id.get(branch_id)
+        return branch.name if branch else default
+
+
+def build_branch_directory():
+    """Load the branches in one query"""
+    branches = tuple(
+        BranchEntry(branch.id, branch.name, branch.location, branch.image_url)
+        for branch in Branch.query.order_by(Branch.name, Branch.id)
+    )
+    return BranchDirectory(branches, MappingProxyType({branch.id: branch for branch in branches}))
+
+
+_snapshot = TableSnapshot('branch_directory', (Branch,), build_branch_directory, BranchDirectory())
+
+
+def get_branch_directory():
+    """
+    Current branch directory, rebuilt only after branch writes.
+
+    Returns:
+        BranchDirectory: Iterable of BranchEntry, by name
+    """
+    return _snapshot.get()
+
+
+# For templates (see inject_branches in main.py); loaded on first use
+branch_directory = LocalProxy(get_branch_directory)
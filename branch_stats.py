@@ -0,0 +1,77 @@
+"""
+Branch Statistics
+
+This module computes per-branch figures (product count, order count, asset
+value, revenue and pending orders) for any number of branches with a fixed
+number of grouped queries, so pages listing branches don't issue one query
+per branch.
+"""
+
+from dataclasses import dataclass, asdict
+from sqlalchemy import func, select
+from extensions import db
+from models import BranchProduct, Order, Payment
+from dashboard_stats import count_if, sum_if, has_asset_value
+
+
+@dataclass
+class BranchStats:
+    """Figures for a single branch"""
+    products: int = 0
+    orders: int = 0
+    pending_orders: int = 0
+    asset_value: float = 0
+    revenue: float = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def get_branch_stats(branch_ids):
+    """
+    Compute statistics for the given branches in three grouped queries.
+
+    Revenue is the sum of completed payments, matching the sales report.
+
+    Args:
+        branch_ids: Iterable of branch IDs
+
+    Returns:
+        dict: {branch_id: BranchStats}, with an entry for every requested branch
+    """
+    branch_ids = list(branch_ids)
+    stats = {branch_id: BranchStats() for branch_id in branch_ids}
+    if not branch_ids:
+        return stats
+
+    for branch_id, products, asset_value in db.session.execute(
+        select(
+            BranchProduct.branchid,
+            func.count(BranchProduct.id),
+            sum_if(has_asset_value(), BranchProduct.buyingprice * BranchProduct.stock)
+        ).where(BranchProduct.branchid.in_(branch_ids))
+        .group_by(BranchProduct.branchid)
+    ):
+        stats[branch_id].products = products
+        stats[branch_id].asset_value = asset_value
+
+    for branch_id, orders, pending in db.session.execute(
+        select(
+            Order.branchid,
+            func.count(Order.id),
+            count_if(Order.approvalstatus == False)
+        ).where(Order.branchid.in_(branch_ids))
+        .group_by(Order.branchid)
+    ):
+        stats[branch_id].orders = orders
+        stats[branch_id].pending_orders = pending
+
+    for branch_id, revenue in db.session.execute(
+        select(Order.branchid, func.coalesce(func.sum(Payment.amount), 0))
+        .join(Payment, Order.id == Payment.orderid)
+        .where(Order.branchid.in_(branch_ids), Payment.payment_status == 'completed')
+        .group_by(Order.branchid)
+    ):
+        stats[branch_id].revenue = revenue
+
+    return stats
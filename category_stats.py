@@ -0,0 +1,159 @@
+"""
+Category Statistics
+
+This module computes catalog product counts and sales revenue per category
+and subcategory in a single ROLLUP query, shared by the categories list and
+the category and subcategory detail pages.
+
+Revenue follows the current order structure: OrderItem -> BranchProduct ->
+ProductCatalog -> SubCategory -> Category (OrderItem.productid is a legacy
+column that current orders leave empty). Items count when their order is
+paid or partially paid, optionally within a date range of order dates.
+
+Results are cached per date range (see report_cache.cached_result) and
+invalidated by writes to any of the tables read.
+"""
+
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+from sqlalchemy import func, select
+from extensions import db
+from models import Branch, BranchProduct, Category, Order, OrderItem, ProductCatalog, SubCategory
+from report_cache import cached_result
+from timezones import eat_day_start
+
+PAID_ORDER_STATUSES = ('paid', 'partially_paid')
+
+
+@dataclass
+class CategoryStats:
+    """Figures of one category, subcategory or the whole catalog"""
+    products: int = 0
+    quantity: Decimal = Decimal('0')
+    revenue: Decimal = Decimal('0')
+
+    def add(self, products, quantity, revenue):
+        self.products += products or 0
+        self.quantity += quantity or 0
+        self.revenue += revenue or 0
+
+
+@dataclass
+class CategoryAnalytics:
+    """ROLLUP(category, subcategory) of catalog products and revenue"""
+    total: CategoryStats = field(default_factory=CategoryStats)
+    categories: dict = field(default_factory=dict)  # {category_id: CategoryStats}
+    subcategories: dict = field(default_factory=dict)  # {subcategory_id: CategoryStats}
+
+    def category(self, category_id):
+        return self.categories.get(category_id) or CategoryStats()
+
+    def subcategory(self, subcategory_id):
+        return self.subcategories.get(subcategory_id) or CategoryStats()
+
+
+def _sales_by_product(start_date=None, end_date=None):
+    """
+    Quantity sold and revenue per catalog product, through the branch products.
+
+    Returns:
+        Subquery: (catalog_id, quantity, revenue)
+    """
+    query = select(
+        BranchProduct.catalog_id.label('catalog_id'),
+        func.sum(OrderItem.quantity).label('quantity'),
+        func.sum(OrderItem.quantity * OrderItem.final_price).label('revenue')
+    ).select_from(OrderItem).join(
+        BranchProduct, OrderItem.branch_productid == BranchProduct.id
+    ).join(
+        Order, OrderItem.orderid == Order.id
+    ).where(
+        Order.payment_status.in_(PAID_ORDER_STATUSES),
+        OrderItem.final_price.isnot(None)
+    )
+    if start_date:
+        query = query.where(Order.created_at >= eat_day_start(start_date))
+    if end_date:
+        query = query.where(Order.created_at < eat_day_start(end_date) + timedelta(days=1))
+    return query.group_by(BranchProduct.catalog_id).subquery()
+
+
+def _compute_category_stats(start_date, end_date):
+    sales = _sales_by_product(start_date, end_date)
+    figures = (
+        func.count(ProductCatalog.id),
+        func.coalesce(func.sum(sales.c.quantity), 0),
+        func.coalesce(func.sum(sales.c.revenue), 0)
+    )
+    query = select().select_from(Category).outerjoin(
+        SubCategory, SubCategory.category_id == Category.id
+    ).outerjoin(
+        ProductCatalog, ProductCatalog.subcategory_id == SubCategory.id
+    ).outerjoin(
+        sales, sales.c.catalog_id == ProductCatalog.id
+    )
+
+    analytics = CategoryAnalytics()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        for category_grouped, subcategory_grouped, category_id, subcategory_id, *row in db.session.execute(
+            query.with_only_columns(
+                func.grouping(Category.id), func.grouping(SubCategory.id),
+                Category.id, SubCategory.id, *figures
+            ).group_by(func.rollup(Category.id, SubCategory.id))
+        ):
+            if category_grouped:
+                analytics.total.add(*row)
+            elif subcategory_grouped:
+                analytics.categories.setdefault(category_id, CategoryStats()).add(*row)
+            elif subcategory_id is not None:
+                analytics.subcategories.setdefault(subcategory_id, CategoryStats()).add(*row)
+    else:
+        # Databases without ROLLUP: sum the detail rows up in Python
+        for category_id, subcategory_id, *row in db.session.execute(
+            query.with_only_columns(Category.id, SubCategory.id, *figures)
+            .group_by(Category.id, SubCategory.id)
+        ):
+            analytics.total.add(*row)
+            analytics.categories.setdefault(category_id, CategoryStats()).add(*row)
+            if subcategory_id is not None:
+                analytics.subcategories.setdefault(subcategory_id, CategoryStats()).add(*row)
+    return analytics
+
+
+def get_category_stats(start_date=None, end_date=None):
+    """
+    Product counts and revenue of every category and subcategory.
+
+    Args:
+        start_date: First order date counted (inclusive, EAT), or None
+        end_date: Last order date counted (inclusive, EAT), or None
+
+    Returns:
+        CategoryAnalytics
+    """
+    return cached_result(
+        'category_stats',
+        (Category, SubCategory, ProductCatalog, BranchProduct, Order, OrderItem),
+        _compute_category_stats, start_date, end_date
+    )
+
+
+def get_branch_product_counts(subcategory_ids):
+    """
+    Branch products per branch for the catalog products of some subcategories.
+
+    Returns:
+        list: (branch name, product count) tuples, by branch name
+    """
+    if not subcategory_ids:
+        return []
+    return db.session.execute(
+        select(Branch.name, func.count(BranchProduct.id))
+        .select_from(BranchProduct)
+        .join(ProductCatalog, BranchProduct.catalog_id == ProductCatalog.id)
+        .join(Branch, BranchProduct.branchid == Branch.id)
+        .where(ProductCatalog.subcategory_id.in_(subcategory_ids))
+        .group_by(Branch.id, Branch.name)
+        .order_by(Branch.name)
+    ).all()
@@ -0,0 +1,104 @@
+"""
+Category Tree
+
+This module keeps an immutable in-memory copy of the category hierarchy
+(categories, subcategories and their id -> name maps), built once per
+worker and shared by every request, so routes and templates listing or
+naming categories don't query them each time.
+
+The tree is rebuilt when a category or subcategory write commits: it is a
+report_cache.TableSnapshot of the `category` and `sub_category` tables,
+whose versions are bumped on commit and, with REPORT_CACHE_URL set, shared
+by all workers.
+
+Usage:
+    tree = get_category_tree()
+    tree.categories, tree.subcategories            # Sorted by name
+    tree.category_name(subcategory_id)             # Via the subcategory
+    {{ category_tree.subcategory_names[id] }}      # In templates
+"""
+
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from werkzeug.local import LocalProxy
+from models import Category, SubCategory
+from report_cache import TableSnapshot
+
+
+@dataclass(frozen=True)
+class CategoryNode:
+    """Read-only copy of a Category"""
+    id: int
+    name: str
+    description: str = None
+    image_url: str = None
+
+
+@dataclass(frozen=True)
+class SubCategoryNode:
+    """Read-only copy of a SubCategory, with its category"""
+    id: int
+    name: str
+    category_id: int
+    category: CategoryNode = None
+    description: str = None
+    image_url: str = None
+
+
+@dataclass(frozen=True)
+class CategoryTree:
+    """Snapshot of the category hierarchy"""
+    categories: tuple = ()  # CategoryNode, by name
+    subcategories: tuple = ()  # SubCategoryNode, by name
+    category_names: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))  # {category_id: name}
+    subcategory_names: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))  # {subcategory_id: name}
+    subcategory_category: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))  # {subcategory_id: category_id}
+
+    def subcategories_of(self, category_id):
+        """Subcategories of a category, by name"""
+        return tuple(sub for sub in self.subcategories if sub.category_id == category_id)
+
+    def subcategory_ids(self, category_id):
+        return [sub.id for sub in self.subcategories if sub.category_id == category_id]
+
+    def category_name(self, subcategory_id, default=''):
+        """Name of the category a subcategory belongs to"""
+        return self.category_names.get(self.subcategory_category.get(subcategory_id), default)
+
+
+def build_category_tree():
+    """Load the hierarchy in two queries"""
+    categories = tuple(
+        CategoryNode(category.id, category.name, category.description, category.image_url)
+        for category in Category.query.order_by(Category.name, Category.id)
+    )
+    by_id = {category.id: category for category in categories}
+    subcategories = tuple(
+        SubCategoryNode(sub.id, sub.name, sub.category_id, by_id.get(sub.category_id),
+                        sub.description, sub.image_url)
+        for sub in SubCategory.query.order_by(SubCategory.name, SubCategory.id)
+    )
+    return CategoryTree(
+        categories=categories,
+        subcategories=subcategories,
+        category_names=MappingProxyType({category.id: category.name for category in categories}),
+        subcategory_names=MappingProxyType({sub.id: sub.name for sub in subcategories}),
+        subcategory_category=MappingProxyType({sub.id: sub.category_id for sub in subcategories}),
+    )
+
+
+_snapshot = TableSnapshot('category_tree', ('category', 'sub_category'), build_category_tree, CategoryTree())
+
+
+def get_category_tree():
+    """
+    Current category tree, rebuilt only after category writes.
+
+    Returns:
+        CategoryTree
+    """
+    return _snapshot.get()
+
+
+# For templates (see inject_category_tree in main.py); built on first use
+category_tree = LocalProxy(get_category_tree)
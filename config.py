@@ -26,4 +26,48 @@ class Config:
     SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
-    PERMANENT_SESSION_LIFETIME = timedelta(hours=24)  # 24 hour session lifetime 
\ No newline at end of file
+    PERMANENT_SESSION_LIFETIME = timedelta(hours=24)  # 24 hour session lifetime
+    
+    # Dashboard snapshot: not served when its last full rebuild is older than this.
+    # Run `flask rebuild-dashboard-snapshot` from cron (e.g. every 15 minutes) to pick
+    # up writes made outside this app
+    DASHBOARD_SNAPSHOT_MAX_AGE = timedelta(hours=1)
+    
+    # Daily sales rollup: days recomputed by `flask refresh-daily-sales-rollup`
+    # (run from cron, e.g. every 5 minutes) to pick up payments written outside this app
+    SALES_ROLLUP_RECENT_DAYS = 2
+    
+    # Report cache (see report_cache.py); REPORT_CACHE_URL is a Redis URL shared by all workers
+    REPORT_CACHE_ENABLED = os.environ.get('REPORT_CACHE_ENABLED', 'true').lower() == 'true'
+    REPORT_CACHE_URL = os.environ.get('REPORT_CACHE_URL')
+    REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 120))  # seconds
+    REPORT_CACHE_MAX_ENTRIES = 256
+    
+    # Logged-in user identity cache (see identity_cache.py); 0 disables it
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))  # seconds
+    
+    # Tracing (see tracing.py): default level, per-tracer levels ("name=level,...")
+    # and the fraction of requests whose debug/info records are emitted
+    TRACE_LEVEL = os.environ.get('TRACE_LEVEL', 'info')
+    TRACE_MODULES = os.environ.get('TRACE_MODULES', '')
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+    
+    # Per-request SQL statistics (see query_stats.py): executions of one statement
+    # in a request flagged as N+1, slowest statements kept, X-Query-Stats header
+    # outside debug mode
+    QUERY_STATS_ENABLED = os.environ.get('QUERY_STATS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    QUERY_STATS_N_PLUS_ONE = int(os.environ.get('QUERY_STATS_N_PLUS_ONE', 10))
+    QUERY_STATS_SLOWEST = int(os.environ.get('QUERY_STATS_SLOWEST', 5))
+    QUERY_STATS_HEADER = os.environ.get('QUERY_STATS_HEADER', 'false').lower() in ['true', 'on', '1']
+    
+    # Prometheus metrics at /metrics (see metrics.py). METRICS_DIR is a directory
+    # shared by the uWSGI workers to merge their metrics.
+    # /metrics answers 404 unless the scraper sends METRICS_TOKEN as
+    # "Authorization: Bearer <token>" or connects from an address in
+    # METRICS_ALLOWED_IPS (comma-separated). Behind a reverse proxy the address
+    # is the proxy's, so only allowlist scrapers that reach uWSGI directly
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 15))  # seconds
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
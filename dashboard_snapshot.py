@@ -0,0 +1,409 @@
+"""
+Dashboard Snapshot
+
+This module maintains the `dashboard_snapshot` table: one row per branch plus
+a global row (branch_id NULL) holding the expensive dashboard figures, so the
+dashboard reads a single row instead of scanning the orderitems/payments join
+on every load.
+
+- Writes in this app adjust the rows incrementally: the figures of the
+  orders, branch products and expenses a flush touches are computed before
+  and after it, and the difference is added to their branch rows and to the
+  global row (`x = x + delta`), so concurrent writers never overwrite each
+  other.
+- Rows are unique per COALESCE(branch_id, 0) and written with
+  INSERT ... ON CONFLICT DO UPDATE. On PostgreSQL full rebuilds take an
+  exclusive advisory lock and incremental updates a shared one, so they
+  never interleave.
+- Writes made outside this app (e.g. the cashier portal) are picked up by the
+  full rebuild of `flask rebuild-dashboard-snapshot`, which should run from
+  cron more often than DASHBOARD_SNAPSHOT_MAX_AGE. Readers never rebuild:
+  a snapshot of a previous month or older than that is not served, and the
+  dashboard computes its figures live instead.
+"""
+
+from datetime import datetime
+from sqlalchemy import event, func, inspect, literal_column, select
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+from config import Config
+from models import (
+    EAT, DashboardSnapshot, BranchProduct, Order, OrderItem, Payment, Expense
+)
+from dashboard_stats import count_if, sum_if, has_asset_value, dashboard_periods
+from report_cache import record_table_writes
+from timezones import eat_day_start
+
+
+SNAPSHOT_FIELDS = (
+    'total_revenue', 'monthly_revenue', 'total_profit', 'monthly_profit',
+    'total_cogs', 'monthly_cogs', 'product_asset_value', 'low_stock_count',
+    'pending_orders', 'total_expense_amount', 'monthly_expenses'
+)
+
+# Columns whose change affects the snapshot; None means any column
+_WATCHED_COLUMNS = {
+    Payment: None,
+    OrderItem: ('quantity', 'final_price', 'buying_price', 'orderid'),
+    BranchProduct: ('buyingprice', 'stock', 'branchid'),
+    Expense: ('amount', 'status', 'expense_date', 'branch_id'),
+    Order: ('approvalstatus', 'branchid'),
+}
+
+# pg_advisory_xact_lock key serializing rebuilds with incremental updates
+_LOCK_KEY = 0x64617368  # 'dash'
+
+
+def _empty_figures():
+    return dict.fromkeys(SNAPSHOT_FIELDS, 0)
+
+
+def _branch_figures(connection, this_month, orders=None, products=None, expenses=None):
+    """
+    Compute snapshot figures grouped by branch.
+
+    Args:
+        connection: Connection (or session) to run the queries on
+        this_month: First day of the current month
+        orders: Filter on Order for the payment, item and pending figures
+        products: Filter on BranchProduct for the stock figures
+        expenses: Filter on Expense for the expense figures (expenses without
+            a branch are grouped under None)
+
+    A group of figures whose filter is None is not computed.
+
+    Returns:
+        dict: {branch_id: {field: value}}
+    """
+    figures = {}
+
+    def row_for(branch_id):
+        return figures.setdefault(branch_id, _empty_figures())
+
+    completed = Payment.payment_status == 'completed'
+    this_month_payment = Payment.created_at >= eat_day_start(this_month)
+
+    if orders is not None:
+        for branch_id, total, monthly in connection.execute(
+            select(
+                Order.branchid,
+                func.coalesce(func.sum(Payment.amount), 0),
+                sum_if(this_month_payment, Payment.amount)
+            ).select_from(Payment).join(Order, Payment.orderid == Order.id)
+            .where(completed, orders)
+            .group_by(Order.branchid)
+        ):
+            row = row_for(branch_id)
+            row['total_revenue'], row['monthly_revenue'] = total, monthly
+
+        # Items are joined to each completed payment of their order, same as the
+        # live dashboard computation in dashboard_stats._sales_kpis
+        item_profit = (OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity
+        item_cost = OrderItem.buying_price * OrderItem.quantity
+        for branch_id, profit, cogs, monthly_profit, monthly_cogs in connection.execute(
+            select(
+                Order.branchid,
+                func.coalesce(func.sum(item_profit), 0),
+                func.coalesce(func.sum(item_cost), 0),
+                sum_if(this_month_payment, item_profit),
+                sum_if(this_month_payment, item_cost)
+            ).select_from(OrderItem)
+            .join(Payment, OrderItem.orderid == Payment.orderid)
+            .join(Order, OrderItem.orderid == Order.id)
+            .where(completed, orders)
+            .group_by(Order.branchid)
+        ):
+            row = row_for(branch_id)
+            row['total_profit'], row['total_cogs'] = profit, cogs
+            row['monthly_profit'], row['monthly_cogs'] = monthly_profit, monthly_cogs
+
+        for branch_id, pending in connection.execute(
+            select(Order.branchid, count_if(Order.approvalstatus == False))
+            .where(orders)
+            .group_by(Order.branchid)
+        ):
+            row_for(branch_id)['pending_orders'] = pending
+
+    if products is not None:
+        for branch_id, asset_value, low_stock in connection.execute(
+            select(
+                BranchProduct.branchid,
+                sum_if(has_asset_value(), BranchProduct.buyingprice * BranchProduct.stock),
+                count_if(BranchProduct.stock < 10)
+            ).where(products)
+            .group_by(BranchProduct.branchid)
+        ):
+            row = row_for(branch_id)
+            row['product_asset_value'], row['low_stock_count'] = asset_value, low_stock
+
+    if expenses is not None:
+        approved = Expense.status == 'approved'
+        for branch_id, total, monthly in connection.execute(
+            select(
+                Expense.branch_id,
+                sum_if(approved, Expense.amount),
+                sum_if(approved & (Expense.expense_date >= this_month), Expense.amount)
+            ).where(expenses)
+            .group_by(Expense.branch_id)
+        ):
+            row = row_for(branch_id)
+            row['total_expense_amount'], row['monthly_expenses'] = total, monthly
+    return figures
+
+
+def _totals(figures):
+    """Sum of {key: {field: value}} over the keys"""
+    totals = _empty_figures()
+    for values in figures.values():
+        for field in SNAPSHOT_FIELDS:
+            totals[field] += values[field] or 0
+    return totals
+
+
+def _naive(moment):
+    """EAT wall-clock time without tzinfo, as stored in the snapshot table"""
+    return moment.astimezone(EAT).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def _dialect(connection):
+    bind = getattr(connection, 'dialect', None)
+    return bind.name if bind is not None else connection.get_bind().dialect.name
+
+
+def _lock(connection, shared=False):
+    """Take the snapshot advisory lock until the end of the transaction (PostgreSQL)"""
+    if _dialect(connection) == 'postgresql':
+        lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+        connection.execute(select(lock(_LOCK_KEY)))
+
+
+def _write_row(connection, branch_id, period_start, values, add=False, rebuilt_at=None):
+    """
+    Insert or update the snapshot row of branch_id in one statement.
+
+    Args:
+        add: Add values to the stored figures instead of replacing them
+    """
+    snapshot = DashboardSnapshot.__table__
+    values = dict(values, period_start=period_start, updated_at=_naive(datetime.now(EAT)))
+    if rebuilt_at is not None:
+        values['rebuilt_at'] = _naive(rebuilt_at)
+
+    dialect = _dialect(connection)
+    if dialect not in ('postgresql', 'sqlite'):
+        # No upsert: update, then insert when missing
+        match = snapshot.c.branch_id.is_(None) if branch_id is None else snapshot.c.branch_id == branch_id
+        changes = {field: snapshot.c[field] + value for field, value in values.items()
+                   if field in SNAPSHOT_FIELDS} if add else {}
+        result = connection.execute(snapshot.update().where(match).values(**dict(values, **changes)))
+        if result.rowcount == 0:
+            connection.execute(snapshot.insert().values(branch_id=branch_id, **values))
+        return
+
+    insert = (postgresql if dialect == 'postgresql' else sqlite).insert(snapshot).values(branch_id=branch_id, **values)
+    changes = {
+        field: (snapshot.c[field] + insert.excluded[field]) if add and field in SNAPSHOT_FIELDS
+        else insert.excluded[field]
+        for field in values
+    }
+    connection.execute(insert.on_conflict_do_update(
+        index_elements=[func.coalesce(snapshot.c.branch_id, literal_column('0'))],
+        set_=changes
+    ))
+
+
+def rebuild_dashboard_snapshot(connection=None, now=None):
+    """
+    Recompute every snapshot row from scratch.
+
+    Args:
+        connection: Connection to use (defaults to the current session)
+        now: Reference time (defaults to the current time in EAT)
+
+    Returns:
+        int: Number of rows written, including the global row
+    """
+    connection = connection if connection is not None else db.session
+    now = now or datetime.now(EAT)
+    _, this_month = dashboard_periods(now)
+    _lock(connection)
+
+    figures = _branch_figures(connection, this_month, orders=Order.id.isnot(None),
+                              products=BranchProduct.id.isnot(None), expenses=Expense.id.isnot(None))
+    totals = _totals(figures)  # Includes the expenses without a branch
+    figures.pop(None, None)
+
+    snapshot = DashboardSnapshot.__table__
+    connection.execute(snapshot.delete().where(
+        snapshot.c.branch_id.isnot(None), snapshot.c.branch_id.notin_(sorted(figures) or [0])
+    ))
+    for branch_id, values in sorted(figures.items()):
+        _write_row(connection, branch_id, this_month, values, rebuilt_at=now)
+    _write_row(connection, None, this_month, totals, rebuilt_at=now)
+    record_table_writes(db.session, {DashboardSnapshot.__tablename__})
+    return len(figures) + 1
+
+
+def apply_dashboard_deltas(connection, deltas, this_month):
+    """
+    Add figure changes to the branch rows and to the global row.
+
+    Args:
+        deltas: {branch_id: {field: change}}; None is the global-only key of
+            expenses without a branch
+        this_month: Month the changes were computed for
+
+    Returns:
+        bool: False when the snapshot refers to another month (nothing applied;
+            the next rebuild starts the new month)
+    """
+    _lock(connection, shared=True)
+    snapshot = DashboardSnapshot.__table__
+    period_start = connection.execute(
+        select(snapshot.c.period_start).where(snapshot.c.branch_id.is_(None))
+    ).scalar()
+    if period_start != this_month:
+        return False
+
+    for branch_id, values in sorted((key, values) for key, values in deltas.items() if key is not None):
+        _write_row(connection, branch_id, this_month, values, add=True)
+    _write_row(connection, None, this_month, _totals(deltas), add=True)
+    return True
+
+
+# --- Maintenance on write -------------------------------------------------
+
+def _changed(obj, columns):
+    """True when any watched column of a dirty object has pending changes"""
+    state = inspect(obj)
+    names = columns or [attr.key for attr in state.mapper.column_attrs]
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _ids(obj, column):
+    """Current and previous value of a column (a move touches both)"""
+    state = inspect(obj)
+    # Objects expired by an earlier commit hold no values until loaded
+    current = getattr(obj, column) if state.persistent else state.dict.get(column)
+    values = {current} | set(state.attrs[column].history.deleted or ())
+    values.discard(None)
+    return values
+
+
+def _touched_scope(session):
+    """
+    Collect the orders, branch products and expenses whose figures the
+    objects of this flush change.
+
+    Returns:
+        tuple: (order ids, branch product ids, expense ids)
+    """
+    order_ids, product_ids, expense_ids = set(), set(), set()
+
+    touched = [(obj, False) for obj in session.new] + [(obj, False) for obj in session.deleted]
+    touched += [(obj, True) for obj in session.dirty]
+    for obj, dirty in touched:
+        model = type(obj)
+        if model not in _WATCHED_COLUMNS:
+            continue
+        if dirty and not _changed(obj, _WATCHED_COLUMNS[model]):
+            continue
+
+        if model is Order:
+            order_ids |= _ids(obj, 'id')
+        elif model is BranchProduct:
+            product_ids |= _ids(obj, 'id')
+        elif model is Expense:
+            expense_ids |= _ids(obj, 'id')
+        else:
+            order_ids |= _ids(obj, 'orderid')
+            # Before the flush a new payment or item may only reference its order object
+            order = inspect(obj).dict.get('order')
+            if order is not None and order.id is not None:
+                order_ids.add(order.id)
+    return order_ids, product_ids, expense_ids
+
+
+def _scoped_figures(connection, this_month, scope):
+    order_ids, product_ids, expense_ids = scope
+    return _branch_figures(
+        connection, this_month,
+        orders=Order.id.in_(sorted(order_ids)) if order_ids else None,
+        products=BranchProduct.id.in_(sorted(product_ids)) if product_ids else None,
+        expenses=Expense.id.in_(sorted(expense_ids)) if expense_ids else None
+    )
+
+
+def _before_flush(session, flush_context, instances):
+    """Figures of the touched rows as they are before this flush"""
+    try:
+        scope = _touched_scope(session)
+        # New rows have no ids yet but still need the after_flush pass
+        if any(scope) or any(type(obj) in _WATCHED_COLUMNS for obj in session.new):
+            _, this_month = dashboard_periods()
+            # Run in a savepoint so a snapshot failure never aborts the caller's write
+            connection = session.connection()
+            with connection.begin_nested():
+                before_figures = _scoped_figures(connection, this_month, scope)
+            session.info['dashboard_snapshot_before'] = (scope, this_month, before_figures)
+    except Exception as e:
+        print(f"⚠️ Dashboard snapshot refresh failed: {e}")
+
+
+def _after_flush(session, flush_context):
+    """Add the difference the flush made to the touched rows' figures"""
+    before = session.info.pop('dashboard_snapshot_before', None)
+    if before is None:
+        return
+    scope, this_month, before_figures = before
+    try:
+        # New rows now have ids; their figures before the flush were zero
+        scope = tuple(ids | new_ids for ids, new_ids in zip(scope, _touched_scope(session)))
+
+        # Run in a savepoint so a snapshot failure never aborts the caller's write
+        connection = session.connection()
+        with connection.begin_nested():
+            after_figures = _scoped_figures(connection, this_month, scope)
+            deltas = {}
+            for branch_id in set(before_figures) | set(after_figures):
+                after = after_figures.get(branch_id) or _empty_figures()
+                prior = before_figures.get(branch_id) or _empty_figures()
+                change = {field: (after[field] or 0) - (prior[field] or 0) for field in SNAPSHOT_FIELDS}
+                if any(change.values()):
+                    deltas[branch_id] = change
+            if deltas and apply_dashboard_deltas(connection, deltas, this_month):
+                record_table_writes(session, {DashboardSnapshot.__tablename__})
+    except Exception as e:
+        print(f"⚠️ Dashboard snapshot refresh failed: {e}")
+
+
+event.listen(db.session, 'before_flush', _before_flush)
+event.listen(db.session, 'after_flush', _after_flush)
+
+
+def get_dashboard_snapshot(now=None):
+    """
+    Get the global snapshot row when it can be served.
+
+    Nothing is rebuilt here (see `flask rebuild-dashboard-snapshot`); a
+    missing row, a row of a previous month or one whose last full rebuild is
+    older than DASHBOARD_SNAPSHOT_MAX_AGE gives None, so the dashboard
+    computes its figures live.
+
+    Returns:
+        DashboardSnapshot: Global row, or None
+    """
+    now = now or datetime.now(EAT)
+    _, this_month = dashboard_periods(now)
+    try:
+        row = DashboardSnapshot.query.filter(DashboardSnapshot.branch_id.is_(None)).first()
+        if (row is None
+                or row.period_start != this_month
+                or row.rebuilt_at is None
+                or row.rebuilt_at < _naive(now) - Config.DASHBOARD_SNAPSHOT_MAX_AGE):
+            return None
+        return row
+    except Exception as e:
+        print(f"Error getting dashboard snapshot: {e}")
+        db.session.rollback()
+        return None
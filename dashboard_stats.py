@@ -0,0 +1,217 @@
+"""
+Dashboard Statistics
+
+This module computes the admin dashboard KPIs with a handful of consolidated
+queries (one per table, using conditional aggregates) instead of one
+COUNT/SUM round-trip per figure. The queries are independent, so they run
+concurrently (see query_fanout.py).
+"""
+
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, and_, or_, select
+from query_fanout import QueryFanout
+from models import EAT, User, Branch, BranchProduct, Order, OrderItem, Payment, Expense
+from timezones import eat_day_start
+
+
+@dataclass
+class DashboardStats:
+    """All scalar KPIs shown on the dashboard (index.html)"""
+    total_users: int = 0
+    total_products: int = 0
+    total_orders: int = 0
+    total_branches: int = 0
+    recent_orders: int = 0
+    pending_orders: int = 0
+    low_stock_products: int = 0
+    total_product_asset: float = 0
+    products_with_assets: int = 0
+    products_without_buying_price: int = 0
+    products_with_zero_stock: int = 0
+    total_revenue: float = 0
+    monthly_revenue: float = 0
+    total_profit: float = 0
+    monthly_profit: float = 0
+    total_cogs: float = 0
+    monthly_cogs: float = 0
+    total_expenses: int = 0
+    pending_expenses: int = 0
+    approved_expenses: int = 0
+    total_expense_amount: float = 0
+    monthly_expenses: float = 0
+
+    @property
+    def avg_asset_per_product(self):
+        """Average asset value per product, excluding products without assets"""
+        if self.products_with_assets > 0:
+            return self.total_product_asset / self.products_with_assets
+        return 0
+
+    def as_dict(self):
+        """Return the KPIs as template keyword arguments"""
+        data = asdict(self)
+        data['avg_asset_per_product'] = self.avg_asset_per_product
+        return data
+
+
+def has_asset_value():
+    """Filter for branch products that carry inventory value (priced and in stock)"""
+    return and_(
+        BranchProduct.buyingprice.isnot(None),
+        BranchProduct.buyingprice > 0,
+        BranchProduct.stock.isnot(None),
+        BranchProduct.stock > 0
+    )
+
+
+def count_if(condition):
+    """COUNT of rows matching condition, usable inside a grouped select"""
+    return func.count(case((condition, 1)))
+
+
+def sum_if(condition, value):
+    """SUM of value over rows matching condition, 0 when nothing matches"""
+    return func.coalesce(func.sum(case((condition, value))), 0)
+
+
+def dashboard_periods(now=None):
+    """
+    Get the reference dates used by the dashboard.
+
+    Returns:
+        tuple: (today, this_month) as dates in EAT
+    """
+    now = now or datetime.now(EAT)
+    return now.date(), now.replace(day=1).date()
+
+
+def _order_kpis(today):
+    """Users, branches and orders counts in one statement"""
+    return select(
+        func.count(Order.id),
+        count_if(Order.created_at >= eat_day_start(today - timedelta(days=7))),
+        count_if(Order.approvalstatus == False),
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.count(Branch.id)).scalar_subquery()
+    ).select_from(Order), (
+        'total_orders', 'recent_orders', 'pending_orders', 'total_users', 'total_branches'
+    )
+
+
+def _product_kpis():
+    """Branch product counts, asset value and stock levels in one pass"""
+    return select(
+        func.count(BranchProduct.id),
+        count_if(has_asset_value()),
+        sum_if(has_asset_value(), BranchProduct.buyingprice * BranchProduct.stock),
+        count_if(or_(BranchProduct.buyingprice.is_(None), BranchProduct.buyingprice == 0)),
+        count_if(or_(BranchProduct.stock.is_(None), BranchProduct.stock == 0)),
+        count_if(BranchProduct.stock < 10)
+    ), (
+        'total_products', 'products_with_assets', 'total_product_asset',
+        'products_without_buying_price', 'products_with_zero_stock', 'low_stock_products'
+    )
+
+
+def _revenue_kpis(this_month):
+    """Revenue from completed payments"""
+    return select(
+        func.coalesce(func.sum(Payment.amount), 0),
+        sum_if(Payment.created_at >= eat_day_start(this_month), Payment.amount)
+    ).where(Payment.payment_status == 'completed'), (
+        'total_revenue', 'monthly_revenue'
+    )
+
+
+def _profit_kpis(this_month):
+    """Profit/COGS of the order items behind completed payments"""
+    # Rows are order items joined to each completed payment of their order,
+    # so an order paid in several instalments is counted once per payment
+    # (same semantics the dashboard has always used).
+    this_month_payment = Payment.created_at >= eat_day_start(this_month)
+    item_profit = (OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity
+    item_cost = OrderItem.buying_price * OrderItem.quantity
+    return select(
+        func.coalesce(func.sum(item_profit), 0),
+        func.coalesce(func.sum(item_cost), 0),
+        sum_if(this_month_payment, item_profit),
+        sum_if(this_month_payment, item_cost)
+    ).select_from(OrderItem).join(
+        Payment, OrderItem.orderid == Payment.orderid
+    ).where(Payment.payment_status == 'completed'), (
+        'total_profit', 'total_cogs', 'monthly_profit', 'monthly_cogs'
+    )
+
+
+def _expense_kpis(this_month):
+    """Expense counts and approved totals in one pass"""
+    approved = Expense.status == 'approved'
+    return select(
+        func.count(Expense.id),
+        count_if(Expense.status == 'pending'),
+        count_if(approved),
+        sum_if(approved, Expense.amount),
+        sum_if(and_(approved, Expense.expense_date >= this_month), Expense.amount)
+    ), (
+        'total_expenses', 'pending_expenses', 'approved_expenses',
+        'total_expense_amount', 'monthly_expenses'
+    )
+
+
+# DashboardStats field -> DashboardSnapshot column
+SNAPSHOT_STATS = {
+    'total_revenue': 'total_revenue',
+    'monthly_revenue': 'monthly_revenue',
+    'total_profit': 'total_profit',
+    'monthly_profit': 'monthly_profit',
+    'total_cogs': 'total_cogs',
+    'monthly_cogs': 'monthly_cogs',
+    'total_product_asset': 'product_asset_value',
+    'low_stock_products': 'low_stock_count',
+    'pending_orders': 'pending_orders',
+    'total_expense_amount': 'total_expense_amount',
+    'monthly_expenses': 'monthly_expenses',
+}
+
+
+def get_dashboard_stats(now=None, snapshot=None):
+    """
+    Compute every dashboard KPI.
+
+    Args:
+        now: Reference time (defaults to the current time in EAT)
+        snapshot: Optional DashboardSnapshot row; when given, the sales
+            figures are read from it instead of scanning orderitems/payments
+
+    Returns:
+        DashboardStats: KPIs; a group that fails to load keeps its zero defaults
+    """
+    today, this_month = dashboard_periods(now)
+    stats = DashboardStats()
+
+    groups = {
+        'order': _order_kpis(today),
+        'product': _product_kpis(),
+        'expense': _expense_kpis(this_month),
+    }
+    if snapshot is None:
+        groups['revenue'] = _revenue_kpis(this_month)
+        groups['profit'] = _profit_kpis(this_month)
+
+    # The groups are independent, so they run concurrently
+    fanout = QueryFanout('dashboard statistics')
+    for label, (statement, _) in groups.items():
+        fanout.one(label, statement)
+    results = fanout.run(raise_errors=False)
+
+    for label, (_, fields) in groups.items():
+        if label in results:
+            for field, value in zip(fields, results[label]):
+                setattr(stats, field, value)
+
+    if snapshot is not None:
+        for field, column in SNAPSHOT_STATS.items():
+            setattr(stats, field, getattr(snapshot, column))
+
+    return stats
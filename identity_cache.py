@@ -0,0 +1,99 @@
+"""
+Identity Cache
+
+This module serves `current_user` on authenticated requests from a short-TTL
+cache of the fields that stay the same for a session (id, email, names,
+role, accessible branch ids), so load_user and role_required don't read the
+users table on every request.
+
+Entries are tagged with the report cache version of the `users` table (see
+report_cache.py), which is bumped when a users write commits: edit_user,
+delete_user and change_password take effect on the next request in this
+worker and, with REPORT_CACHE_URL set, in all workers. Without a shared
+backend other workers pick the change up within IDENTITY_CACHE_TTL seconds.
+
+The cached Identity is read-only; code that changes the user (passwords)
+loads the User row itself.
+"""
+
+import time
+from dataclasses import dataclass
+from extensions import db
+from models import Branch, User
+from report_cache import report_cache
+from config import Config
+
+_TABLES = ('users',)
+_identities = {}  # {user_id: (versions, expires_at, Identity)}
+
+
+@dataclass(frozen=True)
+class Identity:
+    """Read-only copy of a logged-in User, used as Flask-Login's current_user"""
+    id: int
+    email: str
+    firstname: str
+    lastname: str
+    role: str
+    accessible_branch_ids: tuple = ()
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def has_branch_access(self, branch_id):
+        """Check if user has access to a specific branch"""
+        if not self.accessible_branch_ids:
+            return True  # NULL or empty list means access to all branches
+        return branch_id in self.accessible_branch_ids
+
+    def has_all_branch_access(self):
+        return not self.accessible_branch_ids
+
+    def get_accessible_branches(self):
+        """Get Branch objects for accessible branch IDs"""
+        if not self.accessible_branch_ids:
+            return Branch.query.all()  # All branches if NULL or empty list
+        return Branch.query.filter(Branch.id.in_(self.accessible_branch_ids)).all()
+
+    @classmethod
+    def of(cls, user):
+        return cls(user.id, user.email, user.firstname, user.lastname, user.role,
+                   tuple(user.accessible_branch_ids or ()))
+
+
+def load_identity(user_id):
+    """
+    Identity of a user for the current request.
+
+    Args:
+        user_id: ID stored in the session
+
+    Returns:
+        Identity, or None when the user no longer exists
+    """
+    versions = report_cache.table_versions(_TABLES)
+    now = time.monotonic()
+    entry = _identities.get(user_id)
+    if entry is not None and versions is not None and entry[0] == versions and entry[1] > now:
+        return entry[2]
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        _identities.pop(user_id, None)
+        return None
+    identity = Identity.of(user)
+    if versions is not None and Config.IDENTITY_CACHE_TTL:
+        _identities[user_id] = (versions, now + Config.IDENTITY_CACHE_TTL, identity)
+    return identity
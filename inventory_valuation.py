@@ -0,0 +1,288 @@
+"""
+Inventory Valuation
+
+This module values branch inventory at cost as of any date, with totals by
+branch, category and subcategory computed by a single ROLLUP query.
+
+The quantity of each BranchProduct on a past date is reconstructed from the
+stock ledger (StockTransaction.new_stock is the running balance after each
+movement) starting from the latest stock snapshot on or before that date:
+
+1. the last ledger entry after the snapshot, up to the end of the date;
+2. otherwise the snapshot quantity;
+3. otherwise nothing, if the product didn't exist yet;
+4. otherwise the stock before the first ledger entry after the date
+   (StockTransaction.previous_stock);
+5. otherwise the quantity of the next snapshot, or the current stock when
+   there is none: the product hasn't moved since the date.
+
+Snapshots (one row per product per day, see `flask snapshot-stock`) bound the
+ledger scans to the transactions between the snapshots around the date, so a
+valuation doesn't get slower as years of transactions accumulate. Before the
+first snapshot the scan of 1. starts at the beginning of the ledger, and
+after the last one the scan of 4. runs to its end. Valuations for today read
+the live stock directly.
+
+Quantities are valued at the current buying price of each branch product.
+"""
+
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, case, select, and_, or_, literal, tuple_
+from sqlalchemy.types import Date, DateTime
+from extensions import db
+from models import EAT, Branch, BranchProduct, Category, ProductCatalog, StockSnapshot, StockTransaction, SubCategory
+from timezones import eat_day_start, to_eat
+
+
+LEVELS = ('total', 'branch', 'category', 'subcategory')
+
+
+@dataclass
+class InventoryValuation:
+    """One ROLLUP row: a subcategory of a category within a branch, or a subtotal"""
+    level: str  # One of LEVELS
+    branch_id: int = None
+    branch_name: str = None
+    category_id: int = None
+    category_name: str = None
+    subcategory_id: int = None
+    subcategory_name: str = None
+    products: int = 0
+    quantity: Decimal = Decimal('0')
+    value: Decimal = Decimal('0')
+
+    @property
+    def name(self):
+        """Name of the most specific group of this row"""
+        if self.level == 'subcategory':
+            return self.subcategory_name or 'Uncategorized'
+        if self.level == 'category':
+            return self.category_name or 'Uncategorized'
+        if self.level == 'branch':
+            return self.branch_name
+        return 'Total'
+
+
+def _stock_quantities(as_of, today):
+    """
+    Per-product quantity on hand at the end of as_of.
+
+    Returns:
+        Subquery: (branch_product_id, quantity), one row per BranchProduct
+    """
+    if as_of >= today:
+        return select(
+            BranchProduct.id.label('branch_product_id'),
+            func.coalesce(BranchProduct.stock, 0).label('quantity')
+        ).subquery()
+
+    day_end = eat_day_start(as_of) + timedelta(days=1)
+    snapshot_day, next_snapshot_day = db.session.execute(select(
+        select(func.max(StockSnapshot.day)).where(StockSnapshot.day <= as_of).scalar_subquery(),
+        select(func.min(StockSnapshot.day)).where(StockSnapshot.day > as_of).scalar_subquery()
+    )).one()
+
+    ledger = select(
+        StockTransaction.branch_productid.label('branch_product_id'),
+        StockTransaction.new_stock.label('new_stock'),
+        StockTransaction.created_at.label('created_at'),
+        func.row_number().over(
+            partition_by=StockTransaction.branch_productid,
+            order_by=(StockTransaction.created_at.desc(), StockTransaction.id.desc())
+        ).label('position')
+    ).where(StockTransaction.created_at < day_end)
+    snapshot = select(
+        StockSnapshot.branch_productid.label('branch_product_id'),
+        StockSnapshot.stock.label('stock'),
+        StockSnapshot.taken_at.label('taken_at')
+    ).where(StockSnapshot.day == snapshot_day)
+    if snapshot_day is not None:
+        # Only the movements since the snapshot are needed
+        ledger = ledger.where(StockTransaction.created_at >= eat_day_start(snapshot_day))
+    ledger = ledger.subquery()
+    snapshot = snapshot.subquery()
+
+    # The first movement after the date holds the stock before it
+    later = select(
+        StockTransaction.branch_productid.label('branch_product_id'),
+        StockTransaction.previous_stock.label('previous_stock'),
+        func.row_number().over(
+            partition_by=StockTransaction.branch_productid,
+            order_by=(StockTransaction.created_at, StockTransaction.id)
+        ).label('position')
+    ).where(StockTransaction.created_at >= day_end)
+    next_snapshot = select(
+        StockSnapshot.branch_productid.label('branch_product_id'),
+        StockSnapshot.stock.label('stock')
+    ).where(StockSnapshot.day == next_snapshot_day)
+    if next_snapshot_day is not None:
+        # Up to the end of the next snapshot's day: a product without
+        # movements by then still had the next snapshot's quantity
+        later = later.where(StockTransaction.created_at < eat_day_start(next_snapshot_day) + timedelta(days=1))
+    later = later.subquery()
+    next_snapshot = next_snapshot.subquery()
+
+    if next_snapshot_day is not None:
+        unmoved = func.coalesce(next_snapshot.c.stock, BranchProduct.stock, 0)
+    else:
+        unmoved = func.coalesce(BranchProduct.stock, 0)
+    quantity = case(
+        (and_(ledger.c.new_stock.isnot(None),
+              or_(snapshot.c.taken_at.is_(None), ledger.c.created_at >= snapshot.c.taken_at)),
+         ledger.c.new_stock),
+        (snapshot.c.stock.isnot(None), snapshot.c.stock),
+        (BranchProduct.created_at >= day_end, 0),
+        (later.c.previous_stock.isnot(None), later.c.previous_stock),
+        else_=unmoved
+    )
+    return select(
+        BranchProduct.id.label('branch_product_id'),
+        quantity.label('quantity')
+    ).outerjoin(
+        ledger, and_(ledger.c.branch_product_id == BranchProduct.id, ledger.c.position == 1)
+    ).outerjoin(
+        snapshot, snapshot.c.branch_product_id == BranchProduct.id
+    ).outerjoin(
+        later, and_(later.c.branch_product_id == BranchProduct.id, later.c.position == 1)
+    ).outerjoin(
+        next_snapshot, next_snapshot.c.branch_product_id == BranchProduct.id
+    ).subquery()
+
+
+def _level(branch_grouped, category_grouped, subcategory_grouped):
+    """Row level from the GROUPING() flags of the rollup columns"""
+    return LEVELS[3 - sum((branch_grouped, category_grouped, subcategory_grouped))]
+
+
+def _rollup_in_python(rows):
+    """ROLLUP(branch, category, subcategory) of detail rows, for databases without ROLLUP"""
+    totals = {}
+    for row in rows:
+        keys = (
+            ('subcategory',) + row[:6],
+            ('category',) + row[:4] + (None, None),
+            ('branch',) + row[:2] + (None,) * 4,
+            ('total',) + (None,) * 6,
+        )
+        for key in keys:
+            figures = totals.setdefault(key, [0, Decimal('0'), Decimal('0')])
+            for index, figure in enumerate(row[6:]):
+                figures[index] += figure or 0
+    return [InventoryValuation(*key, *figures) for key, figures in totals.items()]
+
+
+def get_inventory_valuation(as_of=None, branch_id=None, now=None):
+    """
+    Value inventory at cost as of the end of a date.
+
+    Args:
+        as_of: Date to value stock at (defaults to today in EAT)
+        branch_id: Only value this branch
+        now: Reference time (defaults to the current time in EAT)
+
+    Returns:
+        list: InventoryValuation rows for every level, details before their
+        subtotals, ordered by branch, category and subcategory name
+    """
+    today = to_eat(now or datetime.now(EAT)).date()
+    as_of = as_of or today
+    stock = _stock_quantities(as_of, today)
+
+    branch = (Branch.id, Branch.name)
+    category = (Category.id, Category.name)
+    subcategory = (SubCategory.id, SubCategory.name)
+    figures = (
+        func.count(BranchProduct.id),
+        func.coalesce(func.sum(stock.c.quantity), 0),
+        func.coalesce(func.sum(stock.c.quantity * func.coalesce(BranchProduct.buyingprice, 0)), 0)
+    )
+    query = select().select_from(BranchProduct).join(
+        stock, stock.c.branch_product_id == BranchProduct.id
+    ).join(
+        Branch, BranchProduct.branchid == Branch.id
+    ).join(
+        ProductCatalog, BranchProduct.catalog_id == ProductCatalog.id
+    ).outerjoin(
+        SubCategory, ProductCatalog.subcategory_id == SubCategory.id
+    ).outerjoin(
+        Category, SubCategory.category_id == Category.id
+    ).where(stock.c.quantity > 0)
+    if branch_id:
+        query = query.where(BranchProduct.branchid == branch_id)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        rows = [
+            InventoryValuation(_level(*row[:3]), *row[3:])
+            for row in db.session.execute(
+                query.with_only_columns(
+                    func.grouping(Branch.id), func.grouping(Category.id), func.grouping(SubCategory.id),
+                    *branch, *category, *subcategory, *figures
+                ).group_by(func.rollup(tuple_(*branch), tuple_(*category), tuple_(*subcategory)))
+            )
+        ]
+    else:
+        rows = _rollup_in_python(db.session.execute(
+            query.with_only_columns(*branch, *category, *subcategory, *figures)
+            .group_by(*branch, *category, *subcategory)
+        ).all())
+
+    def sort_key(row):
+        # Subtotals sort after the rows they sum up
+        depth = LEVELS.index(row.level)
+        return tuple(
+            (depth < position, name or '')
+            for position, name in enumerate((row.branch_name, row.category_name, row.subcategory_name), 1)
+        )
+    return sorted(rows, key=sort_key)
+
+
+def valuation_total(rows):
+    """Grand total value of get_inventory_valuation() rows"""
+    return next((row.value for row in rows if row.level == 'total'), Decimal('0'))
+
+
+def valuation_by_category(rows):
+    """
+    Category subtotals summed over branches, highest value first.
+
+    Returns:
+        list: InventoryValuation rows at the category level, without branch
+    """
+    categories = {}
+    for row in rows:
+        if row.level != 'category':
+            continue
+        total = categories.get(row.category_id)
+        if total is None:
+            categories[row.category_id] = replace(row, branch_id=None, branch_name=None)
+        else:
+            total.products += row.products
+            total.quantity += row.quantity
+            total.value += row.value
+    return sorted(categories.values(), key=lambda row: row.value, reverse=True)
+
+
+def take_stock_snapshot(connection=None, now=None):
+    """
+    Record the current stock of every branch product for today (EAT),
+    replacing an earlier snapshot of the same day.
+
+    Returns:
+        int: Number of products recorded
+    """
+    connection = connection if connection is not None else db.session
+    now = to_eat(now or datetime.now(EAT))
+    snapshots = StockSnapshot.__table__
+    connection.execute(snapshots.delete().where(snapshots.c.day == now.date()))
+    result = connection.execute(snapshots.insert().from_select(
+        ['branch_productid', 'day', 'stock', 'taken_at'],
+        select(
+            BranchProduct.id,
+            literal(now.date(), Date),
+            func.coalesce(BranchProduct.stock, 0),
+            literal(now, DateTime(timezone=True))
+        )
+    ))
+    return result.rowcount
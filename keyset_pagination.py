@@ -0,0 +1,148 @@
+"""
+Keyset Pagination
+
+This module pages through large tables with a cursor on the sort key (e.g.
+`(created_at, id)`) instead of OFFSET. Each page seeks straight to the
+cursor through the matching index and reads `per_page + 1` rows, so a deep
+page costs the same as the first one, and no COUNT(*) is needed to know
+whether there is a next page. When a total is wanted, `estimate_count` reads
+the planner's row estimate instead of counting.
+
+Usage:
+    page = keyset_paginate(query, (Order.created_at, Order.id),
+                           after=request.args.get('after'),
+                           before=request.args.get('before'),
+                           per_page=20)
+    page.items, page.next_cursor, page.prev_cursor
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.engine import Row
+from sqlalchemy.types import Date, DateTime
+from extensions import db
+
+
+def encode_cursor(values):
+    """Encode the sort key of a row as an opaque, URL-safe cursor"""
+    values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decode a cursor made by encode_cursor for the given key columns.
+
+    Returns:
+        tuple: Key values, or None when the cursor is missing or malformed
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        decoded = []
+        for column, value in zip(columns, values):
+            if isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif isinstance(column.type, Date):
+                value = date.fromisoformat(value)
+            decoded.append(value)
+        return tuple(decoded)
+    except (ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total  # Optional, possibly approximate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=20, descending=True):
+    """
+    Fetch one page of `query` ordered by `columns`.
+
+    The columns must be NOT NULL in the schema, not just in practice: a row
+    with a NULL key never compares greater or smaller than a cursor and drops
+    out of every page but the first. They must also be unique together (end
+    with the primary key) and should be covered by an index in that order.
+
+    Args:
+        query: ORM query with filters applied and no ORDER BY; with several
+            columns, the entity holding the sort key must come first
+        columns: Sort key columns, e.g. (Order.created_at, Order.id)
+        after: Cursor of the last row of the previous page (next page)
+        before: Cursor of the first row of the following page (previous page)
+        per_page: Page size
+        descending: Newest/highest first
+
+    Returns:
+        KeysetPage: Items in display order with the cursors of its neighbours
+    """
+    columns = tuple(columns)
+    key = tuple_(*columns)
+    after = decode_cursor(after, columns)
+    before = decode_cursor(before, columns) if after is None else None
+    backwards = before is not None
+
+    # Walking backwards reverses the order, then the page is flipped back
+    reverse = descending != backwards
+    query = query.order_by(*(column.desc() if reverse else column.asc() for column in columns))
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    elif before is not None:
+        query = query.filter(key > tuple_(*before) if descending else key < tuple_(*before))
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+
+    def cursor_of(row):
+        # Rows of multi-column queries carry the keyed entity first
+        entity = row[0] if isinstance(row, Row) else row
+        return encode_cursor([getattr(entity, column.key) for column in columns])
+
+    next_cursor = cursor_of(rows[-1]) if rows and has_next else None
+    prev_cursor = cursor_of(rows[0]) if rows and has_prev else None
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor)
+
+
+def estimate_count(statement):
+    """
+    Approximate number of rows a SELECT returns.
+
+    On PostgreSQL this is the planner's estimate from EXPLAIN, which costs no
+    more than planning the query; other databases get an exact COUNT.
+    """
+    session = db.session
+    if session.get_bind().dialect.name == 'postgresql':
+        compiled = statement.compile(dialect=session.get_bind().dialect)
+        plan = session.connection().exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return session.execute(select(func.count()).select_from(statement.subquery())).scalar()
@@ -17,10 +17,11 @@ import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 from werkzeug.utils import secure_filename
+import hmac
 import os
 from config import Config
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import or_, func, and_, case
+from sqlalchemy import or_, func, and_, case, select
 from sqlalchemy.orm import joinedload
 
 from extensions import db
@@ -69,14 +70,44 @@ def format_stock(value):
         return str(value)
 
 # Import models after db is initialized
-from models import Branch, Category, User, OrderType, Order, OrderItem, StockTransaction, Payment, SubCategory, ProductDescription, Expense, Supplier, PurchaseOrder, PurchaseOrderItem, ProductCatalog, BranchProduct, Quotation, QuotationItem
+from models import Branch, Category, User, OrderType, Order, OrderItem, StockTransaction, Payment, SubCategory, ProductDescription, Expense, Supplier, PurchaseOrder, PurchaseOrderItem, ProductCatalog, BranchProduct, Quotation, QuotationItem, StockSnapshot, ProfitLossClose, DailySalesRollup
+from dashboard_stats import get_dashboard_stats, has_asset_value
+from dashboard_snapshot import get_dashboard_snapshot, rebuild_dashboard_snapshot
+from branch_stats import get_branch_stats
+from salesperson_stats import get_salesperson_stats, get_salesperson_orders
+from report_cache import cached_report
+from order_queries import get_order_figures, get_order_totals, get_order_stats, order_list_filters
+from order_accounting import payment_status_for, reconcile_order_totals
+from keyset_pagination import keyset_paginate, estimate_count
+from sales_rollup import get_sales_rollup, rebuild_sales_rollup, refresh_recent_sales_rollup
+from timezones import to_eat, eat_day_start, eat_day_range
+from inventory_valuation import get_inventory_valuation, valuation_total, valuation_by_category, take_stock_snapshot
+from period_close import get_profit_loss, close_profit_loss_periods
+from ar_aging import AGING_BUCKETS, get_ar_aging, get_outstanding_orders
+from category_stats import CategoryAnalytics, get_category_stats, get_branch_product_counts
+from category_tree import get_category_tree, category_tree
+from branch_directory import get_branch_directory, branch_directory
+from identity_cache import load_identity
+from tracing import get_tracer, init_tracing
+from query_stats import init_query_stats, get_query_stats, reset_query_stats
+from metrics import init_metrics, render_metrics, timed
 
 # Define EAT timezone
 EAT = timezone(timedelta(hours=3))
 
+# Structured, sampled tracing instead of print debugging (see tracing.py)
+init_tracing(app)
+init_query_stats(app)
+init_metrics(app)
+auth_trace = get_tracer('auth')
+catalog_trace = get_tracer('catalog')
+po_trace = get_tracer('purchase_orders')
+pdf_trace = get_tracer('pdf')
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Cached identity (see identity_cache.py); the users table is only read on a miss
+    return load_identity(int(user_id))
 
 with app.app_context():
     db.create_all()
@@ -97,290 +128,89 @@ def role_required(roles):
         return decorated_function
     return wrapper
 
+# Dashboard widgets: (endpoint, template slots, client refresh interval in seconds).
+# The refresh interval matches each widget's Cache-Control max-age.
+DASHBOARD_WIDGETS = [
+    ('dashboard_kpis_api', ['kpi-cards', 'asset-breakdown'], 60),
+    ('dashboard_branch_stats_api', ['branch-assets', 'branch-overview'], 120),
+    ('dashboard_top_products_api', ['top-products', 'top-products-by-asset'], 300),
+    ('dashboard_recent_orders_api', ['recent-orders', 'recent-users'], 30),
+    ('dashboard_ar_aging_api', ['ar-aging'], 300),
+]
+
 @app.route("/")
 @login_required
 @role_required(['admin']) 
 def index():
-    print(f"🔍 Index route accessed - User: {current_user.email if current_user.is_authenticated else 'Not authenticated'}")
-    print(f"🔍 User role: {current_user.role if current_user.is_authenticated else 'No role'}")
-    
-    # Set default date values
-    today = datetime.now().date()
-    this_month = datetime.now().replace(day=1).date()
-    last_month = (this_month - timedelta(days=1)).replace(day=1)
-    
-    try:
-        # Get real business data in EAT timezone
-        now = datetime.now(EAT)
-        today = now.date()
-        this_month = now.replace(day=1).date()
-        last_month = (this_month - timedelta(days=1)).replace(day=1)
-        print(f"✅ EAT timezone calculation successful")
-    except Exception as e:
-        print(f"❌ Error in index route setup: {e}")
-        flash('An error occurred while loading dashboard data. Please try again.', 'error')
-        # Continue with default date values
-    
-    # Dashboard statistics
-    try:
-        total_users = User.query.count()
-        total_products = BranchProduct.query.count()
-        total_orders = Order.query.count()
-        total_branches = Branch.query.count()
-    except Exception as e:
-        print(f"Error getting basic statistics: {e}")
-        total_users = 0
-        total_products = 0
-        total_orders = 0
-        total_branches = 0
-    
-    # Total product asset value (buying price * stock quantity)
-    # Exclude products with no buying price, zero stock, or null stock
-    try:
-        total_product_asset = db.session.query(
-            func.sum(BranchProduct.buyingprice * BranchProduct.stock)
-        ).filter(
-            and_(
-                BranchProduct.buyingprice.isnot(None),  # Exclude products with no buying price
-                BranchProduct.buyingprice > 0,          # Exclude products with zero buying price
-                BranchProduct.stock.isnot(None),        # Exclude products with null stock
-                BranchProduct.stock > 0                 # Exclude products with zero stock
-            )
-        ).scalar() or 0
-    except Exception as e:
-        print(f"Error calculating total product asset: {e}")
-        total_product_asset = 0
-    
-    # ProductCatalog asset statistics
-    try:
-        products_with_assets = db.session.query(BranchProduct).filter(
-            and_(
-                BranchProduct.buyingprice.isnot(None),
-                BranchProduct.buyingprice > 0,
-                BranchProduct.stock.isnot(None),
-                BranchProduct.stock > 0
-            )
-        ).count()
-        
-        products_without_buying_price = db.session.query(BranchProduct).filter(
-            or_(
-                BranchProduct.buyingprice.is_(None),
-                BranchProduct.buyingprice == 0
-            )
-        ).count()
-        
-        products_with_zero_stock = db.session.query(BranchProduct).filter(
-            or_(
-                BranchProduct.stock.is_(None),
-                BranchProduct.stock == 0
-            )
-        ).count()
-    except Exception as e:
-        print(f"Error getting product asset statistics: {e}")
-        products_with_assets = 0
-        products_without_buying_price = 0
-        products_with_zero_stock = 0
-    
-    # Average asset value per product (excluding products without assets)
-    avg_asset_per_product = total_product_asset / products_with_assets if products_with_assets > 0 else 0
-    
-    # Recent orders (last 7 days)
-    try:
-        recent_orders = Order.query.filter(
-            Order.created_at >= today - timedelta(days=7)
-        ).count()
-    except Exception as e:
-        print(f"Error getting recent orders count: {e}")
-        recent_orders = 0
-    
-    # Pending orders
-    try:
-        pending_orders = Order.query.filter_by(approvalstatus=False).count()
-    except Exception as e:
-        print(f"Error getting pending orders count: {e}")
-        pending_orders = 0
-    
-    # Total revenue (from completed payments)
-    try:
-        total_revenue = db.session.query(func.sum(Payment.amount)).join(
-            Order, Payment.orderid == Order.id
-        ).filter(Payment.payment_status == 'completed').scalar() or 0
-    except Exception as e:
-        print(f"Error calculating total revenue: {e}")
-        total_revenue = 0
-    
-    # Monthly revenue (from completed payments)
-    try:
-        monthly_revenue = db.session.query(func.sum(Payment.amount)).join(
-            Order, Payment.orderid == Order.id
-        ).filter(
-            and_(Payment.payment_status == 'completed', Payment.created_at >= this_month)
-        ).scalar() or 0
-    except Exception as e:
-        print(f"Error calculating monthly revenue: {e}")
-        monthly_revenue = 0
-    
-    # Total profit calculation (Revenue - Cost of Goods Sold)
-    try:
-        # Calculate total profit from completed payments
-        total_profit = db.session.query(func.sum((OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity)).join(
-            Order, OrderItem.orderid == Order.id
-        ).join(
-            Payment, Order.id == Payment.orderid
-        ).filter(
-            Payment.payment_status == 'completed',
-            OrderItem.final_price.isnot(None),
-            OrderItem.buying_price.isnot(None)
-        ).scalar() or 0
-        
-        # Calculate total cost of goods sold for completed payments
-        total_cogs = db.session.query(func.sum(OrderItem.buying_price * OrderItem.quantity)).join(
-            Order, OrderItem.orderid == Order.id
-        ).join(
-            Payment, Order.id == Payment.orderid
-        ).filter(
-            Payment.payment_status == 'completed',
-            OrderItem.buying_price.isnot(None)
-        ).scalar() or 0
-        
-    except Exception as e:
-        print(f"Error calculating total profit: {e}")
-        total_profit = 0
-        total_cogs = 0
+    auth_trace.debug('dashboard_opened', user_id=current_user.id, role=current_user.role)
     
-    # Monthly profit calculation
-    try:
-        # Calculate monthly profit from completed payments
-        monthly_profit = db.session.query(func.sum((OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity)).join(
-            Order, OrderItem.orderid == Order.id
-        ).join(
-            Payment, Order.id == Payment.orderid
-        ).filter(
-            and_(Payment.payment_status == 'completed', Payment.created_at >= this_month),
-            OrderItem.final_price.isnot(None),
-            OrderItem.buying_price.isnot(None)
-        ).scalar() or 0
-        
-        # Calculate monthly cost of goods sold for completed payments
-        monthly_cogs = db.session.query(func.sum(OrderItem.buying_price * OrderItem.quantity)).join(
-            Order, OrderItem.orderid == Order.id
-        ).join(
-            Payment, Order.id == Payment.orderid
-        ).filter(
-            and_(Payment.payment_status == 'completed', Payment.created_at >= this_month),
-            OrderItem.buying_price.isnot(None)
-        ).scalar() or 0
-        
-    except Exception as e:
-        print(f"Error calculating monthly profit: {e}")
-        monthly_profit = 0
-        monthly_cogs = 0
-    
-    # Low stock products (less than 10 items)
-    try:
-        low_stock_products = BranchProduct.query.filter(BranchProduct.stock < 10).count()
-    except Exception as e:
-        print(f"Error getting low stock products count: {e}")
-        low_stock_products = 0
-    
-    # Recent activities - Load recent orders with proper relationships and calculate totals
-    try:
-        recent_orders_list = db.session.query(Order).options(
-            db.joinedload(Order.user),
-            db.joinedload(Order.branch),
-            db.joinedload(Order.order_items).joinedload(OrderItem.branch_product).joinedload(BranchProduct.catalog_product)
-        ).order_by(Order.created_at.desc()).limit(5).all()
-        
-        # Calculate totals for each recent order
-        for order in recent_orders_list:
-            total_amount = 0
-            for item in order.order_items:
-                # Handle both cases: products with relationships and manually entered items
-                if item.final_price:
-                    # Use the final_price if available (for manually entered items or negotiated prices)
-                    item_total = item.final_price * item.quantity
-                    total_amount += item_total
-                elif item.branch_product and item.branch_product.sellingprice:
-                    # Use branch product's selling price if no final_price but branch_product relationship exists
-                    item_total = item.branch_product.sellingprice * item.quantity
-                    total_amount += item_total
-                elif hasattr(item, 'product_name') and item.product_name and item.original_price:
-                    # For manually entered items without product relationship, check if they have a price
-                    item_total = item.original_price * item.quantity
-                    total_amount += item_total
-            
-            # Store the calculated total on the order object for template use
-            order.calculated_total = total_amount
-            
-            # Calculate profit for the order using OrderItem fields directly
-            order_profit = 0
-            print(f"🔍 Dashboard: Calculating profit for order {order.id} with {len(order.order_items)} items")
-            for item in order.order_items:
-                print(f"  📦 Dashboard Item {item.id}: final_price={item.final_price}, buying_price={item.buying_price}")
-                
-                # Use final_price as selling price and buying_price from OrderItem table
-                if item.final_price and item.buying_price:
-                    item_profit = (item.final_price - item.buying_price) * item.quantity
-                    order_profit += item_profit
-                    print(f"    💰 Profit: ({item.final_price} - {item.buying_price}) × {item.quantity} = {item_profit}")
-                else:
-                    print(f"    ⚠️ Cannot calculate profit - missing price data")
-                    print(f"      final_price: {item.final_price}")
-                    print(f"      buying_price: {item.buying_price}")
-            
-            # Store the calculated profit on the order object for template use
-            order.calculated_profit = order_profit
-            print(f"🔍 Dashboard: Order {order.id}: calculated_profit = {order_profit}")
-        
-        # Add adjusted times (3 hours ahead) for display
-        for order in recent_orders_list:
-            order.created_at_adjusted = order.created_at + timedelta(hours=3)
-        
-        recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
-    except Exception as e:
-        print(f"Error getting recent activities: {e}")
-        recent_orders_list = []
-        recent_users = []
-    
-    # Branch statistics with product asset value
-    branch_stats = []
+    # The dashboard is a shell; its widgets are fetched in parallel from /api/dashboard/*
+    dashboard_widgets = [
+        {'url': url_for(endpoint), 'slots': slots, 'refresh': refresh}
+        for endpoint, slots, refresh in DASHBOARD_WIDGETS
+    ]
+    return render_template("index.html", dashboard_widgets=dashboard_widgets)
+
+def _json_value(value):
+    """Convert Decimal/datetime values from queries to JSON-friendly types"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _widget_response(template, data, **context):
+    """JSON payload shared by the dashboard widgets: raw data plus rendered slots"""
+    return jsonify({
+        'data': data,
+        'html': render_template(template, **context)
+    })
+
+@app.route('/api/dashboard/kpis')
+@login_required
+@role_required(['admin'])
+@cached_report(User, Branch, BranchProduct, Order, OrderItem, Payment, Expense, ttl=60, max_age=60)
+def dashboard_kpis_api():
+    # Sales figures come from the materialized snapshot (see dashboard_snapshot.py);
+    # the rest are consolidated KPI queries
+    stats = get_dashboard_stats(snapshot=get_dashboard_snapshot())
+    kpis = stats.as_dict()
+    return _widget_response('dashboard_kpis_partial.html',
+                            {name: _json_value(value) for name, value in kpis.items()},
+                            **kpis)
+
+@app.route('/api/dashboard/branch-stats')
+@login_required
+@role_required(['admin'])
+@cached_report(Branch, BranchProduct, Order, Payment, ttl=300, max_age=120)
+def dashboard_branch_stats_api():
+    # Branch statistics with product asset value (grouped queries, see branch_stats.py)
     try:
-        for branch in Branch.query.all():
-            try:
-                branch_products = BranchProduct.query.filter_by(branchid=branch.id).count()
-                branch_orders = Order.query.filter_by(branchid=branch.id).count()
-                
-                # Calculate product asset value for this branch (buying price * stock)
-                branch_asset_value = db.session.query(
-                    func.sum(BranchProduct.buyingprice * BranchProduct.stock)
-                ).filter(
-                    and_(
-                        BranchProduct.branchid == branch.id,
-                        BranchProduct.buyingprice.isnot(None),
-                        BranchProduct.buyingprice > 0,
-                        BranchProduct.stock.isnot(None),
-                        BranchProduct.stock > 0
-                    )
-                ).scalar() or 0
-                
-                branch_stats.append({
-                    'branch': branch,
-                    'products': branch_products,
-                    'orders': branch_orders,
-                    'asset_value': branch_asset_value
-                })
-            except Exception as e:
-                print(f"Error getting stats for branch {branch.id}: {e}")
-                branch_stats.append({
-                    'branch': branch,
-                    'products': 0,
-                    'orders': 0,
-                    'asset_value': 0
-                })
+        all_branches = Branch.query.all()
+        stats_by_branch = get_branch_stats(branch.id for branch in all_branches)
+        branch_stats = [
+            dict(stats_by_branch[branch.id].as_dict(), branch=branch)
+            for branch in all_branches
+        ]
     except Exception as e:
         print(f"Error getting branch statistics: {e}")
+        db.session.rollback()
         branch_stats = []
     
+    data = [
+        dict({name: _json_value(value) for name, value in stat.items() if name != 'branch'},
+             branch_id=stat['branch'].id, name=stat['branch'].name, location=stat['branch'].location)
+        for stat in branch_stats
+    ]
+    return _widget_response('dashboard_branch_stats_partial.html', data,
+                            branch_stats=branch_stats,
+                            total_branches=len(branch_stats))
+
+@app.route('/api/dashboard/top-products')
+@login_required
+@role_required(['admin'])
+@cached_report(BranchProduct, ProductCatalog, Order, OrderItem, Payment, ttl=600, max_age=300)
+def dashboard_top_products_api():
     # Top selling products (using completed payments to match sales report)
     try:
         top_products = db.session.query(
@@ -396,23 +226,22 @@ def index():
         ).limit(5).all()
     except Exception as e:
         print(f"Error getting top products: {e}")
+        db.session.rollback()
         top_products = []
     
     # Top products by asset value (buying price * stock)
     try:
         top_products_by_asset_value = db.session.query(
             BranchProduct, (BranchProduct.buyingprice * BranchProduct.stock).label('asset_value')
-        ).filter(
-            and_(
-                BranchProduct.buyingprice.isnot(None),
-                BranchProduct.buyingprice > 0,
-                BranchProduct.stock.isnot(None),
-                BranchProduct.stock > 0
-            )
-        ).order_by((BranchProduct.buyingprice * BranchProduct.stock).desc()).limit(5).all()
+        ).filter(has_asset_value()).order_by((BranchProduct.buyingprice * BranchProduct.stock).desc()).limit(5).all()
+        total_product_asset = db.session.query(
+            func.sum(BranchProduct.buyingprice * BranchProduct.stock)
+        ).filter(has_asset_value()).scalar() or 0
     except Exception as e:
         print(f"Error getting top products by asset value: {e}")
+        db.session.rollback()
         top_products_by_asset_value = []
+        total_product_asset = 0
     
     # Calculate percentage of total assets for each top product
     top_products_with_percentage = []
@@ -424,64 +253,112 @@ def index():
             'percentage': percentage
         })
     
-    # Expense statistics
+    def product_data(product):
+        catalog = product.catalog_product
+        return {
+            'branch_product_id': product.id,
+            'name': catalog.name if catalog else None,
+            'productcode': catalog.productcode if catalog else None,
+        }
+    
+    data = {
+        'top_selling': [
+            dict(product_data(product), total_sold=_json_value(total_sold),
+                 avg_final_price=_json_value(avg_final_price or product.sellingprice))
+            for product, total_sold, avg_final_price in top_products
+        ],
+        'top_by_asset_value': [
+            dict(product_data(item['product']), asset_value=_json_value(item['asset_value']),
+                 stock=_json_value(item['product'].stock), percentage=_json_value(item['percentage']))
+            for item in top_products_with_percentage
+        ],
+    }
+    return _widget_response('dashboard_top_products_partial.html', data,
+                            top_products=top_products,
+                            top_products_with_percentage=top_products_with_percentage)
+
+@app.route('/api/dashboard/recent-orders')
+@login_required
+@role_required(['admin'])
+@cached_report(User, Order, OrderItem, BranchProduct, ProductCatalog, ttl=60, max_age=30)
+def dashboard_recent_orders_api():
+    # Recent activities - Load recent orders with proper relationships and calculate totals
     try:
-        total_expenses = Expense.query.count()
-        pending_expenses = Expense.query.filter_by(status='pending').count()
-        approved_expenses = Expense.query.filter_by(status='approved').count()
-        total_expense_amount = db.session.query(func.sum(Expense.amount)).filter_by(status='approved').scalar() or 0
-        monthly_expenses = db.session.query(func.sum(Expense.amount)).filter(
-            and_(Expense.status == 'approved', Expense.expense_date >= this_month)
-        ).scalar() or 0
+        recent_orders_list = db.session.query(Order).options(
+            db.joinedload(Order.user),
+            db.joinedload(Order.branch)
+        ).order_by(Order.created_at.desc()).limit(5).all()
+        
+        # Stored order figures (see order_accounting.py)
+        order_figures = get_order_figures(recent_orders_list)
+        for order in recent_orders_list:
+            order.calculated_total = order_figures[order.id].total_amount
+            order.calculated_profit = order_figures[order.id].total_profit
+        
+        recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
     except Exception as e:
-        print(f"Error getting expense statistics: {e}")
-        total_expenses = 0
-        pending_expenses = 0
-        approved_expenses = 0
-        total_expense_amount = 0
-        monthly_expenses = 0
+        print(f"Error getting recent activities: {e}")
+        recent_orders_list = []
+        recent_users = []
     
+    data = {
+        'orders': [
+            {
+                'id': order.id,
+                'customer': f"{order.user.firstname} {order.user.lastname}" if order.user else None,
+                'branch': order.branch.name if order.branch else None,
+                'total': _json_value(order.calculated_total),
+                'profit': _json_value(order.calculated_profit),
+                'approved': bool(order.approvalstatus),
+                'created_at': _json_value(to_eat(order.created_at)),
+            }
+            for order in recent_orders_list
+        ],
+        'users': [
+            {
+                'id': user.id,
+                'name': f"{user.firstname} {user.lastname}",
+                'email': user.email,
+                'role': user.role,
+                'created_at': _json_value(user.created_at),
+            }
+            for user in recent_users
+        ],
+    }
+    return _widget_response('dashboard_recent_orders_partial.html', data,
+                            recent_orders_list=recent_orders_list,
+                            recent_users=recent_users)
+
+@app.route('/api/dashboard/ar-aging')
+@login_required
+@role_required(['admin'])
+@cached_report(Branch, User, Order, OrderItem, Payment, ttl=600, max_age=300)
+def dashboard_ar_aging_api():
+    # Outstanding balances by age (one grouped query, see ar_aging.py)
     try:
-        return render_template("index.html", 
-                             total_users=total_users,
-                             total_products=total_products,
-                             total_orders=total_orders,
-                             total_branches=total_branches,
-                             recent_orders=recent_orders,
-                             pending_orders=pending_orders,
-                             total_revenue=total_revenue,
-                             monthly_revenue=monthly_revenue,
-                             total_profit=total_profit,
-                             monthly_profit=monthly_profit,
-                             total_cogs=total_cogs,
-                             monthly_cogs=monthly_cogs,
-                             low_stock_products=low_stock_products,
-                             recent_orders_list=recent_orders_list,
-                             recent_users=recent_users,
-                             branch_stats=branch_stats,
-                             top_products=top_products,
-                             top_products_by_asset_value=top_products_by_asset_value,
-                             top_products_with_percentage=top_products_with_percentage,
-                             total_expenses=total_expenses,
-                             pending_expenses=pending_expenses,
-                             approved_expenses=approved_expenses,
-                             total_expense_amount=total_expense_amount,
-                             monthly_expenses=monthly_expenses,
-                             total_product_asset=total_product_asset,
-                             products_with_assets=products_with_assets,
-                             products_without_buying_price=products_without_buying_price,
-                             products_with_zero_stock=products_with_zero_stock,
-                             avg_asset_per_product=avg_asset_per_product)
+        aging = get_ar_aging()
     except Exception as e:
-        print(f"Error in index route: {e}")
-        flash('An error occurred while loading dashboard data. Please try again.', 'error')
-        return redirect(url_for('login'))
+        print(f"Error getting receivables aging: {e}")
+        db.session.rollback()
+        aging = None
+    
+    data = {
+        'as_of': aging.as_of.isoformat() if aging else None,
+        'total': _json_value(aging.total.total) if aging else 0,
+        'buckets': {key: _json_value(amount) for key, amount in aging.total.buckets.items()} if aging else {},
+        'branches': [
+            {'branch_id': row.id, 'name': row.name, 'total': _json_value(row.total)}
+            for row in aging.by_branch
+        ] if aging else [],
+    }
+    return _widget_response('dashboard_ar_aging_partial.html', data,
+                            aging=aging,
+                            aging_buckets=AGING_BUCKETS)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
-    print(f"🔍 Login route accessed - User authenticated: {current_user.is_authenticated}")
+    auth_trace.debug('login_opened', authenticated=current_user.is_authenticated)
     if current_user.is_authenticated:
-        print(f"🔍 User already authenticated, redirecting to index")
         return redirect(url_for('index'))
         
     if request.method == "POST":
@@ -639,21 +516,23 @@ def allowed_file(filename):
 
 def upload_to_cloudinary(file):
     """Upload file to Cloudinary and return the URL"""
-    try:
-        # Upload the file to Cloudinary
-        result = cloudinary.uploader.upload(
-            file,
-            folder="abz_products",  # Organize images in a folder
-            resource_type="auto",
-            transformation=[
-                {'width': 800, 'height': 800, 'crop': 'limit'},  # Resize large images
-                {'quality': 'auto:good'}  # Optimize quality
-            ]
-        )
-        return result['secure_url']  # Return the secure HTTPS URL
-    except Exception as e:
-        print(f"Error uploading to Cloudinary: {e}")
-        return None
+    with timed('abz_cloudinary_upload_seconds', outcome='success') as upload:
+        try:
+            # Upload the file to Cloudinary
+            result = cloudinary.uploader.upload(
+                file,
+                folder="abz_products",  # Organize images in a folder
+                resource_type="auto",
+                transformation=[
+                    {'width': 800, 'height': 800, 'crop': 'limit'},  # Resize large images
+                    {'quality': 'auto:good'}  # Optimize quality
+                ]
+            )
+            return result['secure_url']  # Return the secure HTTPS URL
+        except Exception as e:
+            upload['outcome'] = 'error'
+            print(f"Error uploading to Cloudinary: {e}")
+            return None
 
 def delete_from_cloudinary(public_id):
     """Delete image from Cloudinary using public_id"""
@@ -693,11 +572,23 @@ def format_quantity(value):
     except (ValueError, TypeError):
         return str(value)
 
+# Custom template filter for showing stored timestamps in East Africa Time
+@app.template_filter('eat')
+def format_eat(value):
+    """Convert a timestamp to EAT, e.g. {{ (order.created_at|eat).strftime('%I:%M %p') }}"""
+    return to_eat(value)
+
 # Context processor to make branches available to all templates
+# Branch list for templates; a proxy, so the cached branch directory (see
+# branch_directory.py) is only looked up by templates that use it
 @app.context_processor
 def inject_branches():
-    branches = Branch.query.order_by(Branch.name).all()
-    return dict(branches=branches)
+    return dict(branches=branch_directory)
+
+# Category hierarchy for templates, cached per worker (see category_tree.py)
+@app.context_processor
+def inject_category_tree():
+    return dict(category_tree=category_tree)
 
 # Context processor to make user data available to all templates
 @app.context_processor
@@ -715,9 +606,10 @@ def inject_user_data():
 @login_required
 @role_required(['admin'])
 def products():
-    categories = Category.query.order_by(Category.name).all()
-    subcategories = SubCategory.query.order_by(SubCategory.name).all()
-    branches = Branch.query.order_by(Branch.name).all()
+    tree = get_category_tree()
+    categories = tree.categories
+    subcategories = tree.subcategories
+    branches = get_branch_directory()
     
     # Get selected branch from query parameter - default to first branch if none selected
     selected_branch_id = request.args.get('branch_id', type=int)
@@ -807,6 +699,7 @@ def export_products_csv():
     try:
         # Get branch filter from query parameter
         branch_id = request.args.get('branch_id', type=int)
+        tree = get_category_tree()
         
         # Base query with joins
         base_query = ProductCatalog.query.join(
@@ -836,12 +729,9 @@ def export_products_csv():
                 if product.sub_category.category:
                     category_name = product.sub_category.category.name
             elif product.subcategory_id:
-                # Fallback: query directly
-                subcategory = SubCategory.query.get(product.subcategory_id)
-                if subcategory:
-                    subcategory_name = subcategory.name
-                    if subcategory.category:
-                        category_name = subcategory.category.name
+                # Fallback: names from the cached category tree
+                subcategory_name = tree.subcategory_names.get(product.subcategory_id, '')
+                category_name = tree.category_name(product.subcategory_id)
             
             csv_data.append([
                 product.id,
@@ -876,6 +766,7 @@ def export_products_by_category_csv():
     try:
         # Get branch filter from query parameter
         branch_id = request.args.get('branch_id', type=int)
+        tree = get_category_tree()
         
         if branch_id:
             # Export branch-specific products
@@ -899,10 +790,8 @@ def export_products_by_category_csv():
                 if hasattr(product, 'sub_category') and product.sub_category and product.sub_category.category:
                     category_name = product.sub_category.category.name
                 elif product.subcategory_id:
-                    # Fallback: query the subcategory and category directly
-                    subcategory = SubCategory.query.get(product.subcategory_id)
-                    if subcategory and subcategory.category:
-                        category_name = subcategory.category.name
+                    # Fallback: category name from the cached category tree
+                    category_name = tree.category_name(product.subcategory_id, category_name)
                 
                 if category_name not in products_by_category:
                     products_by_category[category_name] = []
@@ -970,10 +859,8 @@ def export_products_by_category_csv():
                 if hasattr(product, 'sub_category') and product.sub_category and product.sub_category.category:
                     category_name = product.sub_category.category.name
                 elif product.subcategory_id:
-                    # Fallback: query the subcategory and category directly
-                    subcategory = SubCategory.query.get(product.subcategory_id)
-                    if subcategory and subcategory.category:
-                        category_name = subcategory.category.name
+                    # Fallback: category name from the cached category tree
+                    category_name = tree.category_name(product.subcategory_id, category_name)
                 
                 if category_name not in products_by_category:
                     products_by_category[category_name] = []
@@ -1031,6 +918,7 @@ def export_products_by_category_pdf():
     try:
         # Get branch filter from query parameter
         branch_id = request.args.get('branch_id', type=int)
+        tree = get_category_tree()
         branch = None
         if branch_id:
             branch = Branch.query.get(branch_id)
@@ -1057,10 +945,8 @@ def export_products_by_category_pdf():
                 if hasattr(product, 'sub_category') and product.sub_category and product.sub_category.category:
                     category_name = product.sub_category.category.name
                 elif product.subcategory_id:
-                    # Fallback: query the subcategory and category directly
-                    subcategory = SubCategory.query.get(product.subcategory_id)
-                    if subcategory and subcategory.category:
-                        category_name = subcategory.category.name
+                    # Fallback: category name from the cached category tree
+                    category_name = tree.category_name(product.subcategory_id, category_name)
                 
                 if category_name not in products_by_category:
                     products_by_category[category_name] = []
@@ -1087,10 +973,8 @@ def export_products_by_category_pdf():
                 if hasattr(product, 'sub_category') and product.sub_category and product.sub_category.category:
                     category_name = product.sub_category.category.name
                 elif product.subcategory_id:
-                    # Fallback: query the subcategory and category directly
-                    subcategory = SubCategory.query.get(product.subcategory_id)
-                    if subcategory and subcategory.category:
-                        category_name = subcategory.category.name
+                    # Fallback: category name from the cached category tree
+                    category_name = tree.category_name(product.subcategory_id, category_name)
                 
                 if category_name not in products_by_category:
                     products_by_category[category_name] = []
@@ -1135,11 +1019,11 @@ def export_products_by_category_pdf():
         # Load the logo image
         try:
             logo_path = os.path.join(app.static_folder, 'assets', 'img', 'logo.png')
-            print(f"Loading logo from: {logo_path}")
+            pdf_trace.debug('pdf_logo', path=logo_path)
             logo_image = Image(logo_path, width=1.5*inch, height=1*inch)
             logo_cell = logo_image
         except Exception as e:
-            print(f"Error loading logo: {e}")
+            pdf_trace.warning('pdf_logo_failed', path=logo_path, error=str(e))
             # Create a placeholder if logo fails to load
             logo_cell = Paragraph('''
             <para align=left>
@@ -1276,9 +1160,10 @@ def export_products_by_category_pdf():
 def branch_products(branch_id):
     # Get the specific branch
     branch = Branch.query.get_or_404(branch_id)
-    categories = Category.query.order_by(Category.name).all()
-    subcategories = SubCategory.query.order_by(SubCategory.name).all()
-    branches = Branch.query.order_by(Branch.name).all()
+    tree = get_category_tree()
+    categories = tree.categories
+    subcategories = tree.subcategories
+    branches = get_branch_directory()
     
     # Search and filter parameters
     search = request.args.get('search', '')
@@ -1463,8 +1348,9 @@ def delete_category(id):
 @login_required
 @role_required(['admin'])
 def product_catalog():
-    categories = Category.query.order_by(Category.name).all()
-    subcategories = SubCategory.query.order_by(SubCategory.name).all()
+    tree = get_category_tree()
+    categories = tree.categories
+    subcategories = tree.subcategories
     
     # Search and filter parameters
     search = request.args.get('search', '')
@@ -1751,7 +1637,7 @@ def add_new_product_to_branch():
             try:
                 # Upload to Cloudinary
                 image_url = upload_to_cloudinary(image)
-                print(f"Image uploaded successfully: {image_url}")
+                catalog_trace.debug('image_uploaded', url=image_url)
             except Exception as e:
                 print(f"Error uploading image to Cloudinary: {e}")
                 image_url = None
@@ -1850,13 +1736,12 @@ def delete_branch_product(id):
         branch_product = BranchProduct.query.get_or_404(id)
         branch_id = branch_product.branchid
         
-        print(f"Attempting to delete branch product {id} from branch {branch_id}")
-        
         # Check if branch product has related records
         order_items_count = len(branch_product.order_items) if branch_product.order_items else 0
         stock_transactions_count = len(branch_product.stock_transactions) if branch_product.stock_transactions else 0
         
-        print(f"Order items: {order_items_count}, Stock transactions: {stock_transactions_count}")
+        catalog_trace.debug('branch_product_delete', branch_product_id=id, branch_id=branch_id,
+                            order_items=order_items_count, stock_transactions=stock_transactions_count)
         
         if order_items_count > 0 or stock_transactions_count > 0:
             flash('Cannot delete this branch product. It has associated orders or stock transactions.', 'error')
@@ -1881,6 +1766,7 @@ def delete_branch_product(id):
 @app.route('/sales_performance')
 @login_required
 @role_required(['admin'])
+@cached_report(Order, Payment)
 def sales_performance():
     """Sales performance page showing salespeople's order counts and revenue"""
     try:
@@ -1891,102 +1777,24 @@ def sales_performance():
         
         # Default to last 30 days if no dates provided
         if not start_date:
-            start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+            start_date = (datetime.now(EAT) - timedelta(days=30)).strftime('%Y-%m-%d')
         if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-        
-        # Convert string dates to datetime objects
-        start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-        end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)  # Include full end date
-        
-        # Base query for sales performance - match salesperson orders logic
-        # First get all orders for each user
-        orders_query = db.session.query(
-            User.id,
-            User.firstname,
-            User.lastname,
-            User.email,
-            func.count(Order.id).label('total_orders')
-        ).join(Order, User.id == Order.userid).filter(
-            Order.created_at >= start_datetime,
-            Order.created_at < end_datetime
-        )
-        
-        # Add branch filter if specified
-        if branch_id:
-            orders_query = orders_query.filter(Order.branchid == branch_id)
-        
-        # Group by user to get order counts
-        orders_data = orders_query.group_by(
-            User.id, User.firstname, User.lastname, User.email
-        ).all()
-        
-        # Now get revenue data separately (matching salesperson orders logic)
-        revenue_data = {}
-        for user_data in orders_data:
-            user_id = user_data.id
-            # Calculate revenue from completed payments only (same as salesperson orders)
-            completed_payments_query = db.session.query(func.sum(Payment.amount)).join(
-                Order, Payment.orderid == Order.id
-            ).filter(
-                Order.userid == user_id,
-                Order.created_at >= start_datetime,
-                Order.created_at < end_datetime,
-                Payment.payment_status == 'completed'
-            )
-            
-            # Add branch filter if specified
-            if branch_id:
-                completed_payments_query = completed_payments_query.filter(Order.branchid == branch_id)
-            
-            total_revenue = completed_payments_query.scalar() or 0
-            
-            # Calculate completed orders count (orders that have been approved)
-            completed_orders_query = db.session.query(func.count(Order.id)).filter(
-                Order.userid == user_id,
-                Order.created_at >= start_datetime,
-                Order.created_at < end_datetime,
-                Order.approvalstatus.is_(True)
-            )
-            
-            # Add branch filter if specified
-            if branch_id:
-                completed_orders_query = completed_orders_query.filter(Order.branchid == branch_id)
-            
-            completed_orders = completed_orders_query.scalar() or 0
-            
-            revenue_data[user_id] = {
-                'total_revenue': total_revenue,
-                'completed_orders': completed_orders,
-                'completed_revenue': total_revenue
-            }
+            end_date = datetime.now(EAT).strftime('%Y-%m-%d')
         
-        # Combine the data
-        sales_data = []
-        for order_data in orders_data:
-            user_id = order_data.id
-            revenue_info = revenue_data.get(user_id, {
-                'total_revenue': 0,
-                'completed_orders': 0,
-                'completed_revenue': 0
-            })
-            
-            sales_data.append({
-                'id': user_id,
-                'firstname': order_data.firstname,
-                'lastname': order_data.lastname,
-                'email': order_data.email,
-                'total_orders': order_data.total_orders,
-                'total_revenue': revenue_info['total_revenue'],
-                'completed_orders': revenue_info['completed_orders'],
-                'completed_revenue': revenue_info['completed_revenue']
-            })
+        # EAT midnight bounds, including the full end date
+        start_datetime, end_datetime = eat_day_range(
+            datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')
+        )
         
-        # Sort by total revenue descending
-        sales_data.sort(key=lambda x: x['total_revenue'], reverse=True)
+        # All salespeople in one grouped query (plus one for the daily trend)
+        show_trend = request.args.get('trend') == '1'
+        sales_data = [
+            salesperson.as_dict()
+            for salesperson in get_salesperson_stats(start_datetime, end_datetime, branch_id, daily=show_trend)
+        ]
         
         # Get branches for filter dropdown
-        branches = Branch.query.order_by(Branch.name).all()
+        branches = get_branch_directory()
         
         # Calculate summary statistics
         total_salespeople = len(sales_data)
@@ -2005,7 +1813,8 @@ def sales_performance():
                              total_orders=total_orders,
                              total_revenue=total_revenue,
                              total_completed_orders=total_completed_orders,
-                             total_completed_revenue=total_completed_revenue)
+                             total_completed_revenue=total_completed_revenue,
+                             show_trend=show_trend)
         
     except Exception as e:
         print(f"Error loading sales performance: {str(e)}")
@@ -2025,13 +1834,14 @@ def salesperson_orders(user_id):
         
         # Default to last 30 days if no dates provided
         if not start_date:
-            start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+            start_date = (datetime.now(EAT) - timedelta(days=30)).strftime('%Y-%m-%d')
         if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
+            end_date = datetime.now(EAT).strftime('%Y-%m-%d')
         
-        # Convert string dates to datetime objects
-        start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-        end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)  # Include full end date
+        # EAT midnight bounds, including the full end date
+        start_datetime, end_datetime = eat_day_range(
+            datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')
+        )
         
         # Get salesperson info
         salesperson = User.query.get(user_id)
@@ -2039,125 +1849,29 @@ def salesperson_orders(user_id):
             flash('Salesperson not found.', 'error')
             return redirect(url_for('sales_performance'))
         
-        # Get orders for this salesperson with date filter
-        orders_query = Order.query.filter(
-            Order.userid == user_id,
-            Order.created_at >= start_datetime,
-            Order.created_at < end_datetime
+        # Period figures, then one page of orders with their items and payments
+        # in batched queries (see salesperson_stats.py)
+        drilldown = get_salesperson_orders(
+            user_id, start_datetime, end_datetime, branch_id,
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 20, type=int)
         )
         
-        # Add branch filter if specified
-        if branch_id:
-            orders_query = orders_query.filter(Order.branchid == branch_id)
-        
-        orders = orders_query.order_by(Order.created_at.desc()).all()
-        
-        # Calculate totals using the same logic as sales performance
-        # Total orders count (all orders regardless of payment status) - use SQL COUNT like sales performance
-        total_orders_count_query = db.session.query(func.count(Order.id)).filter(
-            Order.userid == user_id,
-            Order.created_at >= start_datetime,
-            Order.created_at < end_datetime
-        )
-        
-        # Add branch filter if specified
-        if branch_id:
-            total_orders_count_query = total_orders_count_query.filter(Order.branchid == branch_id)
-        
-        total_orders_count = total_orders_count_query.scalar() or 0
-        
-        # Total revenue from completed payments only (matching sales performance logic)
-        completed_payments_query = db.session.query(func.sum(Payment.amount)).join(
-            Order, Payment.orderid == Order.id
-        ).filter(
-            Order.userid == user_id,
-            Order.created_at >= start_datetime,
-            Order.created_at < end_datetime,
-            Payment.payment_status == 'completed'
-        )
-        
-        # Add branch filter if specified
-        if branch_id:
-            completed_payments_query = completed_payments_query.filter(Order.branchid == branch_id)
-        
-        total_revenue = completed_payments_query.scalar() or 0
-        
-        # Calculate completed orders count (orders that have been approved)
-        # Debug: Let's check what approvalstatus values exist
-        debug_orders = Order.query.filter(Order.userid == user_id).all()
-        print(f"🔍 Debug: Found {len(debug_orders)} orders for user {user_id}")
-        for order in debug_orders[:5]:  # Show first 5 orders
-            print(f"  Order {order.id}: approvalstatus = {order.approvalstatus} (type: {type(order.approvalstatus)})")
-        
-        completed_orders_query = db.session.query(func.count(Order.id)).filter(
-            Order.userid == user_id,
-            Order.created_at >= start_datetime,
-            Order.created_at < end_datetime,
-            Order.approvalstatus.is_(True)
-        )
-        
-        # Add branch filter if specified
-        if branch_id:
-            completed_orders_query = completed_orders_query.filter(Order.branchid == branch_id)
-        
-        completed_orders_count = completed_orders_query.scalar() or 0
-        print(f"🔍 Debug: Completed orders count = {completed_orders_count}")
-        
-        # Get order items with product details for each order
-        orders_with_items = []
-        total_profit = 0
-        
-        for order in orders:
-            # Get order items with product details
-            order_items = db.session.query(OrderItem, BranchProduct, ProductCatalog).outerjoin(
-                BranchProduct, OrderItem.branch_productid == BranchProduct.id
-            ).outerjoin(
-                ProductCatalog, BranchProduct.catalog_id == ProductCatalog.id
-            ).filter(OrderItem.orderid == order.id).all()
-            
-            # Calculate order totals (for display purposes)
-            order_revenue = sum(item.OrderItem.quantity * item.OrderItem.final_price for item in order_items)
-            order_profit = sum((item.OrderItem.final_price - item.OrderItem.buying_price) * item.OrderItem.quantity 
-                             for item in order_items if item.OrderItem.buying_price and item.OrderItem.final_price)
-            
-            # Get payment info for this order
-            payments = Payment.query.filter(Payment.orderid == order.id).all()
-            payment_status = 'pending'
-            total_paid = 0
-            if payments:
-                completed_payments = [p for p in payments if p.payment_status == 'completed']
-                total_paid = sum(p.amount for p in completed_payments)
-                if total_paid >= order_revenue:
-                    payment_status = 'completed'
-                elif total_paid > 0:
-                    payment_status = 'partially_paid'
-            
-            orders_with_items.append({
-                'order': order,
-                'order_items': order_items,
-                'order_revenue': order_revenue,
-                'order_profit': order_profit,
-                'payment_status': payment_status,
-                'total_paid': total_paid,
-                'payments': payments
-            })
-            
-            total_profit += order_profit
-        
         # Get branches for filter dropdown
-        branches = Branch.query.order_by(Branch.name).all()
+        branches = get_branch_directory()
         
         return render_template('salesperson_orders.html',
                              salesperson=salesperson,
-                             orders_with_items=orders_with_items,
+                             orders_with_items=drilldown.orders,
+                             pagination=drilldown.pagination,
                              branches=branches,
                              selected_branch_id=branch_id,
                              start_date=start_date,
                              end_date=end_date,
-                             total_revenue=total_revenue,
-                             total_profit=total_profit,
-                             total_orders=total_orders_count,
-                             completed_orders=completed_orders_count)
+                             total_revenue=drilldown.total_revenue,
+                             total_profit=drilldown.total_profit,
+                             total_orders=drilldown.total_orders,
+                             completed_orders=drilldown.completed_orders)
         
     except Exception as e:
         print(f"Error loading salesperson orders: {str(e)}")
@@ -2466,10 +2180,6 @@ def stock_history(branch_product_id):
     branch_product = BranchProduct.query.get_or_404(branch_product_id)
     transactions = StockTransaction.query.filter_by(branch_productid=branch_product_id).order_by(StockTransaction.created_at.desc()).all()
     
-    # Add adjusted times (3 hours ahead) for display
-    for transaction in transactions:
-        transaction.created_at_adjusted = transaction.created_at + timedelta(hours=3)
-    
     return render_template('stock_history.html', branch_product=branch_product, transactions=transactions)
 
 @app.route('/export_stock_history_pdf/<int:branch_product_id>')
@@ -2580,9 +2290,7 @@ def export_stock_history_pdf(branch_product_id):
         
         # Add transaction rows
         for transaction in transactions:
-            # Adjust time (3 hours ahead)
-            adjusted_time = transaction.created_at + timedelta(hours=3)
-            date_time = adjusted_time.strftime('%Y-%m-%d %H:%M:%S')
+            date_time = to_eat(transaction.created_at).strftime('%Y-%m-%d %H:%M:%S')
             
             # Format transaction type
             trans_type = 'Add' if transaction.transaction_type == 'add' else 'Remove'
@@ -2691,7 +2399,6 @@ def toggle_display(branch_product_id):
 @role_required(['admin'])
 def users():
     try:
-        print("Users route accessed")
         # Pagination parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -2702,13 +2409,8 @@ def users():
             per_page=per_page, 
             error_out=False
         )
-        print(f"Pagination object: {pagination}")
         users = pagination.items
-        print(f"Users found: {len(users)}")
-        
-        # Add adjusted times (3 hours ahead) for display
-        for user in users:
-            user.created_at_adjusted = user.created_at + timedelta(hours=3)
+        auth_trace.debug('users_listed', page=page, users=len(users), total=pagination.total)
         
         return render_template('users.html', users=users, pagination=pagination)
     except Exception as e:
@@ -2774,7 +2476,7 @@ def add_user():
             return redirect(url_for('add_user'))
     
     # Get all branches for the form
-    branches = Branch.query.order_by(Branch.name).all()
+    branches = get_branch_directory()
     return render_template('add_user.html', branches=branches)
 
 @app.route('/edit_user/<int:id>', methods=['GET', 'POST'])
@@ -2835,7 +2537,7 @@ def edit_user(id):
             return redirect(url_for('edit_user', id=id))
     
     # Get all branches for the form
-    branches = Branch.query.order_by(Branch.name).all()
+    branches = get_branch_directory()
     return render_template('edit_user.html', user=user, branches=branches)
 
 @app.route('/delete_user/<int:id>', methods=['POST'])
@@ -2875,238 +2577,58 @@ def delete_user(id):
 @role_required(['admin'])
 def orders():
     try:
-        print("Orders route accessed")
-        # Pagination parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        # Pagination parameters (keyset cursors, see keyset_pagination.py)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
         
         # Filter parameters
         status_filter = request.args.get('status', '')
         payment_filter = request.args.get('payment_status', '')
         branch_filter = request.args.get('branch_id', type=int)
         
-        # Base query with joins and eager loading
+        # Base query with joins and eager loading (item figures are stored on the order)
         base_query = db.session.query(Order).options(
             db.joinedload(Order.user),
             db.joinedload(Order.ordertype),
-            db.joinedload(Order.branch),
-            # Legacy product relationship removed - using branch_product only
-            db.joinedload(Order.order_items).joinedload(OrderItem.branch_product).joinedload(BranchProduct.catalog_product)
+            db.joinedload(Order.branch)
         )
         
         # Apply filters
-        if status_filter:
-            if status_filter == 'approved':
-                base_query = base_query.filter(Order.approvalstatus == True)
-            elif status_filter == 'pending':
-                base_query = base_query.filter(Order.approvalstatus == False)
-        
-        if payment_filter:
-            base_query = base_query.filter(Order.payment_status == payment_filter)
-        
-        if branch_filter:
-            base_query = base_query.filter(Order.branchid == branch_filter)
-        
-        # Order by creation date (newest first)
-        base_query = base_query.order_by(Order.created_at.desc())
-        
-        # Apply pagination
-        pagination = base_query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
+        filters = order_list_filters(status_filter, payment_filter, branch_filter)
+        base_query = base_query.filter(*filters)
+        
+        # Newest first; seeks on (created_at, id) so deep pages cost the same as
+        # the first one and no COUNT(*) is needed to page
+        pagination = keyset_paginate(
+            base_query, (Order.created_at, Order.id),
+            after=after, before=before, per_page=per_page
         )
-        
         orders = pagination.items
-        print(f"Orders found: {len(orders)}")
-        
-        # Debug: Check the first order's data
-        if orders:
-            first_order = orders[0]
-            print(f"First order ID: {first_order.id}")
-            print(f"First order user: {first_order.user.firstname if first_order.user else 'No user'}")
-            print(f"First order branch: {first_order.branch.name if first_order.branch else 'No branch'}")
-            print(f"First order items count: {len(first_order.order_items) if first_order.order_items else 0}")
-            
-            if first_order.order_items:
-                first_item = first_order.order_items[0]
-                print(f"First item product: {first_item.branch_product.catalog_product.name if first_item.branch_product and first_item.branch_product.catalog_product else 'No product'}")
-                print(f"First item final_price: {first_item.final_price}")
-                print(f"First item product sellingprice: {first_item.branch_product.sellingprice if first_item.branch_product else 'No product'}")
-        
-        # Calculate and update payment status for all orders
-        for order in orders:
-            print(f"\nCalculating total for order {order.id}:")
-            # Calculate order total
-            total_amount = 0
-            for item in order.order_items:
-                print(f"  Item {item.id}: quantity={item.quantity}, final_price={item.final_price}")
-                
-                # Handle both cases: products with relationships and manually entered items
-                if item.final_price:
-                    # Use the final_price if available (for manually entered items or negotiated prices)
-                    item_total = item.final_price * item.quantity
-                    total_amount += item_total
-                    print(f"    Using final_price: {item.final_price} * {item.quantity} = {item_total}")
-                elif item.branch_product and item.branch_product.sellingprice:
-                    # Use branch product's selling price if no final_price but branch product relationship exists
-                    item_total = item.branch_product.sellingprice * item.quantity
-                    total_amount += item_total
-                    print(f"    Using branch_product.sellingprice: {item.branch_product.sellingprice} * {item.quantity} = {item_total}")
-                elif hasattr(item, 'product_name') and item.product_name:
-                    # For manually entered items without product relationship, check if they have a price
-                    if item.original_price:
-                        item_total = item.original_price * item.quantity
-                        total_amount += item_total
-                        print(f"    Using original_price for manual item '{item.product_name}': {item.original_price} * {item.quantity} = {item_total}")
-                    else:
-                        print(f"    Manual item '{item.product_name}' has no price available")
-                else:
-                    print(f"    No price available for item {item.id}")
-            
-            print(f"  Order {order.id} total: {total_amount}")
-            # Store the calculated total on the order object for template use
-            order.calculated_total = total_amount
-            
-            # Calculate profit for the order using OrderItem fields directly
-            order_profit = 0
-            print(f"🔍 Calculating profit for order {order.id} with {len(order.order_items)} items")
-            for item in order.order_items:
-                print(f"  📦 Item {item.id}: final_price={item.final_price}, buying_price={item.buying_price}")
-                
-                # Use final_price as selling price and buying_price from OrderItem table
-                if item.final_price and item.buying_price:
-                    item_profit = (item.final_price - item.buying_price) * item.quantity
-                    order_profit += item_profit
-                    print(f"    💰 Profit: ({item.final_price} - {item.buying_price}) × {item.quantity} = {item_profit}")
-                else:
-                    print(f"    ⚠️ Cannot calculate profit - missing price data")
-                    print(f"      final_price: {item.final_price}")
-                    print(f"      buying_price: {item.buying_price}")
-            
-            # Store the calculated profit on the order object for template use
-            order.calculated_profit = order_profit
-            print(f"🔍 Order {order.id}: calculated_profit = {order_profit}")
-            
-            # Calculate total payments received
-            total_payments = Decimal('0')
-            for payment in order.payments:
-                if payment.payment_status == 'completed':
-                    total_payments += Decimal(str(payment.amount))
-            
-            # Determine payment status
-            if total_payments >= total_amount:
-                payment_status = 'paid'
-            elif total_payments > 0:
-                payment_status = 'partially_paid'
-            else:
-                payment_status = 'not_paid'
-            
-            # Update the order's payment_status field if it's different
-            if order.payment_status != payment_status:
-                order.payment_status = payment_status
-        
-        # Commit all payment status updates
-        try:
-            db.session.commit()
-        except Exception as e:
-            print(f"Error updating payment statuses: {e}")
-            db.session.rollback()
         
-        # Add adjusted times (3 hours ahead) for display
+        # Totals, profit and payment_status are maintained on write (see order_accounting.py)
+        order_figures = get_order_figures(orders)
         for order in orders:
-            order.created_at_adjusted = order.created_at + timedelta(hours=3)
-            if order.approved_at:
-                order.approved_at_adjusted = order.approved_at + timedelta(hours=3)
+            totals = order_figures[order.id]
+            order.calculated_total = totals.total_amount
+            order.calculated_profit = totals.total_profit
+        
+        # AJAX page loads only need the table, with an approximate total
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            pagination.total = estimate_count(base_query.with_entities(Order.id).statement)
+            return render_template('orders_table_partial.html',
+                                 orders=orders,
+                                 pagination=pagination,
+                                 status_filter=status_filter,
+                                 payment_filter=payment_filter,
+                                 branch_filter=branch_filter)
         
         # Get filter options
-        branches = Branch.query.order_by(Branch.name).all()
-        
-        # Calculate order statistics (using the same filters as the main query)
-        stats_query = db.session.query(Order)
-        
-        # Apply the same filters for statistics
-        if status_filter:
-            if status_filter == 'approved':
-                stats_query = stats_query.filter(Order.approvalstatus == True)
-            elif status_filter == 'pending':
-                stats_query = stats_query.filter(Order.approvalstatus == False)
-        
-        if payment_filter:
-            stats_query = stats_query.filter(Order.payment_status == payment_filter)
-        
-        if branch_filter:
-            stats_query = stats_query.filter(Order.branchid == branch_filter)
-        
-        # Calculate statistics
-        total_orders = stats_query.count()
-        paid_orders = stats_query.filter(Order.payment_status == 'paid').count()
-        pending_orders = stats_query.filter(Order.approvalstatus == False).count()
-        
-        # Calculate total revenue (only from paid orders)
-        total_revenue = db.session.query(
-            db.func.sum(OrderItem.quantity * OrderItem.final_price)
-        ).join(Order, OrderItem.orderid == Order.id).filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            OrderItem.final_price.isnot(None)
-        )
-        
-        # Apply same filters to revenue calculation
-        if status_filter:
-            if status_filter == 'approved':
-                total_revenue = total_revenue.filter(Order.approvalstatus == True)
-            elif status_filter == 'pending':
-                total_revenue = total_revenue.filter(Order.approvalstatus == False)
-        
-        if branch_filter:
-            total_revenue = total_revenue.filter(Order.branchid == branch_filter)
-        
-        total_revenue = total_revenue.scalar() or 0.0
-        
-        # Calculate profit statistics
-        # Total profit calculation (all time)
-        total_profit_query = db.session.query(
-            db.func.sum((OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity)
-        ).join(Order, OrderItem.orderid == Order.id).filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            OrderItem.final_price.isnot(None),
-            OrderItem.buying_price.isnot(None)
-        )
-        
-        # Apply same filters to profit calculation
-        if status_filter:
-            if status_filter == 'approved':
-                total_profit_query = total_profit_query.filter(Order.approvalstatus == True)
-            elif status_filter == 'pending':
-                total_profit_query = total_profit_query.filter(Order.approvalstatus == False)
-        
-        if branch_filter:
-            total_profit_query = total_profit_query.filter(Order.branchid == branch_filter)
-        
-        total_profit = total_profit_query.scalar() or 0.0
-        
-        # Monthly profit calculation (current month)
-        current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        monthly_profit_query = db.session.query(
-            db.func.sum((OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity)
-        ).join(Order, OrderItem.orderid == Order.id).filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            OrderItem.final_price.isnot(None),
-            OrderItem.buying_price.isnot(None),
-            Order.created_at >= current_month_start
-        )
-        
-        # Apply same filters to monthly profit calculation
-        if status_filter:
-            if status_filter == 'approved':
-                monthly_profit_query = monthly_profit_query.filter(Order.approvalstatus == True)
-            elif status_filter == 'pending':
-                monthly_profit_query = monthly_profit_query.filter(Order.approvalstatus == False)
-        
-        if branch_filter:
-            monthly_profit_query = monthly_profit_query.filter(Order.branchid == branch_filter)
+        branches = get_branch_directory()
         
-        monthly_profit = monthly_profit_query.scalar() or 0.0
+        # Statistics for the same filters as the list, in one pass
+        stats = get_order_stats(filters)
+        pagination.total = stats.total_orders
         
         return render_template('orders.html', 
                              orders=orders, 
@@ -3115,12 +2637,12 @@ def orders():
                              status_filter=status_filter,
                              payment_filter=payment_filter,
                              branch_filter=branch_filter,
-                             total_orders=total_orders,
-                             paid_orders=paid_orders,
-                             pending_orders=pending_orders,
-                             total_revenue=float(total_revenue),
-                             total_profit=float(total_profit),
-                             monthly_profit=float(monthly_profit))
+                             total_orders=stats.total_orders,
+                             paid_orders=stats.paid_orders,
+                             pending_orders=stats.pending_orders,
+                             total_revenue=float(stats.total_revenue),
+                             total_profit=float(stats.total_profit),
+                             monthly_profit=float(stats.monthly_profit))
     except Exception as e:
         print(f"Error in orders route: {e}")
         db.session.rollback()
@@ -3152,39 +2674,12 @@ def order_details(order_id):
                 item_profit = (item.final_price - item.buying_price) * item.quantity
                 order_profit += item_profit
         
-        # Calculate payment status based on actual payments received
+        # Payments received; the payment status itself is maintained on write
         total_payments = Decimal('0')
         for payment in order.payments:
             if payment.payment_status == 'completed':
                 total_payments += Decimal(str(payment.amount))
-        
-        # Determine payment status
-        if total_payments >= total_amount:
-            payment_status = 'paid'
-        elif total_payments > 0:
-            payment_status = 'partially_paid'
-        else:
-            payment_status = 'not_paid'
-        
-        # Update the order's payment_status field
-        if order.payment_status != payment_status:
-            order.payment_status = payment_status
-            try:
-                db.session.commit()
-            except Exception as e:
-                print(f"Error updating payment status: {e}")
-                db.session.rollback()
-        
-        # Add adjusted times (3 hours ahead) for display
-        
-        # Create adjusted time attributes for the order
-        order.created_at_adjusted = order.created_at + timedelta(hours=3)
-        if order.approved_at:
-            order.approved_at_adjusted = order.approved_at + timedelta(hours=3)
-        
-        # Create adjusted time attributes for payments
-        for payment in order.payments:
-            payment.created_at_adjusted = payment.created_at + timedelta(hours=3)
+        payment_status = order.payment_status
         
         return render_template('order_details.html', order=order, total_amount=total_amount, total_payments=total_payments, payment_status=payment_status, total_profit=order_profit)
     except Exception as e:
@@ -3230,6 +2725,7 @@ def reject_order(order_id):
 @app.route('/profit_loss')
 @login_required
 @role_required(['admin'])
+@cached_report(ProductCatalog, BranchProduct, Order, OrderItem, Expense, ProfitLossClose)
 def profit_loss():
     try:
         # Get date range from query parameters
@@ -3246,111 +2742,29 @@ def profit_loss():
         start_dt = datetime.strptime(start_date, '%Y-%m-%d')
         end_dt = datetime.strptime(end_date, '%Y-%m-%d')
         
-        # Calculate Revenue (from completed orders)
-        # Use BranchProduct for new orders, fallback to ProductCatalog for legacy orders
-        revenue_query = db.session.query(
-            db.func.sum(OrderItem.quantity * OrderItem.final_price)
-        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).outerjoin(ProductCatalog, OrderItem.productid == ProductCatalog.id).join(
-            Order, OrderItem.orderid == Order.id
-        ).filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        )
-        total_revenue = revenue_query.scalar() or 0
-        
-        # Calculate Cost of Goods Sold (COGS)
-        # Use BranchProduct buying price for new orders, fallback to ProductCatalog for legacy orders
-        cogs_query = db.session.query(
-            db.func.sum(OrderItem.quantity * db.func.coalesce(BranchProduct.buyingprice, ProductCatalog.buyingprice, 0))
-        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).outerjoin(ProductCatalog, OrderItem.productid == ProductCatalog.id).join(
-            Order, OrderItem.orderid == Order.id
-        ).filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        )
-        total_cogs = cogs_query.scalar() or 0
+        # Closed months/days from the period close table, edges computed live (see period_close.py)
+        pl = get_profit_loss(start_dt.date(), end_dt.date())
+        total_revenue = pl.total_revenue
+        total_cogs = pl.total_cogs
+        total_expenses = pl.total_expenses
+        expenses_by_category = pl.expenses_by_category
+        total_orders = pl.total_orders
+        paid_orders = pl.paid_orders
+        top_products = pl.top_products
+        
+        # Total product asset for percentage calculation
+        total_product_asset = db.session.execute(select(
+            func.sum(BranchProduct.buyingprice * BranchProduct.stock)
+        ).where(has_asset_value())).scalar() or 0
         
-        # Calculate Gross Profit
+        # Calculate Gross and Net Profit
         gross_profit = total_revenue - total_cogs
-        
-        # Calculate Total Expenses (approved expenses only)
-        total_expenses = db.session.query(
-            db.func.sum(Expense.amount)
-        ).filter(
-            Expense.status == 'approved',
-            Expense.expense_date >= start_dt.date(),
-            Expense.expense_date <= end_dt.date()
-        ).scalar() or 0
-        
-        # Calculate Net Profit
         net_profit = gross_profit - total_expenses
         
-        # Get expense breakdown by category
-        expenses_by_category = db.session.query(
-            Expense.category,
-            db.func.sum(Expense.amount).label('total_amount'),
-            db.func.count(Expense.id).label('count')
-        ).filter(
-            Expense.status == 'approved',
-            Expense.expense_date >= start_dt.date(),
-            Expense.expense_date <= end_dt.date()
-        ).group_by(Expense.category).order_by(
-            db.func.sum(Expense.amount).desc()
-        ).all()
-        
-        # Get order statistics
-        total_orders = Order.query.filter(
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        ).count()
-        
-        paid_orders = Order.query.filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        ).count()
-        
-        # Get top selling products
-        # Use BranchProduct for new orders, fallback to ProductCatalog for legacy orders
-        top_products = db.session.query(
-            db.func.coalesce(ProductCatalog.name, ProductCatalog.name).label('product_name'),
-            db.func.sum(OrderItem.quantity).label('total_quantity'),
-            db.func.sum(OrderItem.quantity * OrderItem.final_price).label('total_revenue')
-        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).outerjoin(ProductCatalog, BranchProduct.catalog_id == ProductCatalog.id).outerjoin(ProductCatalog, OrderItem.productid == ProductCatalog.id).join(
-            Order, OrderItem.orderid == Order.id
-        ).filter(
-            Order.payment_status.in_(['paid', 'partially_paid']),
-            Order.created_at >= start_dt,
-            Order.created_at <= end_dt
-        ).group_by(db.func.coalesce(ProductCatalog.name, ProductCatalog.name)).order_by(
-            db.func.sum(OrderItem.quantity).desc()
-        ).limit(10).all()
-        
         # Top products by asset value (buying price * stock)
         top_products_by_asset_value = db.session.query(
-            ProductCatalog, (ProductCatalog.buyingprice * ProductCatalog.stock).label('asset_value')
-        ).filter(
-            and_(
-                ProductCatalog.buyingprice.isnot(None),
-                ProductCatalog.buyingprice > 0,
-                ProductCatalog.stock.isnot(None),
-                ProductCatalog.stock > 0
-            )
-        ).order_by((ProductCatalog.buyingprice * ProductCatalog.stock).desc()).limit(5).all()
-        
-        # Calculate total product asset for percentage calculation
-        total_product_asset = db.session.query(
-            func.sum(BranchProduct.buyingprice * BranchProduct.stock)
-        ).filter(
-            and_(
-                BranchProduct.buyingprice.isnot(None),
-                BranchProduct.buyingprice > 0,
-                BranchProduct.stock.isnot(None),
-                BranchProduct.stock > 0
-            )
-        ).scalar() or 0
+            BranchProduct, (BranchProduct.buyingprice * BranchProduct.stock).label('asset_value')
+        ).filter(has_asset_value()).order_by((BranchProduct.buyingprice * BranchProduct.stock).desc()).limit(5).all()
         
         # Calculate percentage of total assets for each top product
         top_products_with_percentage = []
@@ -3390,6 +2804,7 @@ def profit_loss():
 @app.route('/balance_sheet')
 @login_required
 @role_required(['admin'])
+@cached_report(Category, SubCategory, ProductCatalog, BranchProduct, StockTransaction, StockSnapshot, Order, OrderItem, Payment, Expense)
 def balance_sheet():
     try:
         # Get date as of which to show balance sheet
@@ -3397,33 +2812,26 @@ def balance_sheet():
         if not as_of_date:
             as_of_date = datetime.now(EAT).strftime('%Y-%m-%d')
         
-        as_of_dt = datetime.strptime(as_of_date, '%Y-%m-%d')
+        as_of_dt = eat_day_start(datetime.strptime(as_of_date, '%Y-%m-%d'))
+        # Every figure is taken at the end of the balance sheet date, like the
+        # inventory valuation and the receivables aging
+        as_of_end = as_of_dt + timedelta(days=1)
         
         # Calculate Assets
-        # Inventory Value (current stock * buying price)
-        # Use BranchProduct for new inventory, fallback to ProductCatalog for legacy inventory
-        inventory_value = db.session.query(
-            db.func.sum(db.func.coalesce(BranchProduct.stock * BranchProduct.buyingprice, ProductCatalog.stock * ProductCatalog.buyingprice, 0))
-        ).outerjoin(BranchProduct, True).outerjoin(ProductCatalog, True).filter(
-            db.or_(BranchProduct.stock > 0, ProductCatalog.stock > 0)
-        ).scalar() or 0
+        # Inventory Value (stock on the balance sheet date * buying price, see inventory_valuation.py)
+        inventory_valuation = get_inventory_valuation(as_of_dt.date())
+        inventory_value = valuation_total(inventory_valuation)
         
-        # Accounts Receivable (pending payments)
-        accounts_receivable = db.session.query(
-            db.func.sum(OrderItem.quantity * OrderItem.final_price)
-        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).outerjoin(ProductCatalog, OrderItem.productid == ProductCatalog.id).join(
-            Order, OrderItem.orderid == Order.id
-        ).filter(
-            Order.payment_status == 'pending',
-            Order.created_at <= as_of_dt
-        ).scalar() or 0
+        # Accounts Receivable (order balances net of the payments completed by
+        # the balance sheet date, see ar_aging.py)
+        accounts_receivable = get_ar_aging(as_of_dt.date()).total.total
         
         # Cash (completed payments)
         cash = db.session.query(
             db.func.sum(Payment.amount)
         ).filter(
             Payment.payment_status == 'completed',
-            Payment.created_at <= as_of_dt
+            Payment.created_at < as_of_end
         ).scalar() or 0
         
         total_assets = inventory_value + accounts_receivable + cash
@@ -3436,20 +2844,20 @@ def balance_sheet():
         # Retained Earnings (simplified calculation)
         total_revenue = db.session.query(
             db.func.sum(OrderItem.quantity * OrderItem.final_price)
-        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).outerjoin(ProductCatalog, OrderItem.productid == ProductCatalog.id).join(
+        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).join(
             Order, OrderItem.orderid == Order.id
         ).filter(
             Order.payment_status.in_(['paid', 'partially_paid']),
-            Order.created_at <= as_of_dt
+            Order.created_at < as_of_end
         ).scalar() or 0
         
         total_cogs = db.session.query(
-            db.func.sum(OrderItem.quantity * db.func.coalesce(BranchProduct.buyingprice, ProductCatalog.buyingprice, 0))
-        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).outerjoin(ProductCatalog, OrderItem.productid == ProductCatalog.id).join(
+            db.func.sum(OrderItem.quantity * db.func.coalesce(OrderItem.buying_price, BranchProduct.buyingprice, 0))
+        ).select_from(OrderItem).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id).join(
             Order, OrderItem.orderid == Order.id
         ).filter(
             Order.payment_status.in_(['paid', 'partially_paid']),
-            Order.created_at <= as_of_dt
+            Order.created_at < as_of_end
         ).scalar() or 0
         
         # Calculate total expenses up to the balance sheet date
@@ -3465,13 +2873,8 @@ def balance_sheet():
         
         total_liabilities_equity = accounts_payable + retained_earnings
         
-        # Get inventory breakdown by category
-        inventory_by_category = db.session.query(
-            Category.name,
-            db.func.sum(ProductCatalog.stock * ProductCatalog.buyingprice).label('value')
-        ).select_from(Category).join(SubCategory, Category.id == SubCategory.category_id).join(
-            ProductCatalog, SubCategory.id == ProductCatalog.subcategory_id
-        ).filter(ProductCatalog.stock > 0).group_by(Category.id, Category.name).all()
+        # Get inventory breakdown by category (all branches)
+        inventory_by_category = valuation_by_category(inventory_valuation)
         
         # Get recent transactions
         recent_transactions = db.session.query(
@@ -3479,7 +2882,7 @@ def balance_sheet():
         ).select_from(Order).join(User, Order.userid == User.id).join(
             Branch, Order.branchid == Branch.id
         ).filter(
-            Order.created_at <= as_of_dt
+            Order.created_at < as_of_end
         ).order_by(Order.created_at.desc()).limit(10).all()
         
         return render_template('balance_sheet.html',
@@ -3498,13 +2901,76 @@ def balance_sheet():
         flash('An error occurred while loading balance sheet data.', 'error')
         return redirect(url_for('index'))
 
+@app.route('/ar_aging')
+@login_required
+@role_required(['admin'])
+@cached_report(Branch, User, Order, OrderItem, Payment)
+def ar_aging():
+    try:
+        # Date as of which balances are aged
+        as_of_date = request.args.get('as_of_date')
+        if not as_of_date:
+            as_of_date = datetime.now(EAT).strftime('%Y-%m-%d')
+        branch_id = request.args.get('branch_id', type=int)
+        
+        # Outstanding balances per branch and salesperson (see ar_aging.py)
+        aging = get_ar_aging(datetime.strptime(as_of_date, '%Y-%m-%d').date(), branch_id)
+        
+        return render_template('ar_aging.html',
+                             as_of_date=as_of_date,
+                             aging=aging,
+                             aging_buckets=AGING_BUCKETS,
+                             branches=get_branch_directory(),
+                             selected_branch_id=branch_id)
+    except Exception as e:
+        print(f"Error in ar_aging route: {e}")
+        flash('An error occurred while loading receivables aging data.', 'error')
+        return redirect(url_for('index'))
+
+@app.route('/ar_aging/orders')
+@login_required
+@role_required(['admin'])
+@cached_report(Branch, User, Order, OrderItem, Payment)
+def ar_aging_orders():
+    try:
+        as_of_date = request.args.get('as_of_date')
+        if not as_of_date:
+            as_of_date = datetime.now(EAT).strftime('%Y-%m-%d')
+        bucket = request.args.get('bucket')
+        branch_id = request.args.get('branch_id', type=int)
+        user_id = request.args.get('user_id', type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        
+        # Outstanding orders behind an aging figure, oldest first (keyset pagination)
+        pagination = get_outstanding_orders(
+            datetime.strptime(as_of_date, '%Y-%m-%d').date(), bucket, branch_id, user_id,
+            after=request.args.get('after'), before=request.args.get('before'), per_page=per_page
+        )
+        
+        bucket_label = next((label for key, label, _ in AGING_BUCKETS if key == bucket), 'All ages')
+        branch = db.session.get(Branch, branch_id) if branch_id else None
+        salesperson = db.session.get(User, user_id) if user_id else None
+        
+        return render_template('ar_aging_orders.html',
+                             as_of_date=as_of_date,
+                             rows=pagination.items,
+                             pagination=pagination,
+                             bucket=bucket,
+                             bucket_label=bucket_label,
+                             branch=branch,
+                             salesperson=salesperson,
+                             per_page=per_page)
+    except Exception as e:
+        print(f"Error in ar_aging_orders route: {e}")
+        flash('An error occurred while loading outstanding orders.', 'error')
+        return redirect(url_for('ar_aging'))
+
 # Branch Management Routes
 @app.route('/branches')
 @login_required
 @role_required(['admin'])
 def branches():
     try:
-        print("Branches route accessed")
         # Pagination parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -3517,40 +2983,17 @@ def branches():
         )
         
         branches = pagination.items
-        print(f"Branches found: {len(branches)}")
+        catalog_trace.debug('branches_listed', page=page, branches=len(branches))
         
         # Get branch statistics in bulk queries for better performance
-        branch_ids = [branch.id for branch in branches]
-        
-        # Get product counts for all branches in one query
-        product_counts = db.session.query(
-            BranchProduct.branchid,
-            db.func.count(BranchProduct.id).label('product_count')
-        ).filter(BranchProduct.branchid.in_(branch_ids)).group_by(BranchProduct.branchid).all()
-        product_count_dict = {bid: count for bid, count in product_counts}
-        
-        # Get order counts for all branches in one query
-        order_counts = db.session.query(
-            Order.branchid,
-            db.func.count(Order.id).label('order_count')
-        ).filter(Order.branchid.in_(branch_ids)).group_by(Order.branchid).all()
-        order_count_dict = {bid: count for bid, count in order_counts}
-        
-        # Get revenue for all branches using Payment.amount (matching sales_report calculation)
-        revenue_data = db.session.query(
-            Order.branchid,
-            db.func.sum(Payment.amount).label('revenue')
-        ).join(Payment, Order.id == Payment.orderid).filter(
-            Order.branchid.in_(branch_ids),
-            Payment.payment_status == 'completed'
-        ).group_by(Order.branchid).all()
-        revenue_dict = {bid: float(revenue) if revenue else 0.0 for bid, revenue in revenue_data}
+        stats_by_branch = get_branch_stats(branch.id for branch in branches)
         
         # Add calculated attributes to branch objects
         for branch in branches:
-            branch.product_count = product_count_dict.get(branch.id, 0)
-            branch.order_count = order_count_dict.get(branch.id, 0)
-            branch.revenue = revenue_dict.get(branch.id, 0.0)
+            stats = stats_by_branch[branch.id]
+            branch.product_count = stats.products
+            branch.order_count = stats.orders
+            branch.revenue = float(stats.revenue)
         
         return render_template('branches.html', branches=branches, pagination=pagination)
     except Exception as e:
@@ -3559,44 +3002,63 @@ def branches():
         flash('An error occurred while loading branches. Please try again.', 'error')
         return redirect(url_for('index'))
 
+@app.route('/metrics')
+def metrics():
+    # Scraped by Prometheus, so no login: only a scraper with METRICS_TOKEN or
+    # from METRICS_ALLOWED_IPS may read it, everyone else gets a 404
+    token = app.config['METRICS_TOKEN']
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or request.remote_addr in app.config['METRICS_ALLOWED_IPS']):
+        return make_response('Not Found', 404)
+    response = make_response(render_metrics())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@app.route('/query_stats')
+@login_required
+@role_required(['admin'])
+def query_stats():
+    try:
+        stats = get_query_stats()
+        return render_template('query_stats.html',
+                             endpoints=stats['endpoints'],
+                             pid=stats['pid'],
+                             started_at=datetime.fromtimestamp(stats['started_at'], EAT),
+                             n_plus_one_threshold=app.config['QUERY_STATS_N_PLUS_ONE'])
+    except Exception as e:
+        print(f"Error in query stats route: {e}")
+        flash('An error occurred while loading query statistics', 'error')
+        return redirect(url_for('index'))
+
+@app.route('/query_stats/reset', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def reset_query_stats_route():
+    reset_query_stats()
+    flash('Query statistics reset for this worker', 'success')
+    return redirect(url_for('query_stats'))
+
 @app.route('/debug_payment_status')
 @login_required
 @role_required(['admin'])
 def debug_payment_status():
     try:
-        # Get all orders with their payment status
-        orders = Order.query.all()
+        # Compare the stored figures with a fresh computation from items and payments
+        orders = Order.query.order_by(Order.id).all()
+        computed = get_order_totals(order.id for order in orders)
         debug_info = []
         
         for order in orders:
-            # Calculate order total
-            total_amount = 0
-            for item in order.order_items:
-                if item.final_price:
-                    total_amount += item.final_price * item.quantity
-                # Legacy product relationship removed - using branch_product only
-            
-            # Calculate total payments received
-            total_payments = Decimal('0')
-            for payment in order.payments:
-                if payment.payment_status == 'completed':
-                    total_payments += Decimal(str(payment.amount))
-            
-            # Determine payment status
-            if total_payments >= total_amount:
-                payment_status = 'paid'
-            elif total_payments > 0:
-                payment_status = 'partially_paid'
-            else:
-                payment_status = 'not_paid'
-            
+            totals = computed[order.id]
             debug_info.append({
                 'order_id': order.id,
                 'current_status': order.payment_status,
-                'calculated_status': payment_status,
-                'total_amount': total_amount,
-                'total_payments': total_payments,
-                'payment_count': len(order.payments)
+                'calculated_status': payment_status_for(totals.total_amount, totals.total_paid),
+                'stored_total_amount': order.total_amount,
+                'total_amount': totals.total_amount,
+                'stored_total_paid': order.total_paid,
+                'total_payments': totals.total_paid,
+                'item_count': totals.item_count
             })
         
         return jsonify(debug_info)
@@ -3768,8 +3230,9 @@ def branch_details(branch_id):
         branch = Branch.query.get_or_404(branch_id)
         
         # Get branch statistics
-        total_products = BranchProduct.query.filter_by(branchid=branch_id).count()
-        total_orders = Order.query.filter_by(branchid=branch_id).count()
+        stats = get_branch_stats([branch_id])[branch_id]
+        total_products = stats.products
+        total_orders = stats.orders
         
         # Get recent orders for this branch
         recent_orders = Order.query.filter_by(branchid=branch_id).order_by(Order.created_at.desc()).limit(10).all()
@@ -3777,13 +3240,8 @@ def branch_details(branch_id):
         # Get only a limited number of products for display (for performance)
         products = BranchProduct.query.filter_by(branchid=branch_id).limit(20).all()
         
-        # Calculate total branch revenue using Payment.amount (matching sales_report calculation)
-        branch_revenue = db.session.query(
-            db.func.sum(Payment.amount)
-        ).join(Order, Payment.orderid == Order.id).filter(
-            Order.branchid == branch_id,
-            Payment.payment_status == 'completed'
-        ).scalar() or 0
+        # Total branch revenue using Payment.amount (matching sales_report calculation)
+        branch_revenue = stats.revenue
         
         # Calculate revenue from catalog products (OrderItem with branch_productid)
         # Using OrderItem amounts to differentiate catalog vs manual products
@@ -3828,11 +3286,9 @@ def branch_details(branch_id):
 @app.route('/categories')
 @login_required
 @role_required(['admin'])
+@cached_report(Category, SubCategory, ProductCatalog, BranchProduct, Order, OrderItem)
 def categories():
     try:
-        import time
-        start_time = time.time()
-        print("Categories route accessed")
         # Pagination parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -3847,110 +3303,42 @@ def categories():
         )
         
         categories = pagination.items
-        print(f"Categories found: {len(categories)}")
-        
-        # Pre-calculate product counts and revenue for all categories in efficient queries
-        category_ids = [cat.id for cat in categories]
-        print(f"Processing {len(category_ids)} categories: {category_ids}")
         
+        # Product counts and revenue of every category in one ROLLUP query
+        # (OrderItem -> BranchProduct -> ProductCatalog path, see category_stats.py)
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
         try:
-            # Method 1: Try complex joins first
-            try:
-                # Get product counts for all categories in one query
-                product_counts = db.session.query(
-                    SubCategory.category_id,
-                    db.func.count(ProductCatalog.id).label('product_count')
-                ).select_from(SubCategory).outerjoin(
-                    ProductCatalog, SubCategory.id == ProductCatalog.subcategory_id
-                ).filter(
-                    SubCategory.category_id.in_(category_ids)
-                ).group_by(SubCategory.category_id).all()
-                
-                print(f"ProductCatalog counts query result: {product_counts}")
-                
-                # Convert to dictionary for easy lookup
-                product_count_dict = {cat_id: count for cat_id, count in product_counts}
-                
-                # Get revenue for all categories in one query
-                revenue_data = db.session.query(
-                    SubCategory.category_id,
-                    db.func.sum(OrderItem.quantity * OrderItem.final_price).label('revenue')
-                ).select_from(SubCategory).join(
-                    ProductCatalog, SubCategory.id == ProductCatalog.subcategory_id
-                ).join(
-                    OrderItem, ProductCatalog.id == OrderItem.productid
-                ).join(
-                    Order, OrderItem.orderid == Order.id
-                ).filter(
-                    SubCategory.category_id.in_(category_ids),
-                    Order.payment_status.in_(['paid', 'partially_paid']),
-                    OrderItem.final_price.isnot(None)
-                ).group_by(SubCategory.category_id).all()
-                
-                print(f"Revenue query result: {revenue_data}")
-                
-                # Convert to dictionary for easy lookup
-                revenue_dict = {cat_id: float(revenue) if revenue else 0.0 for cat_id, revenue in revenue_data}
-                
-            except Exception as join_error:
-                print(f"Complex join failed, using simple approach: {join_error}")
-                # Method 2: Simple approach - calculate for each category individually
-                product_count_dict = {}
-                revenue_dict = {}
-                
-                for category in categories:
-                    # Get subcategories for this category
-                    subcategories = SubCategory.query.filter_by(category_id=category.id).all()
-                    subcategory_ids = [sub.id for sub in subcategories]
-                    
-                    if subcategory_ids:
-                        # Count products
-                        product_count = ProductCatalog.query.filter(ProductCatalog.subcategory_id.in_(subcategory_ids)).count()
-                        product_count_dict[category.id] = product_count
-                        
-                        # Calculate revenue
-                        revenue = db.session.query(
-                            db.func.sum(OrderItem.quantity * OrderItem.final_price)
-                        ).join(ProductCatalog).join(Order).filter(
-                            ProductCatalog.subcategory_id.in_(subcategory_ids),
-                            Order.payment_status.in_(['paid', 'partially_paid']),
-                            OrderItem.final_price.isnot(None)
-                        ).scalar() or 0
-                        revenue_dict[category.id] = float(revenue)
-                    else:
-                        product_count_dict[category.id] = 0
-                        revenue_dict[category.id] = 0.0
-            
-            # Add calculated values to category objects
-            for category in categories:
-                category.product_count = product_count_dict.get(category.id, 0)
-                category.calculated_revenue = revenue_dict.get(category.id, 0.0)
-            
-            # Calculate summary totals efficiently
-            total_products = sum(product_count_dict.values())
-            total_revenue = sum(revenue_dict.values())
-            avg_products_per_category = total_products / len(categories) if categories else 0
-            
+            with catalog_trace.span('category_stats', start_date=start_date, end_date=end_date):
+                category_stats = get_category_stats(
+                    datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None,
+                    datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+                )
         except Exception as e:
             print(f"Error in data calculation: {e}")
-            # Fallback to simple values if queries fail
-            for category in categories:
-                category.product_count = 0
-                category.calculated_revenue = 0.0
-            
-            total_products = 0
-            total_revenue = 0.0
-            avg_products_per_category = 0.0
+            db.session.rollback()
+            category_stats = CategoryAnalytics()
+        
+        for category in categories:
+            stats = category_stats.category(category.id)
+            category.product_count = stats.products
+            category.calculated_revenue = float(stats.revenue)
         
-        execution_time = time.time() - start_time
-        print(f"Categories route executed in {execution_time:.2f} seconds")
+        # Summary totals over all categories
+        total_products = category_stats.total.products
+        total_revenue = float(category_stats.total.revenue)
+        avg_products_per_category = total_products / pagination.total if pagination.total else 0
+        
+        catalog_trace.debug('categories_listed', page=page, categories=len(categories))
         
         return render_template('categories.html', 
                              categories=categories, 
                              pagination=pagination,
                              total_products=total_products,
                              total_revenue=total_revenue,
-                             avg_products_per_category=avg_products_per_category)
+                             avg_products_per_category=avg_products_per_category,
+                             start_date=start_date,
+                             end_date=end_date)
     except Exception as e:
         print(f"Error in categories route: {e}")
         db.session.rollback()
@@ -3964,37 +3352,22 @@ def category_details(category_id):
     try:
         category = Category.query.get_or_404(category_id)
         
-        # Get subcategories for this category
-        subcategories = SubCategory.query.filter_by(category_id=category_id).order_by(SubCategory.name).all()
-        subcategory_ids = [sub.id for sub in subcategories]
+        # Subcategories of this category, from the cached category tree
+        subcategory_ids = get_category_tree().subcategory_ids(category_id)
         
-        # Handle both old and new product structures
-        if subcategory_ids:
-            # New structure: products through subcategories
-            total_products = ProductCatalog.query.filter(ProductCatalog.subcategory_id.in_(subcategory_ids)).count()
-            products = ProductCatalog.query.filter(ProductCatalog.subcategory_id.in_(subcategory_ids)).order_by(ProductCatalog.id).all()
-            
-            # Calculate category revenue
-            category_revenue = db.session.query(
-                db.func.sum(OrderItem.quantity * OrderItem.final_price)
-            ).join(ProductCatalog).join(Order).filter(
-                ProductCatalog.subcategory_id.in_(subcategory_ids),
-                Order.payment_status.in_(['paid', 'partially_paid'])
-            ).scalar() or 0
-            
-            # Get products by branch
-            products_by_branch = db.session.query(
-                Branch.name,
-                db.func.count(ProductCatalog.id).label('product_count')
-            ).join(ProductCatalog).filter(
-                ProductCatalog.subcategory_id.in_(subcategory_ids)
-            ).group_by(Branch.id, Branch.name).all()
-        else:
-            # No subcategories yet, show empty state
-            total_products = 0
-            products = []
-            category_revenue = 0
-            products_by_branch = []
+        # Product count and revenue from the shared category statistics (see category_stats.py)
+        stats = get_category_stats().category(category_id)
+        total_products = stats.products
+        category_revenue = stats.revenue
+        
+        # Branch products of the category's catalog products
+        products = BranchProduct.query.join(ProductCatalog).options(
+            db.joinedload(BranchProduct.catalog_product),
+            db.joinedload(BranchProduct.branch)
+        ).filter(
+            ProductCatalog.subcategory_id.in_(subcategory_ids)
+        ).order_by(ProductCatalog.name, BranchProduct.id).all() if subcategory_ids else []
+        products_by_branch = get_branch_product_counts(subcategory_ids)
         
         return render_template('category_details.html', 
                              category=category,
@@ -4026,10 +3399,6 @@ def subcategories():
         
         subcategories = pagination.items
         
-        # Add adjusted times (3 hours ahead) for display
-        for subcategory in subcategories:
-            subcategory.created_at_adjusted = subcategory.created_at + timedelta(hours=3)
-        
         return render_template('subcategories.html', subcategories=subcategories, pagination=pagination)
     except Exception as e:
         print(f"Error in subcategories route: {e}")
@@ -4090,7 +3459,7 @@ def add_subcategory():
             return redirect(url_for('add_subcategory'))
     
     # Get all categories for the dropdown
-    categories = Category.query.order_by(Category.name).all()
+    categories = get_category_tree().categories
     return render_template('add_subcategory.html', categories=categories)
 
 @app.route('/edit_subcategory/<int:id>', methods=['GET', 'POST'])
@@ -4147,7 +3516,7 @@ def edit_subcategory(id):
             return redirect(url_for('edit_subcategory', id=id))
     
     # Get all categories for the dropdown
-    categories = Category.query.order_by(Category.name).all()
+    categories = get_category_tree().categories
     return render_template('edit_subcategory.html', subcategory=subcategory, categories=categories)
 
 @app.route('/delete_subcategory/<int:id>', methods=['POST'])
@@ -4187,27 +3556,19 @@ def subcategory_details(subcategory_id):
     try:
         subcategory = SubCategory.query.get_or_404(subcategory_id)
         
-        # Get subcategory statistics
-        total_products = ProductCatalog.query.filter_by(subcategory_id=subcategory_id).count()
+        # Product count and revenue from the shared category statistics (see category_stats.py)
+        stats = get_category_stats().subcategory(subcategory_id)
+        total_products = stats.products
+        subcategory_revenue = stats.revenue
         
-        # Get products in this subcategory
-        products = ProductCatalog.query.filter_by(subcategory_id=subcategory_id).all()
-        
-        # Calculate subcategory revenue
-        subcategory_revenue = db.session.query(
-            db.func.sum(OrderItem.quantity * OrderItem.final_price)
-        ).join(ProductCatalog).join(Order).filter(
-            ProductCatalog.subcategory_id == subcategory_id,
-            Order.payment_status.in_(['paid', 'partially_paid'])
-        ).scalar() or 0
-        
-        # Get products by branch
-        products_by_branch = db.session.query(
-            Branch.name,
-            db.func.count(ProductCatalog.id).label('product_count')
-        ).join(ProductCatalog).filter(
+        # Branch products of the subcategory's catalog products
+        products = BranchProduct.query.join(ProductCatalog).options(
+            db.joinedload(BranchProduct.catalog_product),
+            db.joinedload(BranchProduct.branch)
+        ).filter(
             ProductCatalog.subcategory_id == subcategory_id
-        ).group_by(Branch.id, Branch.name).all()
+        ).order_by(ProductCatalog.name, BranchProduct.id).all()
+        products_by_branch = get_branch_product_counts([subcategory_id])
         
         return render_template('subcategory_details.html', 
                              subcategory=subcategory,
@@ -4231,10 +3592,6 @@ def product_descriptions(product_id):
             product_id=product_id, is_active=True
         ).order_by(ProductDescription.sort_order, ProductDescription.created_at).all()
         
-        # Add adjusted times (3 hours ahead) for display
-        for description in descriptions:
-            description.created_at_adjusted = description.created_at + timedelta(hours=3)
-        
         return render_template('product_descriptions.html', 
                              product=product, 
                              descriptions=descriptions)
@@ -4470,10 +3827,6 @@ def edit_expense(id):
             db.session.rollback()
             flash(f'Error updating expense: {str(e)}', 'danger')
     
-    # Add adjusted times (3 hours ahead) for display
-    expense.created_at_adjusted = expense.created_at + timedelta(hours=3)
-    expense.updated_at_adjusted = expense.updated_at + timedelta(hours=3)
-    
     return render_template('edit_expense.html', expense=expense)
 
 
@@ -4549,10 +3902,6 @@ def delete_expense(id):
 def expense_details(id):
     expense = Expense.query.get_or_404(id)
     
-    # Add adjusted times (3 hours ahead) for display
-    expense.created_at_adjusted = expense.created_at + timedelta(hours=3)
-    expense.updated_at_adjusted = expense.updated_at + timedelta(hours=3)
-    
     return render_template('expense_details.html', expense=expense)
 
 # Supplier Management Routes
@@ -4781,7 +4130,7 @@ def purchase_orders():
         
         # Get suppliers and branches for filters
         suppliers = Supplier.query.filter_by(is_active=True).order_by(Supplier.name).all()
-        branches = Branch.query.all()
+        branches = get_branch_directory()
         
         return render_template('purchase_orders.html', 
                              purchase_orders=purchase_orders, 
@@ -4862,7 +4211,7 @@ def add_purchase_order():
             return redirect(url_for('add_purchase_order'))
     
     suppliers = Supplier.query.filter_by(is_active=True).order_by(Supplier.name).all()
-    branches = Branch.query.all()
+    branches = get_branch_directory()
     products = ProductCatalog.query.order_by(ProductCatalog.name).all()
     
     return render_template('add_purchase_order.html', 
@@ -4875,25 +4224,18 @@ def add_purchase_order():
 @role_required(['admin'])
 def edit_purchase_order(id):
     try:
-        print(f"🔍 Attempting to access edit_purchase_order for ID: {id}")
-        print(f"🔍 Current user: {current_user.email if current_user.is_authenticated else 'Not authenticated'}")
-        print(f"🔍 User role: {current_user.role if current_user.is_authenticated else 'No role'}")
-        
         # Check if purchase order exists
         po = PurchaseOrder.query.get(id)
         if not po:
-            print(f"❌ Purchase Order with ID {id} not found in database")
+            po_trace.warning('po_not_found', po_id=id)
             flash(f'Purchase Order with ID {id} not found.', 'error')
             return redirect(url_for('purchase_orders'))
         
-        print(f"✅ Found Purchase Order: {po.po_number} (ID: {po.id})")
-        print(f"✅ PO Status: {po.status}")
-        print(f"✅ PO Supplier ID: {po.supplier_id}")
-        print(f"✅ PO Branch ID: {po.branch_id}")
+        po_trace.debug('po_loaded', po_id=po.id, po_number=po.po_number, status=po.status,
+                       supplier_id=po.supplier_id, branch_id=po.branch_id)
         
         if request.method == 'POST':
             try:
-                print(f"📝 Processing POST request for PO {id}")
                 supplier_id = request.form.get('supplier_id')
                 branch_id = request.form.get('branch_id')
                 order_date = request.form.get('order_date')
@@ -4901,15 +4243,11 @@ def edit_purchase_order(id):
                 notes = request.form.get('notes')
                 status = request.form.get('status')
                 
-                print(f"📝 Form data received:")
-                print(f"   - supplier_id: {supplier_id}")
-                print(f"   - branch_id: {branch_id}")
-                print(f"   - order_date: {order_date}")
-                print(f"   - expected_delivery_date: {expected_delivery_date}")
-                print(f"   - status: {status}")
+                po_trace.debug('po_update_form', po_id=id, supplier_id=supplier_id, branch_id=branch_id,
+                               order_date=order_date, expected_delivery_date=expected_delivery_date,
+                               status=status)
                 
                 if not supplier_id or not branch_id or not order_date:
-                    print(f"❌ Missing required fields")
                     flash('Supplier, Branch, and Order Date are required', 'error')
                     return redirect(url_for('edit_purchase_order', id=id))
                 
@@ -4926,82 +4264,43 @@ def edit_purchase_order(id):
                         po.approved_at = datetime.now(EAT)
                 
                 db.session.commit()
-                print(f"✅ Purchase Order updated successfully")
+                po_trace.info('po_updated', po_id=id, status=po.status)
                 flash('Purchase Order updated successfully', 'success')
                 return redirect(url_for('purchase_orders'))
             except Exception as e:
                 db.session.rollback()
-                print(f"❌ Error updating purchase order: {str(e)}")
-                print(f"❌ Error type: {type(e).__name__}")
-                import traceback
-                print(f"❌ Full traceback:")
-                traceback.print_exc()
+                po_trace.error('po_update_failed', exc_info=True, po_id=id, error=str(e))
                 flash(f'An error occurred while updating purchase order: {str(e)}', 'error')
                 return redirect(url_for('edit_purchase_order', id=id))
         
         # GET request - prepare data for template
         try:
-            print(f"📋 Preparing data for template")
             suppliers = Supplier.query.filter_by(is_active=True).order_by(Supplier.name).all()
-            branches = Branch.query.all()
+            branches = get_branch_directory()
             products = ProductCatalog.query.all()
             
-            print(f"✅ Data prepared:")
-            print(f"   - Suppliers count: {len(suppliers)}")
-            print(f"   - Branches count: {len(branches)}")
-            print(f"   - ProductCatalogs count: {len(products)}")
-            
-            # Check if template exists
-            import os
-            template_path = os.path.join(app.template_folder, 'edit_purchase_order.html')
-            if os.path.exists(template_path):
-                print(f"✅ Template file exists: {template_path}")
-            else:
-                print(f"❌ Template file not found: {template_path}")
-            
-            print(f"🎯 Attempting to render template...")
-            
-            # Debug: Print PO data structure
-            print(f"🔍 PO data structure:")
-            print(f"   - ID: {po.id}")
-            print(f"   - PO Number: {po.po_number}")
-            print(f"   - Status: {po.status}")
-            print(f"   - Items count: {len(po.items) if po.items else 0}")
+            po_trace.debug('po_form_data', po_id=po.id, suppliers=len(suppliers), branches=len(branches),
+                           products=len(products), items=len(po.items))
+            if po_trace.enabled('debug'):
+                for item in po.items:
+                    po_trace.debug('po_item', po_id=po.id, item_id=item.id, product_code=item.product_code,
+                                   quantity=item.quantity, unit_price=item.unit_price,
+                                   total_price=item.total_price, received_quantity=item.received_quantity)
             
-            if po.items:
-                for i, item in enumerate(po.items):
-                    print(f"   - Item {i+1}:")
-                    print(f"     * ID: {item.id}")
-                    print(f"     * ProductCatalog Name: {item.product_name}")
-                    print(f"     * ProductCatalog Code: {item.product_code}")
-                    print(f"     * Quantity: {item.quantity}")
-                    print(f"     * Unit Price: {item.unit_price}")
-                    print(f"     * Total Price: {item.total_price}")
-                    print(f"     * Received Quantity: {item.received_quantity}")
-            
-            result = render_template('edit_purchase_order.html', 
-                                   po=po, 
-                                   suppliers=suppliers, 
-                                   branches=branches,
-                                   products=products)
-            print(f"✅ Template rendered successfully")
-            return result
+            with po_trace.span('po_render', po_id=po.id):
+                return render_template('edit_purchase_order.html', 
+                                       po=po, 
+                                       suppliers=suppliers, 
+                                       branches=branches,
+                                       products=products)
             
         except Exception as e:
-            print(f"❌ Error preparing template data: {str(e)}")
-            print(f"❌ Error type: {type(e).__name__}")
-            import traceback
-            print(f"❌ Full traceback:")
-            traceback.print_exc()
+            po_trace.error('po_form_failed', exc_info=True, po_id=id, error=str(e))
             flash(f'An error occurred while loading the page: {str(e)}', 'error')
             return redirect(url_for('purchase_orders'))
             
     except Exception as e:
-        print(f"❌ Critical error in edit_purchase_order route: {str(e)}")
-        print(f"❌ Error type: {type(e).__name__}")
-        import traceback
-        print(f"❌ Full traceback:")
-        traceback.print_exc()
+        po_trace.error('po_edit_failed', exc_info=True, po_id=id, error=str(e))
         flash(f'A critical error occurred: {str(e)}', 'error')
         return redirect(url_for('purchase_orders'))
 
@@ -5146,20 +4445,15 @@ def add_po_item(po_id):
 @role_required(['admin'])
 def edit_po_item(item_id):
     try:
-        print(f"🔍 Attempting to edit PO item with ID: {item_id}")
-        
         # Get the PO item
         po_item = PurchaseOrderItem.query.get_or_404(item_id)
-        print(f"✅ Found PO Item: {po_item.product_name} (ID: {po_item.id})")
         
         # Get the parent purchase order
         po = po_item.purchase_order
-        print(f"✅ Parent PO: {po.po_number} (ID: {po.id})")
+        po_trace.debug('po_item_loaded', po_id=po.id, item_id=po_item.id, status=po.status)
         
         if request.method == 'POST':
             try:
-                print(f"📝 Processing POST request for PO item {item_id}")
-                
                 # Get form data
                 product_code = request.form.get('product_code', '').strip()
                 product_name = request.form.get('product_name', '').strip()
@@ -5167,16 +4461,11 @@ def edit_po_item(item_id):
                 unit = request.form.get('unit', 'pieces')
                 unit_price = request.form.get('unit_price')
                 
-                print(f"📝 Form data received:")
-                print(f"   - product_code: {product_code}")
-                print(f"   - product_name: {product_name}")
-                print(f"   - quantity: {quantity}")
-                print(f"   - unit: {unit}")
-                print(f"   - unit_price: {unit_price}")
+                po_trace.debug('po_item_form', po_id=po.id, item_id=item_id, product_code=product_code,
+                               quantity=quantity, unit=unit, unit_price=unit_price)
                 
                 # At least one of product name or product code must be provided, plus quantity
                 if (not product_code and not product_name) or not quantity:
-                    print(f"❌ Missing required fields")
                     flash('Either product name or product code (or both) and quantity are required', 'error')
                     return redirect(url_for('edit_po_item', item_id=item_id))
                 
@@ -5187,13 +4476,11 @@ def edit_po_item(item_id):
                         raise ValueError("Quantity must be positive")
                     unit_price = Decimal(str(unit_price)) if unit_price else None
                 except (ValueError, TypeError):
-                    print(f"❌ Invalid quantity or unit price")
                     flash('Invalid quantity or unit price', 'error')
                     return redirect(url_for('edit_po_item', item_id=item_id))
                 
                 # Check if PO is editable
                 if po.status not in ['draft', 'submitted']:
-                    print(f"❌ PO status '{po.status}' does not allow editing")
                     flash('Cannot edit items in purchase order that is not in draft or submitted status', 'error')
                     return redirect(url_for('edit_purchase_order', id=po.id))
                 
@@ -5217,18 +4504,14 @@ def edit_po_item(item_id):
                 po.total_amount = po.subtotal + (po.tax_amount or Decimal('0')) - (po.discount_amount or Decimal('0'))
                 
                 db.session.commit()
-                print(f"✅ PO Item updated successfully")
-                print(f"✅ PO totals updated - Subtotal: {po.subtotal}, Total: {po.total_amount}")
+                po_trace.info('po_item_updated', po_id=po.id, item_id=item_id,
+                              subtotal=po.subtotal, total_amount=po.total_amount)
                 flash('Purchase Order Item updated successfully', 'success')
                 return redirect(url_for('edit_purchase_order', id=po.id))
                 
             except Exception as e:
                 db.session.rollback()
-                print(f"❌ Error updating PO item: {str(e)}")
-                print(f"❌ Error type: {type(e).__name__}")
-                import traceback
-                print(f"❌ Full traceback:")
-                traceback.print_exc()
+                po_trace.error('po_item_update_failed', exc_info=True, po_id=po.id, item_id=item_id, error=str(e))
                 flash(f'An error occurred while updating the item: {str(e)}', 'error')
                 return redirect(url_for('edit_po_item', item_id=item_id))
         
@@ -5236,11 +4519,7 @@ def edit_po_item(item_id):
         return render_template('edit_po_item.html', po_item=po_item, po=po)
         
     except Exception as e:
-        print(f"❌ Critical error in edit_po_item route: {str(e)}")
-        print(f"❌ Error type: {type(e).__name__}")
-        import traceback
-        print(f"❌ Full traceback:")
-        traceback.print_exc()
+        po_trace.error('po_item_edit_failed', exc_info=True, item_id=item_id, error=str(e))
         flash(f'A critical error occurred: {str(e)}', 'error')
         return redirect(url_for('purchase_orders'))
 
@@ -5317,12 +4596,6 @@ def purchase_order_details(po_id):
             flash(f'Purchase Order with ID {po_id} not found', 'error')
             return redirect(url_for('purchase_orders'))
         
-        # Add adjusted times (3 hours ahead) for display
-        if po.created_at:
-            po.created_at_adjusted = po.created_at + timedelta(hours=3)
-        if po.approved_at:
-            po.approved_at_adjusted = po.approved_at + timedelta(hours=3)
-        
         return render_template('purchase_order_details.html', po=po)
         
     except Exception as e:
@@ -5377,11 +4650,11 @@ def export_purchase_order_pdf(po_id):
         # Load the logo image
         try:
             logo_path = os.path.join(app.static_folder, 'assets', 'img', 'logo.png')
-            print(f"Loading logo from: {logo_path}")
+            pdf_trace.debug('pdf_logo', path=logo_path)
             logo_image = Image(logo_path, width=1.5*inch, height=1*inch)
             logo_cell = logo_image
         except Exception as e:
-            print(f"Error loading logo: {e}")
+            pdf_trace.warning('pdf_logo_failed', path=logo_path, error=str(e))
             # Create a placeholder if logo fails to load
             logo_cell = Paragraph('''
             <para align=left>
@@ -5713,14 +4986,15 @@ def change_password():
             flash('New password must be at least 6 characters long', 'error')
             return redirect(url_for('change_password'))
         
-        # Verify current password
-        if not current_user.check_password(current_password):
+        # Verify current password (current_user is a read-only cached identity)
+        user = User.query.get_or_404(current_user.id)
+        if not user.check_password(current_password):
             flash('Current password is incorrect', 'error')
             return redirect(url_for('change_password'))
         
         # Update password
         try:
-            current_user.set_password(new_password)
+            user.set_password(new_password)
             db.session.commit()
             flash('Password changed successfully', 'success')
             return redirect(url_for('index'))
@@ -5735,101 +5009,43 @@ def change_password():
 @app.route('/sales_report')
 @login_required
 @role_required(['admin'])
+@cached_report(Order, OrderItem, Payment, DailySalesRollup)
 def sales_report():
     from datetime import datetime, timedelta
     
     # Get date range and branch filter from query parameters
-    start_date = request.args.get('start_date', (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d'))
-    end_date = request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+    start_date = request.args.get('start_date', (datetime.now(EAT) - timedelta(days=30)).strftime('%Y-%m-%d'))
+    end_date = request.args.get('end_date', datetime.now(EAT).strftime('%Y-%m-%d'))
     branch_id = request.args.get('branch_id', type=int)
     
     # Convert to datetime objects
     start_dt = datetime.strptime(start_date, '%Y-%m-%d')
     end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
     
-    # Get sales data
-    sales_data_query = db.session.query(
-        func.date(Payment.created_at).label('date'),
-        func.count(Payment.id).label('payment_count'),
-        func.sum(Payment.amount).label('total_amount')
-    ).join(Order, Payment.orderid == Order.id).filter(
-        Payment.payment_status == 'completed',
-        Payment.created_at >= start_dt,
-        Payment.created_at < end_dt
-    )
-    
-    # Apply branch filter if specified
-    if branch_id:
-        sales_data_query = sales_data_query.filter(Order.branchid == branch_id)
-    
-    sales_data = sales_data_query.group_by(func.date(Payment.created_at)).order_by(func.date(Payment.created_at)).all()
-    
-    # Get daily profit data separately to avoid join conflicts
-    daily_profits_query = db.session.query(
-        func.date(Payment.created_at).label('date'),
-        func.sum((OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity).label('daily_profit')
-    ).select_from(Payment).join(Order, Payment.orderid == Order.id).join(
-        OrderItem, Order.id == OrderItem.orderid
-    ).filter(
-        Payment.payment_status == 'completed',
-        Payment.created_at >= start_dt,
-        Payment.created_at < end_dt,
-        OrderItem.final_price.isnot(None),
-        OrderItem.buying_price.isnot(None)
-    )
-    
-    # Apply branch filter if specified
-    if branch_id:
-        daily_profits_query = daily_profits_query.filter(Order.branchid == branch_id)
-    
-    daily_profits = daily_profits_query.group_by(func.date(Payment.created_at)).all()
-    
-    # Create a dictionary for quick profit lookup
-    profit_dict = {row.date: row.daily_profit for row in daily_profits}
-    
-    # Create enhanced sales data with profit information
-    enhanced_sales_data = []
-    for row in sales_data:
-        enhanced_sales_data.append({
-            'date': row.date,
+    # Daily figures from the pre-aggregated rollup (see sales_rollup.py)
+    sales_data = [
+        {
+            'date': row.day,
             'payment_count': row.payment_count,
-            'total_amount': row.total_amount,
-            'total_profit': profit_dict.get(row.date, 0.0)
-        })
+            'total_amount': row.revenue,
+            'total_profit': row.profit
+        }
+        for row in get_sales_rollup(start_dt.date(), end_dt.date() - timedelta(days=1), branch_id)
+    ]
     
     # Calculate totals
-    total_revenue = sum(row.total_amount for row in sales_data if row.total_amount)
-    total_payments = sum(row.payment_count for row in sales_data)
-    
-    # Calculate total profit
-    total_profit_query = db.session.query(
-        db.func.sum((OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity)
-    ).join(Order, OrderItem.orderid == Order.id).join(
-        Payment, Order.id == Payment.orderid
-    ).filter(
-        Payment.payment_status == 'completed',
-        Payment.created_at >= start_dt,
-        Payment.created_at < end_dt,
-        OrderItem.final_price.isnot(None),
-        OrderItem.buying_price.isnot(None)
-    )
-    
-    # Apply branch filter if specified
-    if branch_id:
-        total_profit_query = total_profit_query.filter(Order.branchid == branch_id)
-    
-    total_profit = total_profit_query.scalar() or 0.0
+    total_revenue = sum(row['total_amount'] for row in sales_data)
+    total_payments = sum(row['payment_count'] for row in sales_data)
+    total_profit = sum(row['total_profit'] for row in sales_data)
     
     # Get all branches for dropdown
-    branches = Branch.query.all()
+    branches = get_branch_directory()
     
     # Get selected branch info
-    selected_branch = None
-    if branch_id:
-        selected_branch = Branch.query.get(branch_id)
+    selected_branch = branches.get(branch_id) if branch_id else None
     
     return render_template('sales_report.html', 
-                         sales_data=enhanced_sales_data,
+                         sales_data=sales_data,
                          start_date=start_date,
                          end_date=end_date,
                          total_revenue=total_revenue,
@@ -5848,8 +5064,8 @@ def daily_sales_details(date):
         # Get branch filter from query parameters
         branch_id = request.args.get('branch_id', type=int)
         
-        # Convert date string to datetime
-        date_obj = datetime.strptime(date, '%Y-%m-%d')
+        # Bounds of that day in EAT
+        date_obj = eat_day_start(datetime.strptime(date, '%Y-%m-%d'))
         next_day = date_obj + timedelta(days=1)
         
         # Get payments for the specific date
@@ -5905,8 +5121,8 @@ def export_daily_sales_pdf(date):
         # Get branch filter from query parameters
         branch_id = request.args.get('branch_id', type=int)
         
-        # Convert date string to datetime
-        date_obj = datetime.strptime(date, '%Y-%m-%d')
+        # Bounds of that day in EAT
+        date_obj = eat_day_start(datetime.strptime(date, '%Y-%m-%d'))
         next_day = date_obj + timedelta(days=1)
         
         # Get payments for the specific date
@@ -6002,11 +5218,11 @@ def export_daily_sales_pdf(date):
         # Load the logo image
         try:
             logo_path = os.path.join(app.static_folder, 'assets', 'img', 'logo.png')
-            print(f"Loading logo from: {logo_path}")
+            pdf_trace.debug('pdf_logo', path=logo_path)
             logo_image = Image(logo_path, width=1.5*inch, height=1*inch)
             logo_cell = logo_image
         except Exception as e:
-            print(f"Error loading logo: {e}")
+            pdf_trace.warning('pdf_logo_failed', path=logo_path, error=str(e))
             # Create a placeholder if logo fails to load
             logo_cell = Paragraph('''
             <para align=left>
@@ -6116,7 +5332,7 @@ def export_daily_sales_pdf(date):
                     f'KSh {format_number(payment.amount)}',
                     payment.payment_method or 'N/A',
                     payment.payment_status or 'N/A',
-                    payment.created_at.strftime('%H:%M') if payment.created_at else 'N/A'
+                    to_eat(payment.created_at).strftime('%H:%M') if payment.created_at else 'N/A'
                 ])
             
             payment_table = Table(payment_data, colWidths=[0.8*inch, 0.8*inch, 1.2*inch, 1*inch, 1*inch, 0.8*inch])
@@ -6303,7 +5519,7 @@ def edit_payment():
         payment.amount = amount
         payment.payment_status = payment_status
         payment.reference_number = reference_number if reference_number else None
-        payment.updated_at = datetime.now()
+        payment.updated_at = datetime.now(EAT)
         
         db.session.commit()
         
@@ -6317,6 +5533,70 @@ def edit_payment():
     # Redirect back to the order details page
     return redirect(url_for('order_details', order_id=order_id))
 
+@app.cli.command('rebuild-dashboard-snapshot')
+def rebuild_dashboard_snapshot_command():
+    """Recompute the dashboard snapshot table from scratch"""
+    try:
+        rows = rebuild_dashboard_snapshot()
+        db.session.commit()
+        print(f"✅ Rebuilt {rows} dashboard snapshot rows")
+    except Exception as e:
+        print(f"❌ Error rebuilding dashboard snapshot: {e}")
+        db.session.rollback()
+
+@app.cli.command('rebuild-daily-sales-rollup')
+def rebuild_daily_sales_rollup_command():
+    """Recompute the daily sales rollup table from payments and order items"""
+    try:
+        rows = rebuild_sales_rollup()
+        db.session.commit()
+        print(f"✅ Rebuilt {rows} daily sales rollup rows")
+    except Exception as e:
+        print(f"❌ Error rebuilding daily sales rollup: {e}")
+        db.session.rollback()
+
+@app.cli.command('refresh-daily-sales-rollup')
+def refresh_daily_sales_rollup_command():
+    """Recompute the most recent days of the daily sales rollup (run from cron)"""
+    try:
+        rows = refresh_recent_sales_rollup()
+        db.session.commit()
+        print(f"✅ Refreshed {rows} daily sales rollup rows")
+    except Exception as e:
+        print(f"❌ Error refreshing daily sales rollup: {e}")
+        db.session.rollback()
+
+@app.cli.command('close-profit-loss')
+def close_profit_loss_command():
+    """Close the complete months and recent days of the profit & loss (run daily)"""
+    try:
+        periods = close_profit_loss_periods()
+        print(f"✅ Closed {periods} profit & loss periods")
+    except Exception as e:
+        print(f"❌ Error closing profit & loss periods: {e}")
+        db.session.rollback()
+
+@app.cli.command('snapshot-stock')
+def snapshot_stock_command():
+    """Record today's stock of every branch product for inventory valuations (run daily)"""
+    try:
+        rows = take_stock_snapshot()
+        db.session.commit()
+        print(f"✅ Recorded stock of {rows} branch products")
+    except Exception as e:
+        print(f"❌ Error recording stock snapshot: {e}")
+        db.session.rollback()
+
+@app.cli.command('reconcile-order-totals')
+def reconcile_order_totals_command():
+    """Recompute the stored order totals and payment status from items and completed payments"""
+    try:
+        changed = reconcile_order_totals()
+        print(f"✅ Corrected totals of {changed} orders")
+    except Exception as e:
+        print(f"❌ Error reconciling order totals: {e}")
+        db.session.rollback()
+
 def migrate_existing_passwords():
     """Migrate existing plain text passwords to hashed passwords"""
     try:
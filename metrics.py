@@ -0,0 +1,305 @@
+"""
+Metrics
+
+This module records request and database metrics per Flask endpoint and
+exposes them at /metrics in the Prometheus text format, to scrapers sending
+METRICS_TOKEN or connecting from METRICS_ALLOWED_IPS:
+
+- abz_requests_total{endpoint,method,status} and
+  abz_request_errors_total{endpoint} (5xx responses and unhandled errors)
+- abz_request_duration_seconds{endpoint}: latency histogram
+- abz_request_db_seconds{endpoint} and abz_request_queries{endpoint}:
+  histograms of the database time and query count of each request (see
+  query_stats.py)
+- abz_response_size_bytes{endpoint}: histogram of response bodies
+- abz_db_pool_checked_out, abz_db_pool_overflow, abz_db_pool_size{worker}:
+  connection pool gauges, and abz_db_pool_wait_seconds, the time from the
+  start of a request to its first connection checkout, less the setup time
+  of a new connection (measured with pool events, so it survives
+  engine.dispose())
+- abz_cloudinary_upload_seconds{outcome}: image upload latency
+
+Metrics are kept per worker process. With METRICS_DIR set (a directory
+writable by every uWSGI worker) each worker writes its values there every
+METRICS_FLUSH_INTERVAL seconds, and /metrics on any worker merges them:
+counters and histograms are summed, gauges are reported per live worker.
+Clear the directory when the application is redeployed.
+
+Usage:
+    observe('abz_cloudinary_upload_seconds', seconds, outcome='success')
+    with timed('abz_cloudinary_upload_seconds') as labels:
+        ...
+        labels['outcome'] = 'error'
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from config import Config
+from extensions import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+SIZE_BUCKETS = (1024, 10240, 102400, 524288, 1048576, 5242880, 10485760)
+
+_METRICS = {
+    # name: (type, help, buckets)
+    'abz_requests_total': ('counter', 'Requests handled, by endpoint, method and status', None),
+    'abz_request_errors_total': ('counter', 'Requests that failed with a 5xx status or an unhandled error', None),
+    'abz_request_duration_seconds': ('histogram', 'Request latency', LATENCY_BUCKETS),
+    'abz_request_db_seconds': ('histogram', 'Database time per request', LATENCY_BUCKETS),
+    'abz_request_queries': ('histogram', 'SQL statements per request', QUERY_BUCKETS),
+    'abz_response_size_bytes': ('histogram', 'Response body size', SIZE_BUCKETS),
+    'abz_db_pool_checked_out': ('gauge', 'Pooled connections in use', None),
+    'abz_db_pool_overflow': ('gauge', 'Connections open beyond the pool size', None),
+    'abz_db_pool_size': ('gauge', 'Configured connection pool size', None),
+    'abz_db_pool_wait_seconds': ('histogram', 'Time until a request checks out its first connection, less connection setup', LATENCY_BUCKETS),
+    'abz_cloudinary_upload_seconds': ('histogram', 'Cloudinary image upload latency', LATENCY_BUCKETS),
+}
+
+_values = {}  # {name: {labels tuple: value, or [bucket counts..., sum, count] for histograms}}
+_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter"""
+    with _lock:
+        series = _values.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _values.setdefault(name, {})[_labels_key(labels)] = value
+
+
+def observe(name, value, **labels):
+    """Add an observation to a histogram"""
+    buckets = _METRICS[name][2]
+    with _lock:
+        series = _values.setdefault(name, {})
+        key = _labels_key(labels)
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * len(buckets) + [0.0, 0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe the duration of a block; the block may add or change labels"""
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _pool_gauges():
+    """Record this worker's connection pool state"""
+    pool = db.engine.pool
+    for name, method in (('abz_db_pool_checked_out', 'checkedout'),
+                         ('abz_db_pool_overflow', 'overflow'),
+                         ('abz_db_pool_size', 'size')):
+        if hasattr(pool, method):
+            set_gauge(name, getattr(pool, method)(), worker=os.getpid())
+
+
+def _snapshot():
+    with _lock:
+        return {
+            name: [[list(key), value if not isinstance(value, list) else list(value)]
+                   for key, value in series.items()]
+            for name, series in _values.items()
+        }
+
+
+def flush(force=False):
+    """Write this worker's values to METRICS_DIR (at most every METRICS_FLUSH_INTERVAL)"""
+    global _last_flush
+    if not Config.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < Config.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    _pool_gauges()
+    path = os.path.join(Config.METRICS_DIR, f'metrics_{os.getpid()}.json')
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Error writing metrics to {path}: {e}")
+
+
+def _worker_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merged():
+    """Values of all workers: counters and histograms summed, gauges of live workers"""
+    if not Config.METRICS_DIR:
+        _pool_gauges()
+        return _snapshot()
+    flush(force=True)
+
+    merged = {}
+    for path in glob.glob(os.path.join(Config.METRICS_DIR, 'metrics_*.json')):
+        try:
+            pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+            with open(path) as f:
+                worker = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading metrics from {path}: {e}")
+            continue
+        alive = _worker_alive(pid)
+        for name, samples in worker.items():
+            if name not in _METRICS:
+                continue
+            series = merged.setdefault(name, {})
+            for key, value in samples:
+                key = tuple(tuple(label) for label in key)
+                if _METRICS[name][0] == 'gauge':
+                    if alive:
+                        series[key] = value
+                elif isinstance(value, list):
+                    current = series.get(key)
+                    series[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    series[key] = series.get(key, 0) + value
+    return {name: [[list(key), value] for key, value in series.items()] for name, series in merged.items()}
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    labels = [f'{name}="{_escape(value)}"' for name, value in list(key) + list(extra)]
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+def render_metrics():
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Returns:
+        str
+    """
+    values = _merged()
+    lines = []
+    for name, (kind, help_text, buckets) in _METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for key, value in sorted(values.get(name, []), key=lambda sample: sample[0]):
+            key = [tuple(label) for label in key]
+            if kind == 'histogram':
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", _format_number(float(bound)))])} {count}')
+                lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_number(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(key)} {value[-1]}')
+            else:
+                lines.append(f'{name}{_format_labels(key)} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _connect_started(dialect, connection_record, cargs, cparams):
+    connection_record.info['metrics_connect_started'] = time.perf_counter()
+
+
+def _connected(dbapi_connection, connection_record):
+    started = connection_record.info.pop('metrics_connect_started', None)
+    if started is not None:
+        connection_record.info['metrics_connect_seconds'] = time.perf_counter() - started
+
+
+def _checked_out(dbapi_connection, connection_record, connection_proxy):
+    """Observe abz_db_pool_wait_seconds on the first checkout of a request"""
+    setup = connection_record.info.pop('metrics_connect_seconds', 0)
+    if not has_request_context():
+        return
+    waiting_since = g.pop('metrics_pool_wait_from', None)
+    if waiting_since is not None:
+        observe('abz_db_pool_wait_seconds', max(time.perf_counter() - waiting_since - setup, 0))
+
+
+def _record_request(response=None, error=False):
+    if g.get('metrics_recorded') or g.get('metrics_started') is None:
+        return
+    g.metrics_recorded = True
+    endpoint = request.endpoint or 'unmatched'
+    status = response.status_code if response is not None else 500
+
+    observe('abz_request_duration_seconds', time.perf_counter() - g.metrics_started, endpoint=endpoint)
+    inc('abz_requests_total', endpoint=endpoint, method=request.method, status=status)
+    if error or status >= 500:
+        inc('abz_request_errors_total', endpoint=endpoint)
+
+    queries = g.get('query_stats')
+    if queries is not None:
+        observe('abz_request_db_seconds', queries.seconds, endpoint=endpoint)
+        observe('abz_request_queries', queries.count, endpoint=endpoint)
+
+    if response is not None and not response.is_streamed:
+        size = response.calculate_content_length()
+        if size is not None:
+            observe('abz_response_size_bytes', size, endpoint=endpoint)
+    flush()
+
+
+def init_metrics(app):
+    """Record every request (see the /metrics route in main.py)"""
+    if not Config.METRICS_ENABLED:
+        return
+
+    # Listen on the classes so pools recreated by engine.dispose() are timed too
+    event.listen(Engine, 'do_connect', _connect_started)
+    event.listen(Pool, 'connect', _connected)
+    event.listen(Pool, 'checkout', _checked_out)
+
+    @app.before_request
+    def _start_metrics():
+        g.metrics_started = g.metrics_pool_wait_from = time.perf_counter()
+
+    @app.after_request
+    def _end_metrics(response):
+        _record_request(response)
+        return response
+
+    @app.teardown_request
+    def _failed_metrics(error):
+        # after_request is skipped for unhandled errors
+        if error is not None:
+            _record_request(error=True)
+
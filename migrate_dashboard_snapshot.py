@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Migration script to make dashboard snapshot rows unique per branch
+
+This script will:
+1. Remove the existing snapshot rows (they may hold duplicates)
+2. Create the unique index on COALESCE(branch_id, 0)
+3. Rebuild the snapshot
+
+db.create_all() only creates indexes together with new tables, so existing
+databases need this script once. The table is small and rebuilt in the same
+transaction, so the dashboard falls back to live figures for a moment at most.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from extensions import db
+from dashboard_snapshot import rebuild_dashboard_snapshot
+
+def migrate_dashboard_snapshot():
+    with app.app_context():
+        try:
+            print("🔄 Starting dashboard snapshot migration...")
+
+            db.session.execute(db.text("LOCK TABLE dashboard_snapshot IN EXCLUSIVE MODE"))
+            db.session.execute(db.text("DELETE FROM dashboard_snapshot"))
+            print("➕ Creating index uq_dashboard_snapshot_branch on dashboard_snapshot (COALESCE(branch_id, 0))...")
+            db.session.execute(db.text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_dashboard_snapshot_branch "
+                "ON dashboard_snapshot ((COALESCE(branch_id, 0)))"
+            ))
+            rows = rebuild_dashboard_snapshot(db.session)
+            db.session.commit()
+            print(f"✅ uq_dashboard_snapshot_branch is in place, rebuilt {rows} rows")
+
+            print("🎉 Dashboard snapshot migration completed successfully!")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            import traceback
+            traceback.print_exc()
+
+if __name__ == '__main__':
+    migrate_dashboard_snapshot()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the indexes used by the orders list
+
+This script will:
+1. Backfill orders.created_at where it is NULL (from updated_at, else now)
+2. Make orders.created_at NOT NULL with a DEFAULT now()
+3. Create the (created_at, id) and (branchid, created_at, id) indexes on orders
+
+Keyset pagination compares (created_at, id) tuples, which never match a NULL
+created_at, so orders inserted without one by other apps would drop out of
+the list. The default covers inserts that leave the column out.
+
+db.create_all() only creates indexes together with new tables, so existing
+databases need this script once. The indexes are built CONCURRENTLY so the
+orders table stays writable while they are created.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from extensions import db
+from models import Order
+
+def migrate_order_indexes():
+    with app.app_context():
+        try:
+            print("🔄 Starting order index migration...")
+
+            result = db.session.execute(db.text(
+                "UPDATE orders SET created_at = COALESCE(updated_at, now()) WHERE created_at IS NULL"
+            ))
+            print(f"✅ Backfilled created_at of {result.rowcount} orders")
+            db.session.execute(db.text("ALTER TABLE orders ALTER COLUMN created_at SET DEFAULT now()"))
+            db.session.execute(db.text("ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL"))
+            db.session.commit()
+            print("✅ orders.created_at is NOT NULL")
+
+            # CREATE INDEX CONCURRENTLY can't run inside a transaction
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                for index in Order.__table__.indexes:
+                    columns = ', '.join(column.name for column in index.columns)
+                    print(f"➕ Creating index {index.name} on orders ({columns})...")
+                    connection.exec_driver_sql(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON orders ({columns})"
+                    )
+                    print(f"✅ {index.name} is in place")
+
+            print("🎉 Order index migration completed successfully!")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            import traceback
+            traceback.print_exc()
+
+if __name__ == '__main__':
+    migrate_order_indexes()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the denormalized order totals to the orders table
+
+This script will:
+1. Add total_amount, total_cost, total_profit, total_paid and item_count to orders
+2. Backfill them (and payment_status) for every existing order, in batches
+
+The columns are kept up to date on write afterwards (see order_accounting.py).
+Orders created by other apps can be corrected at any time with
+`flask reconcile-order-totals`.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from extensions import db
+from order_accounting import reconcile_order_totals
+from sqlalchemy import text
+
+ORDER_TOTAL_COLUMNS = (
+    ('total_amount', 'NUMERIC(12,2)'),
+    ('total_cost', 'NUMERIC(12,2)'),
+    ('total_profit', 'NUMERIC(12,2)'),
+    ('total_paid', 'NUMERIC(12,2)'),
+    ('item_count', 'INTEGER'),
+)
+
+def migrate_order_totals():
+    with app.app_context():
+        try:
+            print("🔄 Starting order totals migration...")
+
+            print("📋 Checking orders table structure...")
+            for column, column_type in ORDER_TOTAL_COLUMNS:
+                result = db.session.execute(text("""
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_name = 'orders' AND column_name = :column
+                """), {'column': column})
+
+                if not result.fetchone():
+                    print(f"➕ Adding {column} column to orders table...")
+                    db.session.execute(text(f"ALTER TABLE orders ADD COLUMN {column} {column_type}"))
+                    print(f"✅ {column} column added to orders table")
+                else:
+                    print(f"✅ {column} column already exists in orders table")
+
+            db.session.commit()
+
+            print("🔄 Backfilling order totals...")
+            changed = reconcile_order_totals()
+            print(f"🎉 Migration completed successfully! Updated {changed} orders")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            import traceback
+            traceback.print_exc()
+
+if __name__ == '__main__':
+    migrate_order_totals()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the indexes used by the receivables reports
+
+This script will:
+1. Create the (orderid, payment_status) and (payment_status, created_at)
+   indexes on payments
+
+db.create_all() only creates indexes together with new tables, so existing
+databases need this script once. The indexes are built CONCURRENTLY so the
+payments table stays writable while they are created.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from extensions import db
+from models import Payment
+
+def migrate_payment_indexes():
+    with app.app_context():
+        try:
+            print("🔄 Starting payment index migration...")
+
+            # CREATE INDEX CONCURRENTLY can't run inside a transaction
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                for index in Payment.__table__.indexes:
+                    columns = ', '.join(column.name for column in index.columns)
+                    print(f"➕ Creating index {index.name} on payments ({columns})...")
+                    connection.exec_driver_sql(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON payments ({columns})"
+                    )
+                    print(f"✅ {index.name} is in place")
+
+            print("🎉 Payment index migration completed successfully!")
+
+        except Exception as e:
+            print(f"❌ Migration failed: {e}")
+            import traceback
+            traceback.print_exc()
+
+if __name__ == '__main__':
+    migrate_payment_indexes()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Migration script to store reporting timestamps as timestamptz
+
+This script will:
+1. Convert the timezone-aware DateTime columns of the models (orders,
+   payments, users, stock transactions, ...) from `timestamp` to `timestamptz`
+2. Create the composite indexes used by the report date-range filters
+3. Rebuild the daily sales rollup, whose days are now Africa/Nairobi days
+
+Existing values were written as UTC wall-clock time (the database session
+time zone), which is why list views used to add 3 hours for display; they are
+converted as UTC so every row keeps the same instant.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from extensions import db
+from models import User, ProductDescription, StockTransaction, Order, Payment, SubCategory, Expense, PurchaseOrder
+from sales_rollup import rebuild_sales_rollup
+from sqlalchemy import text
+from sqlalchemy.types import DateTime
+
+STORED_TIMEZONE = 'UTC'
+TIMESTAMPTZ_MODELS = (User, ProductDescription, StockTransaction, Order, Payment, SubCategory, Expense, PurchaseOrder)
+INDEXED_MODELS = (Order, Payment)
+
+def migrate_timestamptz():
+    with app.app_context():
+        try:
+            print("🔄 Starting timestamptz migration...")
+
+            print("📋 Checking timestamp columns...")
+            for model in TIMESTAMPTZ_MODELS:
+                table = model.__tablename__
+                for column in model.__table__.columns:
+                    if not (isinstance(column.type, DateTime) and column.type.timezone):
+                        continue
+                    data_type = db.session.execute(text("""
+                        SELECT data_type
+                        FROM information_schema.columns
+                        WHERE table_name = :table AND column_name = :column
+                    """), {'table': table, 'column': column.name}).scalar()
+
+                    if data_type == 'timestamp without time zone':
+                        print(f"🔄 Converting {table}.{column.name} to timestamptz...")
+                        db.session.execute(text(
+                            f"ALTER TABLE {table} ALTER COLUMN {column.name} TYPE TIMESTAMPTZ "
+                            f"USING {column.name} AT TIME ZONE '{STORED_TIMEZONE}'"
+                        ))
+                        print(f"✅ {table}.{column.name} converted")
+                    else:
+                        print(f"✅ {table}.{column.name} is already {data_type}")
+
+            db.session.commit()
+
+            # CREATE INDEX CONCURRENTLY can't run inside a transaction
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                for model in INDEXED_MODELS:
+                    table = model.__tablename__
+                    for index in model.__table__.indexes:
+                        columns = ', '.join(column.name for column in index.columns)
+                        print(f"➕ Creating index {index.name} on {table} ({columns})...")
+                        connection.exec_driver_sql(
+                            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {table} ({columns})"
+                        )
+                        print(f"✅ {index.name} is in place")
+
+            print("🔄 Rebuilding daily sales rollup on Africa/Nairobi days...")
+            rows = rebuild_sales_rollup(db.session)
+            db.session.commit()
+            print(f"🎉 Migration completed successfully! Rebuilt {rows} rollup rows")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            import traceback
+            traceback.print_exc()
+
+if __name__ == '__main__':
+    migrate_timestamptz()
@@ -28,13 +28,12 @@ class Category(db.Model):
     @property
     def products(self):
         """Get all catalog products in this category through subcategories"""
-        from sqlalchemy import and_
-        # Check if this category has any subcategories
-        subcategories = SubCategory.query.filter_by(category_id=self.id).all()
-        if not subcategories:
+        from category_tree import get_category_tree
+        # Subcategory IDs come from the cached category tree
+        subcategory_ids = get_category_tree().subcategory_ids(self.id)
+        if not subcategory_ids:
             return []
         
-        subcategory_ids = [sub.id for sub in subcategories]
         return ProductCatalog.query.filter(ProductCatalog.subcategory_id.in_(subcategory_ids)).all()
 
 
@@ -46,7 +45,7 @@ class User(db.Model):
     lastname = db.Column(db.String, nullable=False)
     password = db.Column(db.String, nullable=False)
     role = db.Column(db.String, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
     phone = db.Column(db.String, nullable=True)
     accessible_branch_ids = db.Column(db.JSON, nullable=True, default=list)  # Branch access control
     orders = db.relationship('Order', backref='user', lazy=True)
@@ -171,8 +170,8 @@ class ProductDescription(db.Model):
     language = db.Column(db.String, default='en')  # Language code (en, sw, etc.)
     is_active = db.Column(db.Boolean, default=True)  # Can be disabled without deleting
     sort_order = db.Column(db.Integer, default=0)  # For ordering multiple descriptions
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
+    updated_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
 
     branch_product = db.relationship("BranchProduct", back_populates="product_descriptions")
 
@@ -188,7 +187,7 @@ class StockTransaction(db.Model):
     previous_stock = db.Column(db.Numeric(10, 3), nullable=False)  # Support up to 3 decimal places
     new_stock = db.Column(db.Numeric(10, 3), nullable=False)  # Support up to 3 decimal places
     notes = db.Column(db.String, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
 
     branch_product = db.relationship("BranchProduct", back_populates="stock_transactions")
 
@@ -203,15 +202,30 @@ class OrderType(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Keyset pagination of the orders list, newest first (see keyset_pagination.py)
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+        db.Index('ix_orders_branchid_created_at_id', 'branchid', 'created_at', 'id'),
+        # Date-range filters of the sales performance pages (see salesperson_stats.py)
+        db.Index('ix_orders_userid_created_at', 'userid', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     userid = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     ordertypeid = db.Column(db.Integer, db.ForeignKey('ordertypes.id'), nullable=False)
     branchid = db.Column(db.Integer, db.ForeignKey('branch.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+    # NOT NULL: the orders list pages on (created_at, id) (see migrate_order_indexes.py)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(EAT),
+                           server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
     approvalstatus = db.Column(db.Boolean, default=False)
-    approved_at = db.Column(db.DateTime, nullable=True)
+    approved_at = db.Column(db.DateTime(timezone=True), nullable=True)
     payment_status = db.Column(db.String, default='pending')  # pending, paid, failed, refunded
+    # Denormalized figures maintained on write (see order_accounting.py); NULL until computed
+    total_amount = db.Column(db.Numeric(12, 2), nullable=True)
+    total_cost = db.Column(db.Numeric(12, 2), nullable=True)
+    total_profit = db.Column(db.Numeric(12, 2), nullable=True)
+    total_paid = db.Column(db.Numeric(12, 2), nullable=True)  # Completed payments only
+    item_count = db.Column(db.Integer, nullable=True)
 
     order_items = db.relationship('OrderItem', backref='order', lazy=True)
     payments = db.relationship('Payment', backref='order', lazy=True)
@@ -237,6 +251,12 @@ class OrderItem(db.Model):
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Date-range filters on completed payments (sales report, rollup, dashboard)
+        db.Index('ix_payments_status_created_at', 'payment_status', 'created_at'),
+        # Netting completed payments against orders (see ar_aging.py)
+        db.Index('ix_payments_orderid_status', 'orderid', 'payment_status'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     orderid = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
     userid = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -247,8 +267,8 @@ class Payment(db.Model):
     reference_number = db.Column(db.String, nullable=True)  # Internal reference number
     notes = db.Column(db.String, nullable=True)
     payment_date = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
+    updated_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
 
 
 class Invoice(db.Model):
@@ -328,8 +348,8 @@ class SubCategory(db.Model):
     name = db.Column(db.String, nullable=False)
     description = db.Column(db.String, nullable=True)
     image_url = db.Column(db.String, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
+    updated_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
 
     # Legacy relationship commented out - now using ProductCatalog
     # products = db.relationship('Product', backref='sub_category', lazy=True)
@@ -350,8 +370,8 @@ class Expense(db.Model):
     approved_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Who approved the expense
     status = db.Column(db.String, default='pending')  # pending, approved, rejected
     approval_notes = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
+    updated_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
     
     # Relationships
     branch = db.relationship('Branch', backref='expenses', lazy=True)
@@ -398,9 +418,9 @@ class PurchaseOrder(db.Model):
     payment_method = db.Column(db.String, nullable=True)  # cash, bank_transfer, check
     notes = db.Column(db.Text, nullable=True)
     approved_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    approved_at = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+    approved_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT))
+    updated_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
     
     # Relationships
     branch = db.relationship('Branch', backref='purchase_orders', lazy=True)
@@ -497,3 +517,77 @@ class BranchProduct(db.Model):
     product_descriptions = db.relationship("ProductDescription", back_populates="branch_product")
     quotation_items = db.relationship("QuotationItem", back_populates="branch_product")
 
+
+class DashboardSnapshot(db.Model):
+    __tablename__ = 'dashboard_snapshot'
+
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = db.Column(db.Integer, nullable=True, index=True)  # NULL = all branches; no FK so branches stay deletable
+    period_start = db.Column(db.Date, nullable=False)  # Month the monthly_* columns refer to
+    total_revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    monthly_revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    monthly_profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_cogs = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    monthly_cogs = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    product_asset_value = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    low_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    pending_orders = db.Column(db.Integer, nullable=False, default=0)
+    total_expense_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    monthly_expenses = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    rebuilt_at = db.Column(db.DateTime, nullable=True)  # Last full rebuild (see dashboard_snapshot.py)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+
+
+# One row per branch and one global row; the upserts of dashboard_snapshot.py conflict on it
+db.Index('uq_dashboard_snapshot_branch',
+         db.func.coalesce(DashboardSnapshot.branch_id, db.literal_column('0')), unique=True)
+
+
+class DailySalesRollup(db.Model):
+    __tablename__ = 'daily_sales_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('branch_id', 'day', name='uq_daily_sales_rollup_branch_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = db.Column(db.Integer, nullable=False)  # No FK so branches stay deletable
+    day = db.Column(db.Date, nullable=False, index=True)  # Date of the completed payments
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)  # Completed payment amounts
+    profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)  # Item profit of the paid orders
+    cogs = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    items = db.Column(db.Numeric(14, 3), nullable=False, default=0)  # Quantity sold
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+
+
+class StockSnapshot(db.Model):
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        # Day first: valuations read every row of one snapshot day
+        db.UniqueConstraint('day', 'branch_productid', name='uq_stock_snapshots_day_branch_product'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    branch_productid = db.Column(db.Integer, nullable=False)  # No FK so products stay deletable
+    day = db.Column(db.Date, nullable=False)  # EAT date of taken_at
+    stock = db.Column(db.Numeric(12, 3), nullable=False, default=0)
+    taken_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(EAT))
+
+
+class ProfitLossClose(db.Model):
+    __tablename__ = 'profit_loss_close'
+    __table_args__ = (
+        db.Index('ix_profit_loss_close_period', 'period', 'period_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)  # month, day
+    period_start = db.Column(db.Date, nullable=False)
+    branch_id = db.Column(db.Integer, nullable=True)  # No FK so branches stay deletable; NULL for expenses without branch
+    metric = db.Column(db.String(30), nullable=False)  # See period_close.py
+    key = db.Column(db.String, nullable=False, default='')  # Expense category or product name
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    quantity = db.Column(db.Numeric(14, 3), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    closed_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(EAT))
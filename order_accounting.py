@@ -0,0 +1,177 @@
+"""
+Order Accounting
+
+Write-side maintenance of order figures. The denormalized Order columns
+(total_amount, total_cost, total_profit, total_paid, item_count) and
+Order.payment_status are kept in sync from an `after_flush` hook whenever a
+Payment or OrderItem of the order is added, edited or deleted, inside the same
+transaction as the change, so the order pages and reports can read them
+instead of re-aggregating items and payments on every view. A change of
+payment status reopens the closed P&L periods of the order (see
+period_close.py).
+
+Orders written by other apps (e.g. the cashier portal) can be brought back
+in line with `flask reconcile-order-totals`, which should also run
+periodically (e.g. nightly from cron).
+"""
+
+from decimal import Decimal
+from sqlalchemy import bindparam, event, inspect, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from extensions import db
+from models import Order, OrderItem, Payment
+from order_queries import ORDER_TOTAL_FIELDS, order_totals_query
+from period_close import reopen_order_periods
+from report_cache import record_table_writes
+
+
+# Columns whose change affects an order's figures
+_WATCHED_COLUMNS = {
+    Payment: ('orderid', 'amount', 'payment_status'),
+    OrderItem: ('orderid', 'quantity', 'final_price', 'buying_price', 'original_price',
+                'product_name', 'branch_productid'),
+}
+
+_STORED_FIELDS = ORDER_TOTAL_FIELDS + ('payment_status',)
+
+_CENT = Decimal('0.01')
+
+RECONCILE_BATCH_SIZE = 1000
+
+
+def payment_status_for(total_amount, total_paid):
+    """Payment status of an order given its total and completed payments"""
+    if total_paid >= total_amount:
+        return 'paid'
+    elif total_paid > 0:
+        return 'partially_paid'
+    return 'not_paid'
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(_CENT)
+
+
+def _stored(field, value):
+    """Normalize a figure the way its column stores it, for comparison"""
+    if field == 'item_count':
+        return int(value or 0)
+    if field == 'payment_status':
+        return value
+    return _money(value)
+
+
+def refresh_order_totals(connection, order_ids, session=None):
+    """
+    Recompute and store the figures and payment status of the given orders,
+    and reopen the closed P&L periods of those whose payment status changed.
+
+    Args:
+        connection: Connection (or session) to run the statements on
+        order_ids: Orders to refresh
+        session: Session whose loaded Order objects should see the new values,
+            and whose commit invalidates the reports cached on orders
+
+    Returns:
+        int: Number of orders whose stored figures changed
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return 0
+
+    current = {
+        row[0]: row[1:] for row in connection.execute(
+            select(Order.id, *(getattr(Order, field) for field in _STORED_FIELDS))
+            .where(Order.id.in_(order_ids))
+        )
+    }
+
+    changes = []
+    status_changed = []  # Paid orders count in the P&L, so these reopen closed periods
+    for order_id, *figures in connection.execute(order_totals_query(order_ids)):
+        values = {field: _stored(field, value) for field, value in zip(ORDER_TOTAL_FIELDS, figures)}
+        values['payment_status'] = payment_status_for(values['total_amount'], values['total_paid'])
+        stored = tuple(None if value is None else _stored(field, value)
+                       for field, value in zip(_STORED_FIELDS, current[order_id]))
+        if stored != tuple(values[field] for field in _STORED_FIELDS):
+            changes.append(dict(values, order_id=order_id))
+            if stored[-1] != values['payment_status']:
+                status_changed.append(order_id)
+
+    if not changes:
+        return 0
+
+    connection.execute(
+        update(Order.__table__)
+        .where(Order.__table__.c.id == bindparam('order_id'))
+        .values({field: bindparam(field) for field in _STORED_FIELDS}),
+        changes
+    )
+    if status_changed:
+        reopen_order_periods(connection, status_changed, session)
+    if session is not None:
+        # The Core update bypasses the flush, so the report cache must be told
+        record_table_writes(session, {Order.__tablename__})
+        # Keep already-loaded orders consistent without marking them dirty
+        for values in changes:
+            order = session.identity_map.get(identity_key(Order, values['order_id']))
+            if order is not None:
+                for field in _STORED_FIELDS:
+                    set_committed_value(order, field, values[field])
+
+    return len(changes)
+
+
+def _order_ids(obj):
+    """Current and previous order of a payment or item (a move touches both)"""
+    state = inspect(obj)
+    ids = {state.dict.get('orderid')} | set(state.attrs.orderid.history.deleted or ())
+    ids.discard(None)
+    return ids
+
+
+def _touched_orders(session):
+    """Collect the orders whose figures may change with this flush"""
+    order_ids = set()
+    for obj in list(session.new) + list(session.deleted):
+        if type(obj) in _WATCHED_COLUMNS:
+            order_ids |= _order_ids(obj)
+    for obj in session.dirty:
+        columns = _WATCHED_COLUMNS.get(type(obj))
+        if columns and any(inspect(obj).attrs[name].history.has_changes() for name in columns):
+            order_ids |= _order_ids(obj)
+    return order_ids
+
+
+def _after_flush(session, flush_context):
+    order_ids = _touched_orders(session)
+    if order_ids:
+        refresh_order_totals(session.connection(), sorted(order_ids), session)
+
+
+event.listen(db.session, 'after_flush', _after_flush)
+
+
+def reconcile_order_totals(batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Recompute the figures and payment status of every order, in batches.
+
+    Also fills in the columns of orders created before they existed or by
+    other apps.
+
+    Returns:
+        int: Number of orders that were corrected
+    """
+    changed = 0
+    last_id = 0
+    while True:
+        order_ids = db.session.execute(
+            select(Order.id).where(Order.id > last_id).order_by(Order.id).limit(batch_size)
+        ).scalars().all()
+        if not order_ids:
+            break
+        changed += refresh_order_totals(db.session, order_ids, db.session)
+        db.session.commit()
+        last_id = order_ids[-1]
+    return changed
@@ -0,0 +1,215 @@
+"""
+Order Queries
+
+Read-side helpers for order pages. Per-order totals, profit and payments are
+computed in SQL with grouped subqueries, so listing a page of orders doesn't
+require loading every OrderItem -> BranchProduct -> ProductCatalog row.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import func, case, and_, select
+from extensions import db
+from models import EAT, BranchProduct, Order, OrderItem, Payment
+from timezones import eat_day_start
+
+
+ORDER_TOTAL_FIELDS = ('total_amount', 'total_cost', 'total_profit', 'total_paid', 'item_count')
+
+
+@dataclass
+class OrderTotals:
+    """Computed figures for one order (same names as the Order columns)"""
+    total_amount: Decimal = Decimal('0')
+    total_cost: Decimal = Decimal('0')
+    total_profit: Decimal = Decimal('0')
+    total_paid: Decimal = Decimal('0')
+    item_count: int = 0
+
+
+def _is_set(column):
+    """SQL equivalent of a truthy price (not NULL and not zero)"""
+    return and_(column.isnot(None), column != 0)
+
+
+def item_total():
+    """
+    Line total of an order item, with the same fallback as the order pages:
+    final_price, then the branch product's selling price, then the original
+    price of manually entered items.
+
+    Requires BranchProduct to be outer-joined on OrderItem.branch_productid.
+    """
+    return case(
+        (_is_set(OrderItem.final_price), OrderItem.final_price * OrderItem.quantity),
+        (_is_set(BranchProduct.sellingprice), BranchProduct.sellingprice * OrderItem.quantity),
+        (and_(OrderItem.product_name.isnot(None), OrderItem.product_name != '',
+              _is_set(OrderItem.original_price)), OrderItem.original_price * OrderItem.quantity),
+        else_=0
+    )
+
+
+def item_cost():
+    """Cost of an order item at the buying price recorded on the item"""
+    return case(
+        (_is_set(OrderItem.buying_price), OrderItem.buying_price * OrderItem.quantity),
+        else_=0
+    )
+
+
+def item_profit():
+    """Profit of an order item; items missing either price contribute nothing"""
+    return case(
+        (and_(_is_set(OrderItem.final_price), _is_set(OrderItem.buying_price)),
+         (OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity),
+        else_=0
+    )
+
+
+def order_items_subquery(order_ids=None):
+    """Per-order total amount, cost, profit and item count, optionally limited to order_ids"""
+    query = select(
+        OrderItem.orderid.label('orderid'),
+        func.coalesce(func.sum(item_total()), 0).label('total_amount'),
+        func.coalesce(func.sum(item_cost()), 0).label('total_cost'),
+        func.coalesce(func.sum(item_profit()), 0).label('total_profit'),
+        func.count(OrderItem.id).label('item_count')
+    ).outerjoin(BranchProduct, OrderItem.branch_productid == BranchProduct.id)
+    if order_ids is not None:
+        query = query.where(OrderItem.orderid.in_(order_ids))
+    return query.group_by(OrderItem.orderid).subquery()
+
+
+def order_payments_subquery(order_ids=None):
+    """Per-order sum of completed payments, optionally limited to order_ids"""
+    query = select(
+        Payment.orderid.label('orderid'),
+        func.coalesce(func.sum(Payment.amount), 0).label('total_paid')
+    ).where(Payment.payment_status == 'completed')
+    if order_ids is not None:
+        query = query.where(Payment.orderid.in_(order_ids))
+    return query.group_by(Payment.orderid).subquery()
+
+
+def order_totals_query(order_ids):
+    """Select (Order.id, *ORDER_TOTAL_FIELDS) computed from items and payments"""
+    items = order_items_subquery(order_ids)
+    payments = order_payments_subquery(order_ids)
+    return select(
+        Order.id,
+        func.coalesce(items.c.total_amount, 0),
+        func.coalesce(items.c.total_cost, 0),
+        func.coalesce(items.c.total_profit, 0),
+        func.coalesce(payments.c.total_paid, 0),
+        func.coalesce(items.c.item_count, 0)
+    ).outerjoin(items, items.c.orderid == Order.id).outerjoin(
+        payments, payments.c.orderid == Order.id
+    ).where(Order.id.in_(order_ids))
+
+
+def get_order_totals(order_ids, connection=None):
+    """
+    Compute total amount, cost, profit, completed payments and item count
+    for the given orders from their items and payments.
+
+    Args:
+        order_ids: Iterable of order IDs (typically one page of orders)
+        connection: Connection to use (defaults to the current session)
+
+    Returns:
+        dict: {order_id: OrderTotals}, with an entry for every requested order
+    """
+    order_ids = list(order_ids)
+    totals = {order_id: OrderTotals() for order_id in order_ids}
+    if not order_ids:
+        return totals
+
+    connection = connection if connection is not None else db.session
+    for order_id, *figures in connection.execute(order_totals_query(order_ids)):
+        totals[order_id] = OrderTotals(*figures)
+    return totals
+
+
+def get_order_figures(orders):
+    """
+    Figures of already loaded orders, read from the denormalized Order columns.
+
+    Orders whose columns haven't been computed yet (e.g. created by another
+    app since the last `flask reconcile-order-totals`) are computed in SQL.
+
+    Returns:
+        dict: {order_id: OrderTotals}
+    """
+    figures = {}
+    missing = []
+    for order in orders:
+        if order.total_amount is None:
+            missing.append(order.id)
+        else:
+            figures[order.id] = OrderTotals(*(getattr(order, field) or 0 for field in ORDER_TOTAL_FIELDS))
+    figures.update(get_order_totals(missing))
+    return figures
+
+
+@dataclass
+class OrderStats:
+    """Header figures of the orders list for the active filters"""
+    total_orders: int = 0
+    paid_orders: int = 0
+    pending_orders: int = 0
+    total_revenue: Decimal = Decimal('0')
+    total_profit: Decimal = Decimal('0')
+    monthly_profit: Decimal = Decimal('0')
+
+
+def order_list_filters(status_filter='', payment_filter='', branch_filter=None):
+    """
+    WHERE clauses of the orders list filters, shared by the page query and its
+    statistics so they always describe the same set of orders.
+    """
+    filters = []
+    if status_filter == 'approved':
+        filters.append(Order.approvalstatus == True)
+    elif status_filter == 'pending':
+        filters.append(Order.approvalstatus == False)
+    if payment_filter:
+        filters.append(Order.payment_status == payment_filter)
+    if branch_filter:
+        filters.append(Order.branchid == branch_filter)
+    return filters
+
+
+def get_order_stats(filters, now=None):
+    """
+    Compute the orders list statistics in a single pass over orders joined to
+    their items, with conditional aggregates.
+
+    Revenue and profit only count paid and partially paid orders, and items
+    with the prices they need.
+
+    Args:
+        filters: WHERE clauses from order_list_filters()
+        now: Reference time for the monthly figure (defaults to now)
+
+    Returns:
+        OrderStats
+    """
+    now = now or datetime.now(EAT)
+    month_start = eat_day_start(now.replace(day=1))
+
+    sold = and_(Order.payment_status.in_(['paid', 'partially_paid']), OrderItem.final_price.isnot(None))
+    with_profit = and_(sold, OrderItem.buying_price.isnot(None))
+    profit = (OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity
+
+    row = db.session.execute(
+        select(
+            func.count(func.distinct(Order.id)),
+            func.count(func.distinct(case((Order.payment_status == 'paid', Order.id)))),
+            func.count(func.distinct(case((Order.approvalstatus == False, Order.id)))),
+            func.coalesce(func.sum(case((sold, OrderItem.quantity * OrderItem.final_price))), 0),
+            func.coalesce(func.sum(case((with_profit, profit))), 0),
+            func.coalesce(func.sum(case((and_(with_profit, Order.created_at >= month_start), profit))), 0)
+        ).select_from(Order).outerjoin(OrderItem, OrderItem.orderid == Order.id).where(*filters)
+    ).one()
+    return OrderStats(*row)
@@ -0,0 +1,398 @@
+"""
+Period Close
+
+This module keeps closed-period snapshots of the profit & loss components
+per branch in the `profit_loss_close` table, so a P&L for any range reads a
+few pre-aggregated rows per metric instead of scanning every order item and
+expense of the range.
+
+`flask close-profit-loss` (run daily) closes every complete month, plus the
+complete days since the start of the previous month. Each closed period has
+one row per branch and metric:
+
+- revenue, cogs: item revenue and cost of paid/partially paid orders
+- orders, paid_orders: order counts
+- product: quantity and revenue per product name (key)
+- expense_category: approved expenses per category (key)
+- closed: marker row, present once the period is closed
+
+get_profit_loss() serves whole closed months and closed days from the table
+and computes the remaining edges of the range live, with the same queries
+the close uses. A write that touches a closed period (order, order item or
+expense) reopens it from an `after_flush` hook, so it is served live until
+the next close. Payments change the P&L only through the order's payment
+status, which order_accounting rewrites outside the flush; it reopens the
+periods of the orders whose status changed with reopen_order_periods().
+Closed periods keep the buying prices they were closed with.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import event, func, case, inspect, select, tuple_
+from extensions import db
+from models import EAT, BranchProduct, Expense, Order, OrderItem, ProductCatalog, ProfitLossClose
+from report_cache import record_table_writes
+from timezones import eat_day_range, to_eat
+
+
+PAID_STATUSES = ('paid', 'partially_paid')
+
+# Columns whose change affects a closed period
+_WATCHED_COLUMNS = {
+    Order: ('created_at', 'branchid', 'payment_status'),
+    OrderItem: ('orderid', 'branch_productid', 'quantity', 'final_price', 'buying_price'),
+    Expense: ('amount', 'category', 'expense_date', 'status', 'branch_id'),
+}
+
+
+@dataclass
+class ExpenseCategory:
+    category: str
+    total_amount: Decimal = Decimal('0')
+    count: int = 0
+
+
+@dataclass
+class TopProduct:
+    name: str
+    total_quantity: Decimal = Decimal('0')
+    total_revenue: Decimal = Decimal('0')
+
+
+@dataclass
+class ProfitLoss:
+    """P&L components of a date range"""
+    total_revenue: Decimal = Decimal('0')
+    total_cogs: Decimal = Decimal('0')
+    total_expenses: Decimal = Decimal('0')
+    total_orders: int = 0
+    paid_orders: int = 0
+    expenses_by_category: list = field(default_factory=list)  # ExpenseCategory, highest first
+    top_products: list = field(default_factory=list)  # TopProduct, best selling first
+    closed_periods: int = 0  # Periods served from the close table
+    live_ranges: int = 0  # Edges computed from raw rows
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _period_figures(connection, start_day, end_day, branch_id=None):
+    """
+    Compute the P&L components from raw rows for start_day to end_day (inclusive).
+
+    Returns:
+        list: (branch_id, metric, key, amount, quantity, count) tuples
+    """
+    start, end = eat_day_range(start_day, end_day)
+    in_period = [Order.created_at >= start, Order.created_at < end]
+    expense_filters = [Expense.status == 'approved', Expense.expense_date >= start_day, Expense.expense_date <= end_day]
+    if branch_id:
+        in_period.append(Order.branchid == branch_id)
+        expense_filters.append(Expense.branch_id == branch_id)
+    paid = Order.payment_status.in_(PAID_STATUSES)
+    revenue = OrderItem.quantity * OrderItem.final_price
+    cost = OrderItem.quantity * func.coalesce(BranchProduct.buyingprice, OrderItem.buying_price, 0)
+
+    rows = []
+    for branch, orders, paid_orders in connection.execute(
+        select(Order.branchid, func.count(Order.id), func.count(case((paid, Order.id))))
+        .where(*in_period).group_by(Order.branchid)
+    ):
+        rows.append((branch, 'orders', '', 0, 0, orders))
+        rows.append((branch, 'paid_orders', '', 0, 0, paid_orders))
+
+    for branch, name, quantity, product_revenue, product_cost in connection.execute(
+        select(
+            Order.branchid,
+            ProductCatalog.name,
+            func.coalesce(func.sum(OrderItem.quantity), 0),
+            func.coalesce(func.sum(revenue), 0),
+            func.coalesce(func.sum(cost), 0)
+        ).select_from(OrderItem).outerjoin(
+            BranchProduct, OrderItem.branch_productid == BranchProduct.id
+        ).outerjoin(
+            ProductCatalog, BranchProduct.catalog_id == ProductCatalog.id
+        ).join(Order, OrderItem.orderid == Order.id)
+        .where(paid, *in_period).group_by(Order.branchid, ProductCatalog.name)
+    ):
+        rows.append((branch, 'revenue', '', product_revenue, 0, 0))
+        rows.append((branch, 'cogs', '', product_cost, 0, 0))
+        rows.append((branch, 'product', name or '', product_revenue, quantity, 0))
+
+    for branch, category, amount, count in connection.execute(
+        select(Expense.branch_id, Expense.category, func.sum(Expense.amount), func.count(Expense.id))
+        .where(*expense_filters).group_by(Expense.branch_id, Expense.category)
+    ):
+        rows.append((branch, 'expense_category', category, amount, 0, count))
+    return rows
+
+
+def close_period(connection, period, period_start, now=None):
+    """
+    Write (or rewrite) the snapshot rows of one period.
+
+    Args:
+        connection: Connection (or session) to write with
+        period: 'month' or 'day'
+        period_start: First day of the period
+        now: Close time (defaults to the current time in EAT)
+
+    Returns:
+        int: Number of rows written
+    """
+    period_end = _next_month(period_start) - timedelta(days=1) if period == 'month' else period_start
+    table = ProfitLossClose.__table__
+    closed_at = now or datetime.now(EAT)
+
+    # Products and revenue/cogs come one row per product; sum them per branch and key
+    figures = {}
+    for branch, metric, key, amount, quantity, count in _period_figures(connection, period_start, period_end):
+        totals = figures.setdefault((branch, metric, key), [0, 0, 0])
+        totals[0] += amount or 0
+        totals[1] += quantity or 0
+        totals[2] += count or 0
+    rows = [
+        dict(period=period, period_start=period_start, branch_id=branch, metric=metric, key=key,
+             amount=amount, quantity=quantity, count=count, closed_at=closed_at)
+        for (branch, metric, key), (amount, quantity, count) in figures.items()
+    ]
+    rows.append(dict(period=period, period_start=period_start, branch_id=None, metric='closed', key='',
+                     amount=0, quantity=0, count=0, closed_at=closed_at))
+
+    connection.execute(table.delete().where(table.c.period == period, table.c.period_start == period_start))
+    connection.execute(table.insert(), rows)
+    record_table_writes(db.session, {table.name})
+    return len(rows)
+
+
+def close_profit_loss_periods(now=None):
+    """
+    Close every complete month and the complete days since the start of the
+    previous month that aren't closed yet, and drop older daily rows (their
+    months are closed). Commits after each period.
+
+    Returns:
+        int: Number of periods closed
+    """
+    now = to_eat(now or datetime.now(EAT))
+    today = now.date()
+    daily_from = _month_start(_month_start(today) - timedelta(days=1))
+
+    first_order = db.session.execute(select(func.min(Order.created_at))).scalar()
+    first_expense = db.session.execute(select(func.min(Expense.expense_date))).scalar()
+    first_days = [day for day in (to_eat(first_order).date() if first_order else None, first_expense) if day]
+    if not first_days:
+        return 0
+
+    closed = set(db.session.execute(
+        select(ProfitLossClose.period, ProfitLossClose.period_start).where(ProfitLossClose.metric == 'closed')
+    ).all())
+    periods = []
+    month = _month_start(min(first_days))
+    while month < _month_start(today):
+        periods.append(('month', month))
+        month = _next_month(month)
+    day = max(min(first_days), daily_from)
+    while day < today:
+        periods.append(('day', day))
+        day += timedelta(days=1)
+
+    count = 0
+    for period, period_start in periods:
+        if (period, period_start) in closed:
+            continue
+        close_period(db.session, period, period_start, now)
+        db.session.commit()
+        count += 1
+
+    table = ProfitLossClose.__table__
+    db.session.execute(table.delete().where(table.c.period == 'day', table.c.period_start < daily_from))
+    record_table_writes(db.session, {table.name})
+    db.session.commit()
+    return count
+
+
+def _plan(start_day, end_day, closed):
+    """
+    Split a range into closed periods and live (start, end) ranges, preferring
+    whole closed months over days.
+    """
+    periods, live = [], []
+    day = start_day
+    while day <= end_day:
+        month_end = _next_month(day) - timedelta(days=1)
+        if day.day == 1 and month_end <= end_day and ('month', day) in closed:
+            periods.append(('month', day))
+            day = month_end + timedelta(days=1)
+        elif ('day', day) in closed:
+            periods.append(('day', day))
+            day += timedelta(days=1)
+        else:
+            if live and live[-1][1] == day - timedelta(days=1):
+                live[-1] = (live[-1][0], day)
+            else:
+                live.append((day, day))
+            day += timedelta(days=1)
+    return periods, live
+
+
+def get_profit_loss(start_day, end_day, branch_id=None, top=10):
+    """
+    P&L components from start_day to end_day (inclusive).
+
+    Args:
+        start_day: First day of the range
+        end_day: Last day of the range
+        branch_id: Only this branch (expenses without a branch are excluded)
+        top: Number of top products to return
+
+    Returns:
+        ProfitLoss
+    """
+    closed = set(db.session.execute(
+        select(ProfitLossClose.period, ProfitLossClose.period_start).where(
+            ProfitLossClose.metric == 'closed',
+            ProfitLossClose.period_start >= _month_start(start_day),
+            ProfitLossClose.period_start <= end_day
+        )
+    ).all())
+    periods, live = _plan(start_day, end_day, closed)
+
+    figures = []
+    if periods:
+        query = select(
+            ProfitLossClose.metric, ProfitLossClose.key,
+            func.sum(ProfitLossClose.amount), func.sum(ProfitLossClose.quantity), func.sum(ProfitLossClose.count)
+        ).where(
+            tuple_(ProfitLossClose.period, ProfitLossClose.period_start).in_(periods),
+            ProfitLossClose.metric != 'closed'
+        )
+        if branch_id:
+            query = query.where(ProfitLossClose.branch_id == branch_id)
+        figures += db.session.execute(query.group_by(ProfitLossClose.metric, ProfitLossClose.key)).all()
+    for live_start, live_end in live:
+        figures += [row[1:] for row in _period_figures(db.session, live_start, live_end, branch_id)]
+
+    report = ProfitLoss(closed_periods=len(periods), live_ranges=len(live))
+    expenses, products = {}, {}
+    for metric, key, amount, quantity, count in figures:
+        amount, quantity, count = amount or 0, quantity or 0, count or 0
+        if metric == 'revenue':
+            report.total_revenue += amount
+        elif metric == 'cogs':
+            report.total_cogs += amount
+        elif metric == 'orders':
+            report.total_orders += count
+        elif metric == 'paid_orders':
+            report.paid_orders += count
+        elif metric == 'expense_category':
+            expense = expenses.setdefault(key, ExpenseCategory(key))
+            expense.total_amount += amount
+            expense.count += count
+            report.total_expenses += amount
+        elif metric == 'product':
+            product = products.setdefault(key, TopProduct(key or None))
+            product.total_quantity += quantity
+            product.total_revenue += amount
+
+    report.expenses_by_category = sorted(expenses.values(), key=lambda expense: expense.total_amount, reverse=True)
+    report.top_products = sorted(products.values(), key=lambda product: product.total_quantity, reverse=True)[:top]
+    return report
+
+
+# --- Reopening on write ---------------------------------------------------
+
+def _values(obj, column):
+    """Current and previous value of a column (a change touches both)"""
+    state = inspect(obj)
+    values = {state.dict.get(column)} | set(state.attrs[column].history.deleted or ())
+    values.discard(None)
+    return values
+
+
+def _changed(obj, columns):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in columns)
+
+
+def _touched_days(session):
+    """Collect the EAT days whose P&L the objects of this flush change"""
+    days = set()
+    order_ids = set()
+
+    touched = [(obj, False) for obj in session.new] + [(obj, False) for obj in session.deleted]
+    touched += [(obj, True) for obj in session.dirty]
+    for obj, dirty in touched:
+        model = type(obj)
+        if model not in _WATCHED_COLUMNS:
+            continue
+        if dirty and not _changed(obj, _WATCHED_COLUMNS[model]):
+            continue
+
+        if model is Expense:
+            days |= _values(obj, 'expense_date')
+        elif model is Order:
+            days |= {to_eat(moment).date() for moment in _values(obj, 'created_at')}
+        else:
+            order_ids |= _values(obj, 'orderid')
+
+    return days | _order_days(session, order_ids)
+
+
+def _order_days(connection, order_ids):
+    """EAT days the given orders were created on"""
+    if not order_ids:
+        return set()
+    return {
+        to_eat(created_at).date()
+        for created_at in connection.execute(select(Order.created_at).where(Order.id.in_(order_ids))).scalars()
+        if created_at
+    }
+
+
+def _reopen(connection, session, days):
+    """Delete the closed day and month rows of the given days"""
+    periods = {('day', day) for day in days} | {('month', _month_start(day)) for day in days}
+    table = ProfitLossClose.__table__
+    connection.execute(table.delete().where(tuple_(table.c.period, table.c.period_start).in_(sorted(periods))))
+    record_table_writes(session, {table.name})
+
+
+def reopen_order_periods(connection, order_ids, session=None):
+    """
+    Reopen the closed periods of the given orders, e.g. after their payment
+    status was rewritten without a flush.
+
+    Args:
+        connection: Connection (or session) to run the statements on
+        order_ids: Orders whose P&L figures changed
+        session: Session whose commit invalidates the reports cached on the
+            close table (defaults to db.session)
+    """
+    days = _order_days(connection, list(order_ids))
+    if days:
+        _reopen(connection, session if session is not None else db.session, days)
+
+
+def _after_flush(session, flush_context):
+    """Reopen the closed periods touched by this flush"""
+    try:
+        days = _touched_days(session)
+        if not days:
+            return
+
+        # Run in a savepoint so a failure never aborts the caller's write
+        connection = session.connection()
+        with connection.begin_nested():
+            _reopen(connection, session, days)
+    except Exception as e:
+        print(f"⚠️ Reopening closed P&L periods failed: {e}")
+
+
+event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,152 @@
+"""
+Query Fanout
+
+This module runs independent read-only SQLAlchemy statements concurrently,
+each on its own pooled connection, so a report page costs roughly as long as
+its slowest query instead of the sum of all of them.
+
+Statements run outside the request's session: they only see committed data
+and must select columns (ORM entities are returned as plain rows).
+
+Usage:
+    fanout = QueryFanout('profit_loss')
+    fanout.scalar('total_revenue', select(func.sum(Payment.amount)))
+    fanout.all('expenses_by_category', select(Expense.category, func.sum(Expense.amount))
+               .group_by(Expense.category))
+    results = fanout.run()
+    results['total_revenue'], fanout.timings['total_revenue']
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from extensions import db
+from tracing import get_tracer
+
+
+_trace = get_tracer('query_fanout')
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+_FETCH = {
+    'scalar': lambda result: result.scalar(),
+    'one': lambda result: result.one(),
+    'all': lambda result: result.all(),
+    'scalars': lambda result: result.scalars().all(),
+}
+
+
+def _pool_size(engine):
+    """Number of connections the engine keeps pooled (QueuePool), default 4"""
+    try:
+        return max(1, engine.pool.size())
+    except AttributeError:
+        return 4
+
+
+def get_executor(engine):
+    """
+    Get the process-wide thread pool, sized to the engine's connection pool.
+
+    The pool is (re)created lazily per process, since uWSGI forks workers
+    after the app is imported and threads don't survive a fork.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=_pool_size(engine),
+                thread_name_prefix='query-fanout'
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _execute(engine, statement, fetch):
+    """Run one statement on its own connection; returns (value, seconds)"""
+    start = time.perf_counter()
+    with engine.connect() as connection:
+        value = _FETCH[fetch](connection.execute(statement))
+    return value, time.perf_counter() - start
+
+
+class QueryFanout:
+    """A named set of independent statements executed concurrently"""
+
+    def __init__(self, label='fanout'):
+        self.label = label
+        self.statements = {}
+        self.timings = {}
+        self.errors = {}
+
+    def add(self, name, statement, fetch='all'):
+        if fetch not in _FETCH:
+            raise ValueError(f"Unknown fetch mode: {fetch}")
+        self.statements[name] = (statement, fetch)
+        return self
+
+    def scalar(self, name, statement):
+        return self.add(name, statement, 'scalar')
+
+    def one(self, name, statement):
+        return self.add(name, statement, 'one')
+
+    def all(self, name, statement):
+        return self.add(name, statement, 'all')
+
+    def scalars(self, name, statement):
+        return self.add(name, statement, 'scalars')
+
+    def run(self, raise_errors=True):
+        """
+        Execute every statement and wait for all of them.
+
+        Args:
+            raise_errors: Re-raise the first failure; when False, failed
+                statements are left out of the results and listed in errors
+
+        Returns:
+            dict: {name: fetched value}
+        """
+        engine = db.engine
+        start = time.perf_counter()
+
+        if len(self.statements) > 1:
+            executor = get_executor(engine)
+            futures = {
+                name: executor.submit(_execute, engine, statement, fetch)
+                for name, (statement, fetch) in self.statements.items()
+            }
+            outcomes = {}
+            for name, future in futures.items():
+                try:
+                    outcomes[name] = future.result()
+                except Exception as e:
+                    self.errors[name] = e
+        else:
+            outcomes = {}
+            for name, (statement, fetch) in self.statements.items():
+                try:
+                    outcomes[name] = _execute(engine, statement, fetch)
+                except Exception as e:
+                    self.errors[name] = e
+
+        results = {}
+        for name, (value, seconds) in outcomes.items():
+            results[name] = value
+            self.timings[name] = seconds
+
+        elapsed = time.perf_counter() - start
+        if self.timings and _trace.enabled('info'):
+            slowest = max(self.timings, key=self.timings.get)
+            _trace.info('fanout', label=self.label, queries=len(self.statements),
+                        duration_ms=round(elapsed * 1000, 1), slowest=slowest,
+                        slowest_ms=round(self.timings[slowest] * 1000, 1))
+
+        for name, error in self.errors.items():
+            _trace.error('fanout_query_failed', label=self.label, query=name, error=str(error))
+            if raise_errors:
+                raise error
+        return results
@@ -0,0 +1,203 @@
+"""
+Query Statistics
+
+This module instruments the SQL each Flask request runs: query count, total
+database time, the slowest statements and the statements executed again and
+again with different parameters, the signature of N+1 loops (one query per
+order, per salesperson, per product, ...).
+
+- Statements are timed with the engine's before/after_cursor_execute events
+  and grouped by fingerprint: the SQL with literals, parameters and IN lists
+  collapsed, so `WHERE orderid = 1` and `WHERE orderid = 2` match.
+- A fingerprint executed QUERY_STATS_N_PLUS_ONE times or more in one request
+  is flagged as repeated and traced (tracer 'query_stats').
+- In debug mode (or with QUERY_STATS_HEADER set) responses carry an
+  `X-Query-Stats: queries=..; db_ms=..; repeated=..` header.
+- Every request is also added to an in-memory table per endpoint, viewable
+  by admins at /query_stats. The table is per worker process.
+
+Statements run by query_fanout threads are outside the request and are not
+counted.
+"""
+
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+from tracing import get_tracer
+
+_trace = get_tracer('query_stats')
+
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\?|:\w+|\$\d+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """SQL with whitespace, literals and parameter lists normalised"""
+    statement = _STRING.sub('?', statement)
+    statement = _PARAMETER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _LIST.sub('(?)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+class RequestQueries:
+    """Statements executed during one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}  # {fingerprint: [executions, seconds]}
+        self.slowest = []  # (seconds, statement), slowest first
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        entry = self.statements.setdefault(fingerprint(statement), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        if len(self.slowest) < Config.QUERY_STATS_SLOWEST or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, statement))
+            self.slowest.sort(key=lambda slow: slow[0], reverse=True)
+            del self.slowest[Config.QUERY_STATS_SLOWEST:]
+
+    def repeated(self, threshold=None):
+        """
+        Fingerprints executed at least `threshold` times (N+1 candidates).
+
+        Returns:
+            list: (fingerprint, executions, seconds) tuples, most executed first
+        """
+        threshold = threshold or Config.QUERY_STATS_N_PLUS_ONE
+        return sorted(
+            ((statement, executions, seconds)
+             for statement, (executions, seconds) in self.statements.items()
+             if executions >= threshold),
+            key=lambda entry: entry[1], reverse=True
+        )
+
+
+@dataclass
+class EndpointQueryStats:
+    """Queries of all requests to one endpoint since the worker started"""
+    endpoint: str
+    requests: int = 0
+    queries: int = 0
+    seconds: float = 0.0
+    max_queries: int = 0
+    repeated_requests: int = 0  # Requests with an N+1 candidate
+    repeated: dict = field(default_factory=dict)  # {fingerprint: max executions in a request}
+    slowest: list = field(default_factory=list)  # (seconds, statement), slowest first
+
+    @property
+    def avg_queries(self):
+        return self.queries / self.requests if self.requests else 0
+
+    @property
+    def avg_ms(self):
+        return self.seconds * 1000 / self.requests if self.requests else 0
+
+    @property
+    def total_ms(self):
+        return self.seconds * 1000
+
+    def add(self, queries, repeated):
+        self.requests += 1
+        self.queries += queries.count
+        self.seconds += queries.seconds
+        self.max_queries = max(self.max_queries, queries.count)
+        if repeated:
+            self.repeated_requests += 1
+        for statement, executions, _ in repeated:
+            self.repeated[statement] = max(self.repeated.get(statement, 0), executions)
+        self.slowest = sorted(self.slowest + queries.slowest,
+                              key=lambda slow: slow[0], reverse=True)[:Config.QUERY_STATS_SLOWEST]
+
+
+_endpoints = {}  # {endpoint: EndpointQueryStats}
+_endpoints_lock = threading.Lock()
+_started_at = time.time()
+
+
+def current_queries():
+    """RequestQueries of the current request, or None outside requests"""
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_queries() is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_stats_start', None)
+    queries = current_queries()
+    if start is not None and queries is not None:
+        queries.record(statement, time.perf_counter() - start)
+
+
+if Config.QUERY_STATS_ENABLED:
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def get_query_stats():
+    """
+    Per-endpoint query statistics of this worker.
+
+    Returns:
+        dict: started_at, pid and endpoints (EndpointQueryStats, most
+            database time first)
+    """
+    with _endpoints_lock:
+        endpoints = sorted(_endpoints.values(), key=lambda stats: stats.seconds, reverse=True)
+    return {'started_at': _started_at, 'pid': os.getpid(), 'endpoints': endpoints}
+
+
+def reset_query_stats():
+    global _started_at
+    with _endpoints_lock:
+        _endpoints.clear()
+        _started_at = time.time()
+
+
+def init_query_stats(app):
+    """Collect the queries of each request and add them to the endpoint table"""
+    if not Config.QUERY_STATS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_query_stats():
+        g.query_stats = RequestQueries()
+
+    @app.after_request
+    def _end_query_stats(response):
+        queries = g.get('query_stats')
+        if queries is None or request.endpoint is None or request.endpoint == 'static':
+            return response
+
+        repeated = queries.repeated()
+        for statement, executions, seconds in repeated:
+            _trace.info('repeated_statement', executions=executions,
+                        db_ms=round(seconds * 1000, 1), statement=statement[:300])
+        with _endpoints_lock:
+            stats = _endpoints.get(request.endpoint)
+            if stats is None:
+                stats = _endpoints[request.endpoint] = EndpointQueryStats(request.endpoint)
+            stats.add(queries, repeated)
+
+        if app.debug or Config.QUERY_STATS_HEADER:
+            response.headers['X-Query-Stats'] = (
+                f"queries={queries.count}; db_ms={queries.seconds * 1000:.1f}; repeated={len(repeated)}"
+            )
+        return response
@@ -0,0 +1,408 @@
+"""
+Report Cache
+
+This module provides a versioned read-through cache for the expensive report
+and dashboard pages.
+
+Each cached page is keyed by endpoint + user + normalized query args + the
+current data version of every table the page reads. Versions are bumped from
+SQLAlchemy `after_commit` listeners for the tables written in that
+transaction, so an entry stops being served as soon as relevant data changes
+and unrelated writes leave it alone.
+
+Entries live in an in-process LRU (bounded size and TTL). When
+REPORT_CACHE_URL points to a Redis server, versions and entries are also
+shared between uWSGI workers, so a P&L computed by one worker is served by
+all of them.
+
+Usage:
+    @app.route('/profit_loss')
+    @login_required
+    @role_required(['admin'])
+    @cached_report(Order, OrderItem, Expense)
+    def profit_loss():
+        ...
+
+Query results shared by several pages are cached the same way with
+cached_result(), e.g. the category statistics of category_stats.py, and
+small lookup data that rarely changes is kept per worker with TableSnapshot
+(category_tree.py, branch_directory.py).
+
+Code writing with Core statements instead of the ORM records the tables it
+wrote with record_table_writes().
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, make_response, g, has_app_context
+from flask_login import current_user
+from sqlalchemy import event
+from extensions import db
+from config import Config
+
+
+class MemoryBackend:
+    """Thread-safe LRU with a per-entry TTL, local to the worker process"""
+
+    def __init__(self, max_entries=256, ttl=120):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}  # Kept apart from entries so eviction never resets a version
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Shared backend for all workers; requires the `redis` package"""
+
+    def __init__(self, url, ttl=120, prefix='abz:report:'):
+        import redis  # Optional dependency, only needed when REPORT_CACHE_URL is set
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or self.ttl)
+
+    def get_counters(self, keys):
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class ReportCache:
+    """Two-tier cache (local LRU, optional shared backend) with table versions"""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    @property
+    def versions(self):
+        """
+        Backend holding the table version counters.
+
+        Without a shared backend each worker only sees its own commits, so
+        another worker may serve a page up to REPORT_CACHE_TTL old.
+        """
+        return self.shared or self.local
+
+    def table_versions(self, tables):
+        """Current version of each table, in the order given"""
+        keys = [f'version:{table}' for table in tables]
+        try:
+            return self.versions.get_counters(keys)
+        except Exception as e:
+            print(f"⚠️ Report cache version lookup failed: {e}")
+            return None
+
+    def bump(self, tables):
+        """Invalidate every entry depending on any of the given tables"""
+        for table in tables:
+            try:
+                self.versions.incr(f'version:{table}')
+            except Exception as e:
+                print(f"⚠️ Report cache version bump failed for {table}: {e}")
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                print(f"⚠️ Report cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                print(f"⚠️ Report cache write failed: {e}")
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+def _create_cache():
+    local = MemoryBackend(Config.REPORT_CACHE_MAX_ENTRIES, Config.REPORT_CACHE_TTL)
+    shared = None
+    if Config.REPORT_CACHE_URL:
+        try:
+            shared = RedisBackend(Config.REPORT_CACHE_URL, Config.REPORT_CACHE_TTL)
+        except Exception as e:
+            print(f"⚠️ Shared report cache unavailable, using in-process cache only: {e}")
+    return ReportCache(local, shared)
+
+
+report_cache = _create_cache()
+
+
+# Tables rendered on every page through the context processors (branch
+# dropdown, current user's name), so every cached page depends on them
+_BASE_TABLES = ('branch', 'users')
+
+
+def _table_name(model):
+    return model if isinstance(model, str) else model.__tablename__
+
+
+def _normalized_args():
+    """Query args as a sorted tuple, ignoring blank values"""
+    args = ((name, tuple(value for value in request.args.getlist(name) if value != ''))
+            for name in request.args)
+    return tuple(sorted((name, values) for name, values in args if values))
+
+
+def _set_client_cache(response, max_age):
+    if max_age is not None:
+        response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    return response
+
+
+def cached_report(*models, ttl=None, max_age=None):
+    """
+    Cache the rendered output of a GET view.
+
+    Args:
+        *models: Models (or table names) the page reads
+        ttl: Entry lifetime in seconds (defaults to REPORT_CACHE_TTL)
+        max_age: When set, browsers may also reuse the response for this
+            many seconds (Cache-Control: private)
+
+    Pages are not cached when flash messages are pending (they would be
+    rendered into the page), when the view redirects or fails, or when the
+    cache is disabled with REPORT_CACHE_ENABLED.
+    """
+    tables = tuple(sorted(set(_BASE_TABLES) | {_table_name(model) for model in models}))
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not Config.REPORT_CACHE_ENABLED or request.method != 'GET' or '_flashes' in session:
+                return f(*args, **kwargs)
+
+            versions = report_cache.table_versions(tables)
+            if versions is None:
+                return _set_client_cache(make_response(f(*args, **kwargs)), max_age)
+
+            key = repr((
+                request.endpoint,
+                current_user.get_id(),
+                tuple(sorted(kwargs.items())),
+                _normalized_args(),
+                tuple(zip(tables, versions)),
+            ))
+            cached = report_cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                response = make_response(body)
+                response.mimetype = mimetype
+                response.headers['X-Report-Cache'] = 'hit'
+                return _set_client_cache(response, max_age)
+
+            response = make_response(f(*args, **kwargs))
+            if (response.status_code == 200 and not response.direct_passthrough
+                    and '_flashes' not in session):
+                report_cache.set(key, (response.get_data(), response.mimetype), ttl)
+                response.headers['X-Report-Cache'] = 'miss'
+                _set_client_cache(response, max_age)
+            return response
+        return decorated_function
+    return decorator
+
+
+def cached_result(name, models, compute, *args, ttl=None):
+    """
+    Cache the return value of a query function shared by several pages.
+
+    Entries are keyed like cached_report() pages, by name + arguments + the
+    current version of every table read, so the same commits invalidate them.
+    Values must be picklable when a shared backend is configured (plain
+    dataclasses, not ORM objects).
+
+    Args:
+        name: Name of the cached function, e.g. 'category_stats'
+        models: Models (or table names) the function reads
+        compute: Function called with *args on a miss
+        *args: Arguments of compute (dates, IDs), part of the key
+        ttl: Entry lifetime in seconds (defaults to REPORT_CACHE_TTL)
+    """
+    if not Config.REPORT_CACHE_ENABLED:
+        return compute(*args)
+
+    tables = tuple(sorted({_table_name(model) for model in models}))
+    versions = report_cache.table_versions(tables)
+    if versions is None:
+        return compute(*args)
+
+    key = repr(('result', name, args, tuple(zip(tables, versions))))
+    value = report_cache.get(key)
+    if value is None:
+        value = compute(*args)
+        report_cache.set(key, value, ttl)
+    return value
+
+
+class TableSnapshot:
+    """
+    Immutable value derived from rarely written tables (the category tree,
+    the branch directory), built once per worker and shared by its requests.
+
+    The value is tagged with the versions of the tables it was built from
+    and rebuilt once a write to one of them commits. Versions are shared
+    between workers with REPORT_CACHE_URL; without it a worker only sees its
+    own writes, so values are also rebuilt every REPORT_CACHE_TTL seconds.
+    Within a request the value is looked up once (kept on flask.g).
+    """
+
+    def __init__(self, name, models, build, default=None):
+        """
+        Args:
+            name: Name of the snapshot, e.g. 'category_tree'
+            models: Models (or table names) build() reads
+            build: Function returning the (immutable) value
+            default: Value returned when the first build fails
+        """
+        self.name = name
+        self.tables = tuple(sorted({_table_name(model) for model in models}))
+        self.build = build
+        self.default = default
+        self._lock = threading.Lock()
+        self._cached = None  # (versions, built_at, value)
+
+    def get(self):
+        if not has_app_context():
+            return self._current()
+        values = g.setdefault('table_snapshots', {})
+        if self.name not in values:
+            values[self.name] = self._current()
+        return values[self.name]
+
+    def _fresh(self, cached, versions):
+        return (cached is not None and versions is not None and cached[0] == versions
+                and (report_cache.shared is not None
+                     or time.monotonic() - cached[1] < Config.REPORT_CACHE_TTL))
+
+    def _current(self):
+        versions = report_cache.table_versions(self.tables)
+        cached = self._cached
+        if self._fresh(cached, versions):
+            return cached[2]
+
+        with self._lock:
+            if self._cached is not cached and self._fresh(self._cached, versions):
+                return self._cached[2]  # Rebuilt by another thread meanwhile
+            try:
+                value = self.build()
+            except Exception as e:
+                print(f"⚠️ {self.name} rebuild failed: {e}")
+                db.session.rollback()
+                return cached[2] if cached is not None else self.default
+            # Not kept while this session holds uncommitted writes to the tables
+            written = db.session.info.get('report_cache_tables', set())
+            if versions is not None and written.isdisjoint(self.tables):
+                self._cached = (versions, time.monotonic(), value)
+            return value
+
+
+# --- Invalidation ---------------------------------------------------------
+
+def record_table_writes(session, tables):
+    """
+    Record tables written in the session's transaction, so their versions are
+    bumped when it commits.
+
+    Flushed ORM objects and query.update()/delete() are recorded
+    automatically; Core statements (e.g. the after_flush maintenance of
+    order_accounting.py and dashboard_snapshot.py) must call this.
+    """
+    session.info.setdefault('report_cache_tables', set()).update(tables)
+
+
+def _after_flush(session, flush_context):
+    """Remember which tables this transaction wrote to"""
+    record_table_writes(session, {
+        obj.__table__.name
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if hasattr(obj, '__table__')
+    })
+
+
+def _after_bulk_write(update_context):
+    """query.update()/query.delete() bypass the flush, record them here"""
+    record_table_writes(update_context.session, {update_context.mapper.local_table.name})
+
+
+def _after_commit(session):
+    """Bump the versions of the written tables once the outer transaction commits"""
+    if session.in_nested_transaction():
+        return
+    tables = session.info.pop('report_cache_tables', None)
+    if tables:
+        report_cache.bump(sorted(tables))
+        if has_app_context():
+            g.pop('table_snapshots', None)  # Look the snapshots up again in this request
+
+
+def _after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('report_cache_tables', None)
+
+
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'after_bulk_update', _after_bulk_write)
+event.listen(db.session, 'after_bulk_delete', _after_bulk_write)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,262 @@
+"""
+Daily Sales Rollup
+
+This module maintains the `daily_sales_rollup` table: one row per branch and
+day with the completed payments of that day (count and revenue) and the
+profit, cost of goods and quantity of the orders they paid, so the sales
+report reads a few hundred pre-aggregated rows for any range instead of
+scanning payments and order items on every request.
+
+Figures follow the sales report: a day is the Africa/Nairobi date of
+Payment.created_at (see timezones.py), and each completed payment carries the item profit, cost and quantity of its
+order (items with both a final and a buying price).
+
+Rows are refreshed from an `after_flush` hook for the (branch, day) pairs a
+Payment, OrderItem or Order change touches. Payments written outside this
+app (e.g. the cashier portal) are picked up by `flask
+refresh-daily-sales-rollup`, which recomputes the most recent days and
+should run from cron (e.g. every 5 minutes), and by `flask
+rebuild-daily-sales-rollup`, which also fills the table after deploying.
+Readers never write to the table.
+"""
+
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, func, inspect, select, and_, or_, true, tuple_
+from extensions import db
+from config import Config
+from models import EAT, DailySalesRollup, Order, OrderItem, Payment
+from dashboard_stats import sum_if
+from report_cache import record_table_writes
+from timezones import eat_date, eat_day_range, to_eat
+
+
+ROLLUP_FIELDS = ('payment_count', 'revenue', 'profit', 'cogs', 'items')
+
+# Columns whose change affects the rollup
+_WATCHED_COLUMNS = {
+    Payment: ('orderid', 'amount', 'payment_status', 'created_at'),
+    OrderItem: ('orderid', 'quantity', 'final_price', 'buying_price'),
+    Order: ('branchid',),
+}
+
+
+def _as_date(value):
+    """Normalize a DATE() result (SQLite returns strings)"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _payment_day():
+    return eat_date(Payment.created_at)
+
+
+def _day_range(start_day, end_day):
+    start, end = eat_day_range(start_day, end_day)
+    return and_(Payment.created_at >= start, Payment.created_at < end)
+
+
+def _rollup_figures(connection, payment_filter):
+    """
+    Aggregate completed payments matching payment_filter by (branch, day).
+
+    Order figures are aggregated per order first, so joining them to the
+    payments doesn't multiply rows.
+
+    Returns:
+        dict: {(branch_id, day): {field: value}}
+    """
+    priced = and_(OrderItem.final_price.isnot(None), OrderItem.buying_price.isnot(None))
+    paid_orders = select(Payment.orderid).where(Payment.payment_status == 'completed', payment_filter)
+    order_figures = select(
+        OrderItem.orderid.label('orderid'),
+        sum_if(priced, (OrderItem.final_price - OrderItem.buying_price) * OrderItem.quantity).label('profit'),
+        sum_if(priced, OrderItem.buying_price * OrderItem.quantity).label('cogs'),
+        func.coalesce(func.sum(OrderItem.quantity), 0).label('quantity')
+    ).where(OrderItem.orderid.in_(paid_orders)).group_by(OrderItem.orderid).subquery()
+
+    day = _payment_day()
+    rows = connection.execute(
+        select(
+            Order.branchid,
+            day,
+            func.count(Payment.id),
+            func.coalesce(func.sum(Payment.amount), 0),
+            func.coalesce(func.sum(order_figures.c.profit), 0),
+            func.coalesce(func.sum(order_figures.c.cogs), 0),
+            func.coalesce(func.sum(order_figures.c.quantity), 0)
+        ).select_from(Payment).join(Order, Payment.orderid == Order.id)
+        .outerjoin(order_figures, order_figures.c.orderid == Payment.orderid)
+        .where(Payment.payment_status == 'completed', payment_filter)
+        .group_by(Order.branchid, day)
+    )
+    return {
+        (branch_id, _as_date(row_day)): dict(zip(ROLLUP_FIELDS, figures))
+        for branch_id, row_day, *figures in rows
+    }
+
+
+def _write_rows(connection, keys, figures):
+    """Replace the rollup rows of the given (branch, day) keys"""
+    rollup = DailySalesRollup.__table__
+    now = datetime.now(EAT).replace(tzinfo=None)
+    if keys:
+        connection.execute(rollup.delete().where(tuple_(rollup.c.branch_id, rollup.c.day).in_(sorted(keys))))
+    rows = [dict(values, branch_id=branch_id, day=day, updated_at=now)
+            for (branch_id, day), values in sorted(figures.items())]
+    if rows:
+        connection.execute(rollup.insert(), rows)
+    record_table_writes(db.session, {DailySalesRollup.__tablename__})
+    return len(rows)
+
+
+def refresh_sales_rollup(connection, keys):
+    """
+    Recompute the rollup rows of the given (branch_id, day) pairs.
+
+    Returns:
+        int: Number of rows written (days without completed payments have none)
+    """
+    keys = {(branch_id, day) for branch_id, day in keys if branch_id is not None and day is not None}
+    if not keys:
+        return 0
+
+    branches_by_day = {}
+    for branch_id, day in keys:
+        branches_by_day.setdefault(day, set()).add(branch_id)
+    payment_filter = or_(*(
+        and_(_day_range(day, day), Payment.orderid.in_(
+            select(Order.id).where(Order.branchid.in_(sorted(branch_ids)))
+        ))
+        for day, branch_ids in sorted(branches_by_day.items())
+    ))
+
+    figures = _rollup_figures(connection, payment_filter)
+    return _write_rows(connection, keys, {key: values for key, values in figures.items() if key in keys})
+
+
+def refresh_sales_rollup_range(connection, start_day, end_day):
+    """Recompute every rollup row from start_day to end_day (inclusive)"""
+    rollup = DailySalesRollup.__table__
+    figures = _rollup_figures(connection, _day_range(start_day, end_day))
+    connection.execute(rollup.delete().where(rollup.c.day >= start_day, rollup.c.day <= end_day))
+    return _write_rows(connection, (), figures)
+
+
+def rebuild_sales_rollup(connection=None):
+    """
+    Recompute the whole rollup table from payments and order items.
+
+    Returns:
+        int: Number of rows written
+    """
+    connection = connection if connection is not None else db.session
+    figures = _rollup_figures(connection, true())
+    connection.execute(DailySalesRollup.__table__.delete())
+    return _write_rows(connection, (), figures)
+
+
+def refresh_recent_sales_rollup(connection=None, now=None):
+    """
+    Recompute the last SALES_ROLLUP_RECENT_DAYS days, to pick up payments
+    written outside this app.
+
+    Returns:
+        int: Number of rows written
+    """
+    connection = connection if connection is not None else db.session
+    today = to_eat(now or datetime.now(EAT)).date()
+    return refresh_sales_rollup_range(connection, today - timedelta(days=Config.SALES_ROLLUP_RECENT_DAYS - 1), today)
+
+
+def get_sales_rollup(start_day, end_day, branch_id=None):
+    """
+    Daily sales between two dates (inclusive), summed over branches unless
+    branch_id is given.
+
+    Returns:
+        list: Rows with day and the ROLLUP_FIELDS, oldest first
+    """
+    query = db.session.query(
+        DailySalesRollup.day,
+        *(func.sum(getattr(DailySalesRollup, field)).label(field) for field in ROLLUP_FIELDS)
+    ).filter(DailySalesRollup.day >= start_day, DailySalesRollup.day <= end_day)
+    if branch_id:
+        query = query.filter(DailySalesRollup.branch_id == branch_id)
+    return query.group_by(DailySalesRollup.day).order_by(DailySalesRollup.day).all()
+
+
+# --- Maintenance on write -------------------------------------------------
+
+def _values(obj, column):
+    """Current and previous value of a column (a change touches both)"""
+    state = inspect(obj)
+    values = {state.dict.get(column)} | set(state.attrs[column].history.deleted or ())
+    values.discard(None)
+    return values
+
+
+def _changed(obj, columns):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in columns)
+
+
+def _touched_keys(session):
+    """Collect the (branch_id, day) pairs affected by the objects of this flush"""
+    keys = set()
+    payment_days = {}  # order id -> days of changed payments (current and previous)
+    item_orders = set()
+    moved_orders = {}  # order id -> current and previous branches
+
+    touched = [(obj, False) for obj in session.new] + [(obj, False) for obj in session.deleted]
+    touched += [(obj, True) for obj in session.dirty]
+    for obj, dirty in touched:
+        model = type(obj)
+        if model not in _WATCHED_COLUMNS:
+            continue
+        if dirty and not _changed(obj, _WATCHED_COLUMNS[model]):
+            continue
+
+        if model is Payment:
+            days = {to_eat(moment).date() for moment in _values(obj, 'created_at')}
+            for order_id in _values(obj, 'orderid'):
+                payment_days.setdefault(order_id, set()).update(days)
+        elif model is OrderItem:
+            item_orders |= _values(obj, 'orderid')
+        elif dirty:
+            moved_orders[obj.id] = _values(obj, 'branchid')
+
+    if payment_days:
+        for order_id, branch_id in session.execute(
+            select(Order.id, Order.branchid).where(Order.id.in_(payment_days))
+        ):
+            keys |= {(branch_id, day) for day in payment_days[order_id]}
+
+    # Item and branch changes affect every day the order was paid on
+    order_ids = item_orders | set(moved_orders)
+    if order_ids:
+        day = _payment_day()
+        for order_id, branch_id, paid_day in session.execute(
+            select(Order.id, Order.branchid, day).join(Payment, Payment.orderid == Order.id)
+            .where(Order.id.in_(order_ids), Payment.payment_status == 'completed')
+            .distinct()
+        ):
+            for branch in moved_orders.get(order_id, {branch_id}) | {branch_id}:
+                keys.add((branch, _as_date(paid_day)))
+    return keys
+
+
+def _after_flush(session, flush_context):
+    """Refresh the rollup rows touched by this flush"""
+    try:
+        keys = _touched_keys(session)
+        if not keys:
+            return
+
+        # Run in a savepoint so a rollup failure never aborts the caller's write
+        connection = session.connection()
+        with connection.begin_nested():
+            refresh_sales_rollup(connection, keys)
+    except Exception as e:
+        print(f"⚠️ Sales rollup refresh failed: {e}")
+
+
+event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,217 @@
+"""
+Salesperson Statistics
+
+This module computes the sales performance figures (orders, approved orders
+and completed-payment revenue) of every salesperson in one grouped query,
+with optional branch and date filters, instead of two extra queries per
+salesperson. A per-day breakdown for trend sparklines is one more grouped
+query, whatever the number of salespeople or days.
+
+The drilldown of a single salesperson's orders is paginated and loads a
+page's orders, items and payments with a fixed number of batched queries.
+"""
+
+from dataclasses import dataclass, field, asdict
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import func, case, select
+from extensions import db
+from models import User, Order, OrderItem, Payment, BranchProduct, ProductCatalog
+from order_queries import item_profit
+from timezones import eat_date
+
+
+@dataclass
+class SalespersonStats:
+    """Figures for a single salesperson over the selected period"""
+    id: int
+    firstname: str
+    lastname: str
+    email: str
+    total_orders: int = 0
+    completed_orders: int = 0
+    total_revenue: Decimal = Decimal('0')
+    trend: list = field(default_factory=list)  # Daily revenue, oldest first (when requested)
+
+    @property
+    def completed_revenue(self):
+        """Revenue from completed payments (the only revenue counted)"""
+        return self.total_revenue
+
+    def as_dict(self):
+        return dict(asdict(self), completed_revenue=self.completed_revenue)
+
+
+def _period_filters(start_datetime, end_datetime, branch_id=None):
+    filters = [Order.created_at >= start_datetime, Order.created_at < end_datetime]
+    if branch_id:
+        filters.append(Order.branchid == branch_id)
+    return filters
+
+
+def _day_key(value):
+    """Normalize a DATE() result (SQLite returns strings)"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def get_salesperson_stats(start_datetime, end_datetime, branch_id=None, daily=False):
+    """
+    Compute sales performance for every salesperson with orders in the period.
+
+    Orders are joined to their payments once; order counts use COUNT(DISTINCT)
+    so an order with several payments is counted once, and revenue only sums
+    completed payments.
+
+    Args:
+        start_datetime: Start of the period (inclusive)
+        end_datetime: End of the period (exclusive)
+        branch_id: Only count orders of this branch
+        daily: Also fill in `trend` with the revenue of every day in the period
+
+    Returns:
+        list: SalespersonStats, highest revenue first
+    """
+    filters = _period_filters(start_datetime, end_datetime, branch_id)
+    completed_amount = case((Payment.payment_status == 'completed', Payment.amount))
+
+    rows = db.session.execute(
+        select(
+            User.id,
+            User.firstname,
+            User.lastname,
+            User.email,
+            func.count(func.distinct(Order.id)),
+            func.count(func.distinct(case((Order.approvalstatus.is_(True), Order.id)))),
+            func.coalesce(func.sum(completed_amount), 0)
+        ).join(Order, User.id == Order.userid)
+        .outerjoin(Payment, Payment.orderid == Order.id)
+        .where(*filters)
+        .group_by(User.id, User.firstname, User.lastname, User.email)
+    )
+    stats = {row[0]: SalespersonStats(*row) for row in rows}
+
+    if daily and stats:
+        days = [start_datetime.date() + timedelta(days=offset)
+                for offset in range((end_datetime.date() - start_datetime.date()).days)]
+        revenue_by_day = {}
+        order_date = eat_date(Order.created_at)
+        for user_id, order_day, revenue in db.session.execute(
+            select(Order.userid, order_date, func.coalesce(func.sum(completed_amount), 0))
+            .join(Payment, Payment.orderid == Order.id)
+            .where(*filters)
+            .group_by(Order.userid, order_date)
+        ):
+            revenue_by_day[(user_id, _day_key(order_day))] = revenue
+        for user_id, salesperson in stats.items():
+            salesperson.trend = [revenue_by_day.get((user_id, day), 0) for day in days]
+
+    return sorted(stats.values(), key=lambda salesperson: salesperson.total_revenue, reverse=True)
+
+
+@dataclass
+class SalespersonOrders:
+    """One page of a salesperson's orders plus the figures for the whole period"""
+    pagination: object
+    orders: list  # [{'order', 'order_items', 'order_revenue', 'order_profit', 'payment_status', 'total_paid', 'payments'}]
+    total_orders: int = 0
+    completed_orders: int = 0
+    total_revenue: Decimal = Decimal('0')
+    total_profit: Decimal = Decimal('0')
+
+
+def _drilldown_figures(order_ids):
+    """Per-order revenue (final prices), profit, completed payments and payment count"""
+    items = select(
+        OrderItem.orderid.label('orderid'),
+        func.coalesce(func.sum(OrderItem.quantity * OrderItem.final_price), 0).label('revenue'),
+        func.coalesce(func.sum(item_profit()), 0).label('profit')
+    ).where(OrderItem.orderid.in_(order_ids)).group_by(OrderItem.orderid).subquery()
+    payments = select(
+        Payment.orderid.label('orderid'),
+        func.coalesce(func.sum(case((Payment.payment_status == 'completed', Payment.amount))), 0).label('total_paid'),
+        func.count(Payment.id).label('payment_count')
+    ).where(Payment.orderid.in_(order_ids)).group_by(Payment.orderid).subquery()
+    return items, payments
+
+
+def get_salesperson_orders(user_id, start_datetime, end_datetime, branch_id=None, page=1, per_page=20):
+    """
+    Load the order drilldown of a salesperson.
+
+    Queries: period figures (one grouped query), the page of orders with
+    their revenue, profit and payment status (one query), then the page's
+    items and payments with one IN query each.
+
+    Args:
+        user_id: Salesperson
+        start_datetime: Start of the period (inclusive)
+        end_datetime: End of the period (exclusive)
+        branch_id: Only orders of this branch
+        page: Page number (1-based)
+        per_page: Orders per page
+
+    Returns:
+        SalespersonOrders
+    """
+    filters = [Order.userid == user_id] + _period_filters(start_datetime, end_datetime, branch_id)
+    items, payments = _drilldown_figures(select(Order.id).where(*filters))
+    revenue = func.coalesce(items.c.revenue, 0)
+    profit = func.coalesce(items.c.profit, 0)
+    total_paid = func.coalesce(payments.c.total_paid, 0)
+    payment_status = case(
+        (payments.c.payment_count.is_(None), 'pending'),
+        (total_paid >= revenue, 'completed'),
+        (total_paid > 0, 'partially_paid'),
+        else_='pending'
+    )
+
+    def with_figures(*columns):
+        return db.session.query(*columns).select_from(Order).outerjoin(
+            items, items.c.orderid == Order.id
+        ).outerjoin(payments, payments.c.orderid == Order.id).filter(*filters)
+
+    total_orders, completed_orders, total_revenue, total_profit = with_figures(
+        func.count(Order.id),
+        func.count(case((Order.approvalstatus.is_(True), Order.id))),
+        func.coalesce(func.sum(payments.c.total_paid), 0),
+        func.coalesce(func.sum(items.c.profit), 0)
+    ).one()
+
+    # The total is known from the figures above, so paginate() doesn't count
+    pagination = with_figures(
+        Order,
+        revenue.label('order_revenue'),
+        profit.label('order_profit'),
+        payment_status.label('payment_status'),
+        total_paid.label('total_paid')
+    ).order_by(Order.created_at.desc(), Order.id.desc()).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
+    )
+    pagination.total = total_orders
+
+    order_ids = [row.Order.id for row in pagination.items]
+    items_by_order = {order_id: [] for order_id in order_ids}
+    payments_by_order = {order_id: [] for order_id in order_ids}
+    if order_ids:
+        for item in db.session.query(OrderItem, BranchProduct, ProductCatalog).outerjoin(
+            BranchProduct, OrderItem.branch_productid == BranchProduct.id
+        ).outerjoin(
+            ProductCatalog, BranchProduct.catalog_id == ProductCatalog.id
+        ).filter(OrderItem.orderid.in_(order_ids)).order_by(OrderItem.id):
+            items_by_order[item.OrderItem.orderid].append(item)
+        for payment in Payment.query.filter(Payment.orderid.in_(order_ids)).order_by(Payment.id):
+            payments_by_order[payment.orderid].append(payment)
+
+    orders = [
+        {
+            'order': row.Order,
+            'order_items': items_by_order[row.Order.id],
+            'order_revenue': row.order_revenue,
+            'order_profit': row.order_profit,
+            'payment_status': row.payment_status,
+            'total_paid': row.total_paid,
+            'payments': payments_by_order[row.Order.id],
+        }
+        for row in pagination.items
+    ]
+    return SalespersonOrders(pagination, orders, total_orders, completed_orders, total_revenue, total_profit)
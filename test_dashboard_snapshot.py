@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the incremental dashboard snapshot updates
+
+This script rebuilds the snapshot, then adds, edits and deletes a payment and
+checks after each step that the global snapshot row matches the figures
+computed from scratch. The edit and delete are made on an instance expired
+the way commit() expires it. Everything runs in one transaction that is
+rolled back at the end, so the database is left unchanged.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from models import BranchProduct, DashboardSnapshot, Expense, Order, OrderItem, Payment
+from extensions import db
+from dashboard_snapshot import SNAPSHOT_FIELDS, rebuild_dashboard_snapshot, _branch_figures, _totals
+from dashboard_stats import dashboard_periods
+
+def check_snapshot(step):
+    """Assert the global snapshot row equals a full recompute"""
+    _, this_month = dashboard_periods()
+    expected = _totals(_branch_figures(
+        db.session, this_month, orders=Order.id.isnot(None),
+        products=BranchProduct.id.isnot(None), expenses=Expense.id.isnot(None)
+    ))
+    row = db.session.execute(
+        db.select(DashboardSnapshot.__table__).where(DashboardSnapshot.branch_id.is_(None))
+    ).mappings().one()
+    for field in SNAPSHOT_FIELDS:
+        assert float(row[field] or 0) == float(expected[field] or 0), \
+            f"{step}: {field} is {row[field]} in the snapshot, {expected[field]} computed"
+    print(f"✅ {step}: revenue KSh {row['total_revenue']:,.2f}, profit KSh {row['total_profit']:,.2f}")
+
+def test_dashboard_snapshot():
+    """Test that payment writes keep the snapshot in line with a full recompute"""
+    with app.app_context():
+        try:
+            print("🧮 Testing Dashboard Snapshot Updates...")
+            print("=" * 50)
+
+            order = Order.query.join(OrderItem, OrderItem.orderid == Order.id).first()
+            if order is None:
+                print("⚠️ No order with items, nothing to test")
+                return
+
+            rebuild_dashboard_snapshot(db.session)
+            check_snapshot("Rebuild")
+
+            payment = Payment(orderid=order.id, userid=order.userid, amount=20, payment_method='cash',
+                              payment_status='completed', notes='test_dashboard_snapshot')
+            db.session.add(payment)
+            db.session.flush()
+            check_snapshot("Add payment of 20")
+
+            # commit() expires every instance; expire instead so the test can roll back
+            db.session.expire_all()
+            payment.amount = 15
+            db.session.flush()
+            check_snapshot("Edit expired payment to 15")
+
+            db.session.expire_all()
+            db.session.delete(payment)
+            db.session.flush()
+            check_snapshot("Delete expired payment")
+
+            print("✅ Dashboard snapshot test completed!")
+
+        finally:
+            db.session.rollback()
+
+if __name__ == "__main__":
+    test_dashboard_snapshot()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that order totals and payment status follow writes
+
+This script pays an order, edits the payment and an item, then deletes the
+payment, and checks after each step that the stored Order figures and
+payment status match the figures computed from its items and payments. The
+edits are made on instances expired the way commit() expires them.
+Everything runs in one transaction that is rolled back at the end, so the
+database is left unchanged.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from models import Order, OrderItem, Payment
+from extensions import db
+from order_accounting import payment_status_for
+from order_queries import ORDER_TOTAL_FIELDS, order_totals_query
+
+def check_order(step, order_id):
+    """Assert the stored figures of an order equal a recompute"""
+    stored = db.session.execute(
+        db.select(Order.__table__).where(Order.id == order_id)
+    ).mappings().one()
+    expected = dict(zip(ORDER_TOTAL_FIELDS, db.session.execute(order_totals_query([order_id])).one()[1:]))
+    for field in ORDER_TOTAL_FIELDS:
+        assert float(stored[field] or 0) == float(expected[field] or 0), \
+            f"{step}: {field} is {stored[field]} stored, {expected[field]} computed"
+    status = payment_status_for(expected['total_amount'], expected['total_paid'])
+    assert stored['payment_status'] == status, f"{step}: payment status is {stored['payment_status']}, expected {status}"
+    print(f"✅ {step}: total KSh {stored['total_amount']:,.2f}, paid KSh {stored['total_paid']:,.2f}, "
+          f"{stored['payment_status']}")
+
+def test_order_accounting():
+    """Test that item and payment writes keep the order figures in line"""
+    with app.app_context():
+        try:
+            print("🧮 Testing Order Accounting...")
+            print("=" * 50)
+
+            item = OrderItem.query.filter(OrderItem.final_price > 0).first()
+            if item is None:
+                print("⚠️ No priced order item, nothing to test")
+                return
+            order = item.order
+            check_order("Before", order.id)
+
+            outstanding = (order.total_amount or 0) - (order.total_paid or 0)
+            payment = Payment(orderid=order.id, userid=order.userid, amount=outstanding, payment_method='cash',
+                              payment_status='completed', notes='test_order_accounting')
+            db.session.add(payment)
+            db.session.flush()
+            check_order("Pay the balance", order.id)
+
+            # commit() expires every instance; expire instead so the test can roll back
+            db.session.expire_all()
+            payment.amount = outstanding / 2
+            db.session.flush()
+            check_order("Halve the expired payment", order.id)
+
+            db.session.expire_all()
+            item.final_price = item.final_price + 10
+            db.session.flush()
+            check_order("Raise the expired item's price", order.id)
+
+            db.session.expire_all()
+            db.session.delete(payment)
+            db.session.flush()
+            check_order("Delete the expired payment", order.id)
+
+            print("✅ Order accounting test completed!")
+
+        finally:
+            db.session.rollback()
+
+if __name__ == "__main__":
+    test_order_accounting()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that paying an order reopens its closed P&L period
+
+This script closes the month of an unpaid order, pays the order and checks
+that get_profit_loss() for that month picks the payment up. Everything runs
+in one transaction that is rolled back at the end, so the database is left
+unchanged.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from models import EAT, Order, OrderItem, Payment
+from extensions import db
+from period_close import PAID_STATUSES, close_period, get_profit_loss, _month_start, _next_month
+from timezones import eat_day_start, to_eat
+from datetime import datetime, timedelta
+
+def test_period_close():
+    """Test that a payment reopens the closed month of its order"""
+    with app.app_context():
+        try:
+            print("🧮 Testing Period Close Reopening...")
+            print("=" * 50)
+
+            # An unpaid order with priced items from before this month
+            this_month = _month_start(datetime.now(EAT).date())
+            order = Order.query.join(OrderItem, OrderItem.orderid == Order.id).filter(
+                Order.created_at < eat_day_start(this_month),
+                Order.payment_status.notin_(PAID_STATUSES),
+                OrderItem.final_price > 0
+            ).first()
+            if order is None:
+                print("⚠️ No unpaid order with priced items before this month, nothing to test")
+                return
+
+            month = _month_start(to_eat(order.created_at).date())
+            month_end = _next_month(month) - timedelta(days=1)
+            close_period(db.session, 'month', month)
+            before = get_profit_loss(month, month_end)
+            print(f"Order #{order.id} from {month:%B %Y}: {order.payment_status}, total KSh {order.total_amount or 0:,.2f}")
+            print(f"Before payment: revenue KSh {before.total_revenue:,.2f}, paid orders {before.paid_orders}, "
+                  f"closed periods {before.closed_periods}")
+            assert before.closed_periods == 1, "the month should be served from the close table"
+
+            db.session.add(Payment(
+                orderid=order.id, userid=order.userid, amount=(order.total_amount or 0) - (order.total_paid or 0),
+                payment_method='cash', payment_status='completed', notes='test_period_close'
+            ))
+            db.session.flush()
+            print(f"After payment: order is {order.payment_status}")
+
+            after = get_profit_loss(month, month_end)
+            print(f"After payment: revenue KSh {after.total_revenue:,.2f}, paid orders {after.paid_orders}, "
+                  f"closed periods {after.closed_periods}")
+            assert order.payment_status in PAID_STATUSES, "the payment should mark the order paid"
+            assert after.closed_periods == 0, "the payment should reopen the month"
+            assert after.paid_orders == before.paid_orders + 1, "the order should count as paid"
+            assert after.total_revenue > before.total_revenue, "the order's revenue should be included"
+
+            print("✅ Period close test completed!")
+
+        finally:
+            db.session.rollback()
+
+if __name__ == "__main__":
+    test_period_close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the incremental daily sales rollup updates
+
+This script rebuilds the rollup, then adds, edits and deletes a payment and
+checks after each step that the rollup rows match the figures computed from
+scratch. The edit and delete are made on an instance expired the way
+commit() expires it. Everything runs in one transaction that is rolled back
+at the end, so the database is left unchanged.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import app
+from models import DailySalesRollup, Order, OrderItem, Payment
+from extensions import db
+from sales_rollup import ROLLUP_FIELDS, rebuild_sales_rollup, _rollup_figures
+from sqlalchemy import true
+
+def check_rollup(step):
+    """Assert the rollup rows equal a full recompute"""
+    expected = _rollup_figures(db.session, true())
+    stored = {
+        (row.branch_id, row.day): row
+        for row in db.session.execute(db.select(DailySalesRollup.__table__)).all()
+    }
+    assert set(stored) == set(expected), f"{step}: rows for {sorted(stored)}, expected {sorted(expected)}"
+    for key, values in expected.items():
+        for field in ROLLUP_FIELDS:
+            assert float(getattr(stored[key], field) or 0) == float(values[field] or 0), \
+                f"{step}: {field} of {key} is {getattr(stored[key], field)}, {values[field]} computed"
+    revenue = sum(values['revenue'] or 0 for values in expected.values())
+    print(f"✅ {step}: {len(stored)} rows, revenue KSh {revenue:,.2f}")
+
+def test_sales_rollup():
+    """Test that payment writes keep the rollup in line with a full recompute"""
+    with app.app_context():
+        try:
+            print("🧮 Testing Daily Sales Rollup Updates...")
+            print("=" * 50)
+
+            order = Order.query.join(OrderItem, OrderItem.orderid == Order.id).first()
+            if order is None:
+                print("⚠️ No order with items, nothing to test")
+                return
+
+            rebuild_sales_rollup(db.session)
+            check_rollup("Rebuild")
+
+            payment = Payment(orderid=order.id, userid=order.userid, amount=20, payment_method='cash',
+                              payment_status='completed', notes='test_sales_rollup')
+            db.session.add(payment)
+            db.session.flush()
+            check_rollup("Add payment of 20")
+
+            # commit() expires every instance; expire instead so the test can roll back
+            db.session.expire_all()
+            payment.amount = 15
+            db.session.flush()
+            check_rollup("Edit expired payment to 15")
+
+            db.session.expire_all()
+            db.session.delete(payment)
+            db.session.flush()
+            check_rollup("Delete expired payment")
+
+            print("✅ Daily sales rollup test completed!")
+
+        finally:
+            db.session.rollback()
+
+if __name__ == "__main__":
+    test_sales_rollup()
@@ -0,0 +1,71 @@
+"""
+Timezones
+
+This module is the single place that knows how timestamps relate to East
+Africa Time. Reporting timestamps (orders, payments, users, stock
+transactions, ...) are stored as `timestamptz` (see migrate_timestamptz.py),
+so the database knows the instant and Python never shifts rows by hand:
+
+- Range filters start at EAT midnight: eat_day_start() / eat_day_range()
+  return timezone-aware bounds that index range scans can use directly.
+- Grouping by day uses eat_date(column), the Africa/Nairobi calendar day of
+  the timestamp, computed in SQL.
+- Templates display timestamps in EAT with the `eat` filter (to_eat).
+"""
+
+from datetime import datetime, time, timedelta
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import Date
+from models import EAT
+
+EAT_ZONE = 'Africa/Nairobi'
+
+
+def to_eat(value):
+    """
+    Convert a timestamp to EAT (for display or to take its local date).
+
+    Naive values come from databases without time zones (SQLite in
+    development), which store EAT wall-clock time.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=EAT)
+    return value.astimezone(EAT)
+
+
+def eat_day_start(day):
+    """EAT midnight at the start of a date (or of a datetime's date)"""
+    if isinstance(day, datetime):
+        day = day.date()
+    return datetime.combine(day, time.min, tzinfo=EAT)
+
+
+def eat_day_range(start_day, end_day):
+    """
+    Bounds covering start_day to end_day (inclusive) in EAT.
+
+    Returns:
+        tuple: (start, end) for `column >= start` and `column < end` filters
+    """
+    return eat_day_start(start_day), eat_day_start(end_day) + timedelta(days=1)
+
+
+class eat_date(FunctionElement):
+    """Africa/Nairobi calendar day of a timestamp, e.g. eat_date(Payment.created_at)"""
+    type = Date()
+    name = 'eat_date'
+    inherit_cache = True
+
+
+@compiles(eat_date, 'postgresql')
+def _eat_date_postgresql(element, compiler, **kw):
+    return f"CAST(timezone('{EAT_ZONE}', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(eat_date)
+def _eat_date_default(element, compiler, **kw):
+    # Databases without time zones (SQLite in development) store EAT wall-clock time
+    return f"DATE({compiler.process(element.clauses, **kw)})"
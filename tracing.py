@@ -0,0 +1,167 @@
+"""
+Tracing
+
+This module replaces unconditional print debugging on hot paths with
+structured, leveled and sampled trace records.
+
+- Levels: debug, info, warning, error. Each named tracer (e.g.
+  'purchase_orders') has a threshold, TRACE_LEVEL by default, overridable
+  per tracer with TRACE_MODULES, e.g. "purchase_orders=debug,auth=warning".
+- Sampling: debug and info records are only emitted for sampled requests,
+  a TRACE_SAMPLE_RATE fraction of them, or any request sent with the
+  `X-Trace: 1` header. Warnings and errors are emitted for every request.
+  Outside requests (CLI commands) every enabled record is emitted.
+- Structure: one JSON object per line with the event name, tracer, level,
+  route, request id, milliseconds since the request started and the
+  fields passed by the caller (order_id, counts, timings, ...).
+
+Guard loops with enabled() so unsampled requests skip them entirely:
+
+    trace = get_tracer('purchase_orders')
+    trace.info('po_loaded', po_id=po.id, status=po.status)
+    if trace.enabled('debug'):
+        for item in po.items:
+            trace.debug('po_item', po_id=po.id, item_id=item.id, quantity=item.quantity)
+    with trace.span('render', po_id=po.id):
+        ...
+"""
+
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from flask import g, request, has_request_context
+from config import Config
+from models import EAT
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+_SAMPLED_BELOW = logging.WARNING  # Levels that need a sampled request
+
+_logger = logging.getLogger('abz.trace')
+if not _logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.DEBUG)
+    _logger.propagate = False
+
+
+def _parse_modules(value):
+    """'name=level,...' -> {name: logging level}"""
+    modules = {}
+    for entry in (value or '').split(','):
+        name, _, level = entry.partition('=')
+        if name.strip() and level.strip().lower() in LEVELS:
+            modules[name.strip()] = LEVELS[level.strip().lower()]
+    return modules
+
+
+_default_level = LEVELS.get(Config.TRACE_LEVEL.lower(), logging.INFO)
+_module_levels = _parse_modules(Config.TRACE_MODULES)
+
+
+def request_sampled():
+    """Whether debug/info records are emitted for the current request"""
+    if not has_request_context():
+        return True
+    return g.get('trace_sampled', False)
+
+
+class Tracer:
+    """Named source of trace records with its own level threshold"""
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def level(self):
+        return _module_levels.get(self.name, _default_level)
+
+    def enabled(self, level='debug'):
+        """Whether records of this level are emitted in the current request"""
+        level = LEVELS[level]
+        return level >= self.level and (level >= _SAMPLED_BELOW or request_sampled())
+
+    def log(self, level, event, exc_info=False, **fields):
+        if not self.enabled(level):
+            return
+        record = {
+            'ts': datetime.now(EAT).isoformat(timespec='milliseconds'),
+            'level': level,
+            'tracer': self.name,
+            'event': event,
+        }
+        if has_request_context():
+            record['route'] = request.endpoint
+            record['request_id'] = g.get('trace_id')
+            started = g.get('trace_started')
+            if started is not None:
+                record['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        record.update(fields)
+        _logger.log(LEVELS[level], json.dumps(record, default=str), exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event, **fields):
+        self.log('info', event, **fields)
+
+    def warning(self, event, **fields):
+        self.log('warning', event, **fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self.log('error', event, exc_info=exc_info, **fields)
+
+    @contextmanager
+    def span(self, event, level='debug', **fields):
+        """Time a block and emit one record with its duration_ms"""
+        if not self.enabled(level):
+            yield fields
+            return
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.log(level, event, duration_ms=round((time.perf_counter() - start) * 1000, 1), **fields)
+
+
+_tracers = {}
+
+
+def get_tracer(name):
+    """Tracer for a module or feature name (see TRACE_MODULES)"""
+    tracer = _tracers.get(name)
+    if tracer is None:
+        tracer = _tracers[name] = Tracer(name)
+    return tracer
+
+
+_request_tracer = get_tracer('request')
+
+
+def init_tracing(app):
+    """Decide request sampling and trace sampled requests' status and duration"""
+
+    @app.before_request
+    def _start_trace():
+        g.trace_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12]
+        g.trace_started = time.perf_counter()
+        g.trace_sampled = (request.headers.get('X-Trace') == '1'
+                           or (Config.TRACE_SAMPLE_RATE > 0 and random.random() < Config.TRACE_SAMPLE_RATE))
+
+    @app.after_request
+    def _end_trace(response):
+        if g.get('trace_sampled'):
+            _request_tracer.info('request', method=request.method, path=request.path,
+                                 status=response.status_code)
+            response.headers['X-Request-ID'] = g.trace_id
+        return response